@@ -0,0 +1,100 @@
+"""Compare the parallel archive builder with the serial ZIP_DEFLATED walk it replaced.
+
+The output tree resembles the one of the Blocking process: 12 png plots, 2 netcdf4 files and the logs, recipes and
+provenance files written by esmvaltool.
+
+Usage::
+
+    $ python benchmarks/bench_archive.py --netcdf-mb 200
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from c3s_magic_wps.archive import HDF5_SIGNATURE, build_archive
+
+PLOTS = ['Block', 'Block_Avg', 'DurationEvents', 'LongBlockEvents', 'BI', 'ACN', 'CN', 'MGI', 'Z500', 'Events',
+         'BlockEvents', 'Instantaneous']
+
+
+def generate_output(output_dir, netcdf_mb, plot_kb, log_mb):
+    """Write a synthetic Blocking output tree to `output_dir`."""
+    recipe_dir = os.path.join(output_dir, 'recipe_miles_block_20190101_120000')
+    plot_dir = os.path.join(recipe_dir, 'plots', 'miles_diagnostics', 'miles_block')
+    work_dir = os.path.join(recipe_dir, 'work', 'miles_diagnostics', 'miles_block')
+    run_dir = os.path.join(recipe_dir, 'run')
+    for path in (plot_dir, work_dir, run_dir):
+        os.makedirs(path)
+
+    # plots and netcdf4 files are compressed already, random data does not compress either
+    for name in PLOTS:
+        with open(os.path.join(plot_dir, '{}_ACCESS1-0_historical_r1i1p1_2000_2005_DJF.png'.format(name)), 'wb') as fp:
+            fp.write(os.urandom(plot_kb * 1024))
+    for name in ('BlockClim', 'BlockFull'):
+        with open(os.path.join(work_dir, '{}_ACCESS1-0_historical_r1i1p1_2000_2005_DJF.nc'.format(name)), 'wb') as fp:
+            fp.write(HDF5_SIGNATURE)
+            for _ in range(netcdf_mb):
+                fp.write(os.urandom(1024 * 1024))
+
+    line = '2019-01-01 12:00:00,000 UTC [1234] DEBUG   esmvaltool._task:123 Running task miles_block ...\n'
+    for name, size in (('main_log.txt', log_mb // 4 or 1), ('main_log_debug.txt', log_mb)):
+        with open(os.path.join(run_dir, name), 'w') as fp:
+            fp.write(line * (size * 1024 * 1024 // len(line)))
+    for name in ('recipe_miles_block.yml', 'settings.yml', 'metadata.yml', 'diagnostic_provenance.yml'):
+        with open(os.path.join(run_dir, name), 'w') as fp:
+            fp.write('key: value\n' * 2000)
+    return output_dir
+
+
+def _zip_deflated(output_dir, archive_file):
+    """The original compress_output, kept here as the baseline."""
+    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as ziph:
+        for root, dirs, files in os.walk(output_dir):
+            if 'preproc' not in root:
+                for file in files:
+                    path = os.path.join(root, file)
+                    arcname = os.path.relpath(path, output_dir)
+                    ziph.write(path, arcname)
+
+
+def _timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark creating the zip archive of a synthetic output tree.')
+    parser.add_argument('--netcdf-mb', type=int, default=50)
+    parser.add_argument('--plot-kb', type=int, default=300)
+    parser.add_argument('--log-mb', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='synthetic-output-')
+    try:
+        output_dir = generate_output(os.path.join(tmpdir, 'output'), args.netcdf_mb, args.plot_kb, args.log_mb)
+        archive_file = os.path.join(tmpdir, 'result.zip')
+
+        baseline = _timed(lambda: _zip_deflated(output_dir, archive_file), args.repeat)
+        baseline_size = os.path.getsize(archive_file)
+        parallel = _timed(lambda: build_archive(output_dir, archive_file, workers=args.workers), args.repeat)
+        with zipfile.ZipFile(archive_file) as zf:
+            assert zf.testzip() is None
+
+        print('serial ZIP_DEFLATED:  {:.3f}s ({:.1f} MB)'.format(baseline, baseline_size / 1024**2))
+        print('archive builder:      {:.3f}s ({:.1f} MB, {:.1f}x)'.format(
+            parallel, os.path.getsize(archive_file) / 1024**2, baseline / parallel))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
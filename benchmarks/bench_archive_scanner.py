@@ -0,0 +1,82 @@
+"""Compare the ArchiveScanner with the recursive listdir/isdir walk it replaced.
+
+Usage::
+
+    $ python benchmarks/bench_archive_scanner.py --models 20 --ensembles 5
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from c3s_magic_wps.processes.utils.archive_scanner import ArchiveScanner
+
+from synthetic_archive import generate_archive
+
+
+def _dir_entry(path, name):
+    """The original DataFinder scan, kept here as the baseline."""
+    result = dict()
+    result['name'] = name
+
+    contents = []
+    for dir in os.listdir(path):
+        subdir = os.path.join(path, dir)
+        if (os.path.isdir(subdir)):
+            contents.append(_dir_entry(subdir, dir))
+
+    if len(contents) > 0:
+        result['contents'] = contents
+
+    return result
+
+
+def _timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scanning a synthetic archive.')
+    parser.add_argument('--organizations', type=int, default=4)
+    parser.add_argument('--models', type=int, default=5)
+    parser.add_argument('--experiments', type=int, default=3)
+    parser.add_argument('--ensembles', type=int, default=3)
+    parser.add_argument('--variables', type=int, default=8)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='synthetic-cmip5-')
+    try:
+        generate_archive(root, args.organizations, args.models, args.experiments, args.ensembles, args.variables,
+                         args.files)
+
+        baseline, expected = _timed(lambda: _dir_entry(root, 'root'), args.repeat)
+
+        def full_scan():
+            scanner = ArchiveScanner(root, workers=args.workers)
+            scanner.scan()
+            return scanner
+
+        full, scanner = _timed(full_scan, args.repeat)
+        assert scanner.tree('root') == expected
+
+        incremental, _ = _timed(scanner.scan, args.repeat)
+
+        print('directories:          {}'.format(len(scanner.entries)))
+        print('listdir/isdir walk:   {:.4f}s'.format(baseline))
+        print('parallel scandir:     {:.4f}s ({:.1f}x)'.format(full, baseline / full))
+        print('incremental rescan:   {:.4f}s ({:.1f}x)'.format(incremental, baseline / incremental))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""End-to-end benchmarks of the service on a synthetic CMIP5 archive.
+
+Times scanning, indexing and querying the model data with the DataFinder, importing the processes, creating the app,
+DescribeProcess and meta requests, generating a recipe, finding an output and creating the archive of a result. The
+results are written as JSON with the version of the service, so they can be compared between releases.
+
+Usage::
+
+    $ python benchmarks/bench_service.py --models 10 --output results-1.0.0.json
+    $ python benchmarks/bench_service.py --models 10 --compare results-1.0.0.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic_archive import generate_archive
+
+from bench_archive import generate_output
+
+# timed in a fresh interpreter, the processes are imported when they are used for the first time
+_IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+from c3s_magic_wps.processes import processes
+len(processes)
+print(time.perf_counter() - start)
+"""
+
+
+def _timed(func, repeat, setup=None):
+    """Return the timings of `repeat` calls of `func`, `setup` is called untimed before every call."""
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        func(argument) if setup else func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _stats(timings):
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+        'repeat': len(timings),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_data_finder(root, repeat):
+    from c3s_magic_wps.processes.utils.archive_scanner import ArchiveScanner
+    from c3s_magic_wps.processes.utils.data_finder import DataFinder, _build_index
+
+    scanner = ArchiveScanner(root)
+    results = {'datafinder_scan': _timed(lambda scanner: scanner.scan(), repeat, setup=lambda: ArchiveScanner(root))}
+    scanner.scan()
+    results['datafinder_rescan'] = _timed(scanner.scan, repeat)
+    data = scanner.tree('root')
+    results['datafinder_index'] = _timed(lambda: _build_index(data), repeat)
+    finder = DataFinder.get_instance()
+    results['datafinder_query'] = _timed(lambda: finder.get_model_experiment_ensemble(['pr', 'tas'], 'mon'), repeat)
+    return results
+
+
+def bench_import(root, repeat):
+    env = dict(os.environ, CMIP_DATA_ROOT=root)
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _IMPORT_SCRIPT], env=env, stderr=subprocess.DEVNULL)
+        timings.append(float(output.decode().split()[-1]))
+    return {'import_processes': timings}
+
+
+def bench_service(repeat):
+    from werkzeug.test import Client
+    from werkzeug.wrappers import Response
+
+    from c3s_magic_wps import wsgi
+
+    results = {'create_app': _timed(wsgi.create_app, repeat)}
+
+    describe = '/wps?service=WPS&request=DescribeProcess&version=1.0.0&identifier=all'
+    meta = '/wps?service=WPS&request=Execute&version=1.0.0&identifier=meta&DataInputs=process=blocking'
+
+    def request(client, query):
+        response = client.get(query)
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    # a new app renders the descriptions, later requests are answered from the cache
+    results['describe_process'] = _timed(lambda client: request(client, describe), repeat,
+                                         setup=lambda: Client(wsgi.create_app(), Response))
+    client = Client(wsgi.create_app(), Response)
+    request(client, describe)
+    results['describe_process_cached'] = _timed(lambda: request(client, describe), repeat)
+    results['meta'] = _timed(lambda: request(client, meta), repeat)
+    return results
+
+
+def bench_runner(tmpdir, repeat, netcdf_mb):
+    from c3s_magic_wps import manifest, runner
+
+    constraints = dict(model='MODEL0-0', experiment='exp0', ensemble='r1i1p1')
+    workdirs = iter(range(repeat))
+
+    def workdir():
+        path = os.path.join(tmpdir, 'recipe-{}'.format(next(workdirs)))
+        os.makedirs(path)
+        return path
+
+    results = {
+        'generate_recipe': _timed(lambda path: runner.generate_recipe(
+            'miles_blocking', constraints=constraints, options=dict(season='DJF'), start_year=2000, end_year=2005,
+            output_format='png', workdir=path), repeat, setup=workdir)
+    }
+
+    output_dir = generate_output(os.path.join(tmpdir, 'output'), netcdf_mb, plot_kb=300, log_mb=5)
+    path_filter = os.path.join('recipe_*', 'plots', 'miles_diagnostics', 'miles_block')
+
+    def forget_manifests():
+        manifest._manifests.clear()
+
+    results['get_output'] = _timed(lambda _: runner.get_output(output_dir, path_filter, 'Z500*', 'png'), repeat,
+                                   setup=forget_manifests)
+    archive_file = os.path.join(tmpdir, 'result.zip')
+    results['compress_output'] = _timed(lambda: runner.compress_output(output_dir, archive_file), repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change of the median timings against a baseline, return the benchmarks that got slower."""
+    regressions = []
+    print('{:<26} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'median', 'change'))
+    for name, stats in sorted(results['benchmarks'].items()):
+        if name not in baseline['benchmarks']:
+            continue
+        before = baseline['benchmarks'][name]['median']
+        change = stats['median'] / before - 1 if before else 0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = ' slower'
+        print('{:<26} {:>11.4f}s {:>11.4f}s {:>+7.0%}{}'.format(name, before, stats['median'], change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the service on a synthetic archive.')
+    parser.add_argument('--organizations', type=int, default=4)
+    parser.add_argument('--models', type=int, default=5)
+    parser.add_argument('--experiments', type=int, default=3)
+    parser.add_argument('--ensembles', type=int, default=3)
+    parser.add_argument('--variables', type=int, default=8)
+    parser.add_argument('--files', type=int, default=2)
+    parser.add_argument('--netcdf-mb', type=int, default=10, help='size of the netcdf files of the output')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', metavar='PATH', help='write the results as json to PATH')
+    parser.add_argument('--compare', metavar='PATH', help='compare with the results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fail the comparison when a median is this fraction slower')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-service-')
+    try:
+        root = os.path.join(tmpdir, 'cmip5')
+        directories = generate_archive(root, args.organizations, args.models, args.experiments, args.ensembles,
+                                       args.variables, args.files, netcdf=True)
+        # the DataFinder of the service scans the synthetic archive
+        os.environ['CMIP_DATA_ROOT'] = root
+
+        timings = dict()
+        timings.update(bench_import(root, args.repeat))
+        timings.update(bench_data_finder(root, args.repeat))
+        timings.update(bench_service(args.repeat))
+        timings.update(bench_runner(tmpdir, args.repeat, args.netcdf_mb))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    from c3s_magic_wps import __version__
+
+    results = {
+        'version': __version__,
+        'revision': _git_revision(),
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'archive': dict(vars(args), directories=directories),
+        'benchmarks': {name: _stats(values) for name, values in timings.items()},
+    }
+    for name, stats in sorted(results['benchmarks'].items()):
+        print('{:<26} {:>10.4f}s median {:>10.4f}s min'.format(name, stats['median'], stats['min']))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        print()
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
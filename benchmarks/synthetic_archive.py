@@ -0,0 +1,101 @@
+"""Generator for synthetic CP4CDS style DRS trees used by the benchmarks.
+
+The layout follows the folders expected by the DataFinder::
+
+    <organization>/<model>/<experiment>/<frequency>/<realm>/<mip>/<ensemble>/<variable>/<file>.nc
+
+The files are empty, or tiny NetCDF files with a single variable along a time dimension.
+"""
+import argparse
+import itertools
+import os
+import struct
+
+FREQUENCIES = {'mon': 'Amon', 'day': 'day'}
+
+# variables required by the processes, in the order they are used
+VARIABLES = ['pr', 'tas', 'zg', 'psl', 'tasmax', 'tasmin', 'sfcWind', 'ta', 'ua', 'va', 'hus', 'ts', 'clt', 'rlut',
+             'rsut']
+
+_NC_DIMENSION, _NC_VARIABLE, _NC_ATTRIBUTE = 10, 11, 12
+_NC_CHAR, _NC_FLOAT = 2, 5
+
+
+def variable_name(index):
+    return VARIABLES[index] if index < len(VARIABLES) else 'var{}'.format(index)
+
+
+def _nc_name(name):
+    data = name.encode('ascii')
+    return struct.pack('>i', len(data)) + data + b'\0' * (-len(data) % 4)
+
+
+def _nc_attributes(attributes):
+    if not attributes:
+        return struct.pack('>ii', 0, 0)
+    header = struct.pack('>ii', _NC_ATTRIBUTE, len(attributes))
+    for name, value in attributes:
+        data = value.encode('ascii')
+        header += _nc_name(name) + struct.pack('>ii', _NC_CHAR, len(data)) + data + b'\0' * (-len(data) % 4)
+    return header
+
+
+def write_netcdf(path, variable, steps=12):
+    """Write a NetCDF classic file with the float `variable` along a `time` dimension of `steps`."""
+    header = b'CDF\x01' + struct.pack('>i', 0)
+    header += struct.pack('>ii', _NC_DIMENSION, 1) + _nc_name('time') + struct.pack('>i', steps)
+    header += _nc_attributes([('Conventions', 'CF-1.4')])
+    header += struct.pack('>ii', _NC_VARIABLE, 1) + _nc_name(variable) + struct.pack('>ii', 1, 0)
+    header += _nc_attributes([('units', '1')]) + struct.pack('>ii', _NC_FLOAT, steps * 4)
+    # the data starts after the header and its own offset
+    header += struct.pack('>i', len(header) + 4)
+    with open(path, 'wb') as fp:
+        fp.write(header)
+        fp.write(struct.pack('>{}f'.format(steps), *range(steps)))
+
+
+def generate_archive(root, organizations=2, models=3, experiments=2, ensembles=3, variables=4, files=2,
+                     netcdf=False):
+    """Create a DRS tree below `root` and return the number of directories created.
+
+    The files are empty, unless `netcdf` is set.
+    """
+    count = 0
+    for org, model, exp, frequency, ens, var in itertools.product(range(organizations), range(models),
+                                                                  range(experiments), sorted(FREQUENCIES),
+                                                                  range(ensembles), range(variables)):
+        variable = variable_name(var)
+        path = os.path.join(root, 'ORG{}'.format(org), 'MODEL{}-{}'.format(org, model), 'exp{}'.format(exp),
+                            frequency, 'atmos', FREQUENCIES[frequency], 'r{}i1p1'.format(ens + 1), variable)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            count += 1
+        for n in range(files):
+            filename = '{}_{}_MODEL{}-{}_exp{}_r{}i1p1_{}.nc'.format(
+                variable, FREQUENCIES[frequency], org, model, exp, ens + 1, n)
+            if netcdf:
+                write_netcdf(os.path.join(path, filename), variable)
+            else:
+                open(os.path.join(path, filename), 'a').close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic CMIP5 archive.')
+    parser.add_argument('root', help='folder to create the archive in')
+    parser.add_argument('--organizations', type=int, default=2)
+    parser.add_argument('--models', type=int, default=3)
+    parser.add_argument('--experiments', type=int, default=2)
+    parser.add_argument('--ensembles', type=int, default=3)
+    parser.add_argument('--variables', type=int, default=4)
+    parser.add_argument('--files', type=int, default=2)
+    parser.add_argument('--netcdf', action='store_true', help='write tiny NetCDF files instead of empty files')
+    args = parser.parse_args()
+
+    count = generate_archive(args.root, args.organizations, args.models, args.experiments, args.ensembles,
+                             args.variables, args.files, netcdf=args.netcdf)
+    print('created {} variable folders in {}'.format(count, args.root))
+
+
+if __name__ == '__main__':
+    main()
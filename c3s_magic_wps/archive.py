@@ -0,0 +1,407 @@
+import binascii
+import json
+import os
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pywps import configuration
+
+from .result_cache import _copy_tree
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# formats which are compressed already and are stored as is
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.pdf', '.zip', '.gz', '.bz2', '.xz', '.nc4'}
+# netcdf4 files are hdf5 files, which are usually compressed, netcdf3 files are not
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+CHUNK_SIZE = 1024 * 1024
+# compressed data is kept in memory up to this size, and spooled to a temporary file beyond
+SPOOL_SIZE = 16 * 1024 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+# sizes, offsets and counts from these limits on are written to zip64 records
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+# values in the classic records pointing to the zip64 records
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+# first line of the placeholder written instead of an archive which is created when it is downloaded
+LAZY_ARCHIVE_MAGIC = b'C3S-MAGIC-LAZY-ARCHIVE\n'
+# size of the chunks an archive is streamed in
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def is_compressed(path):
+    """Return True when `path` is in a compressed format, deflating it again does not make it smaller."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in STORED_EXTENSIONS:
+        return True
+    if ext == '.nc':
+        with open(path, 'rb') as fp:
+            return fp.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE
+    return False
+
+
+def _deflate(path):
+    """Deflate the file at `path`, returns the crc, the compressed data in a spooled file and its size."""
+    crc = 0
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    with open(path, 'rb') as fp:
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = binascii.crc32(chunk, crc)
+            spool.write(compressor.compress(chunk))
+    spool.write(compressor.flush())
+    compress_size = spool.tell()
+    spool.seek(0)
+    return crc, spool, compress_size
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    year = max(t.tm_year, 1980)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class _Entry():
+    def __init__(self, arcname, path):
+        stat = os.stat(path)
+        self.arcname = arcname
+        self.path = path
+        self.file_size = stat.st_size
+        self.mode = stat.st_mode
+        self.dos_time, self.dos_date = _dos_datetime(stat.st_mtime)
+        self.method = ZIP_STORED if is_compressed(path) else ZIP_DEFLATED
+        self.crc = 0
+        self.compress_size = 0
+        self.header_offset = 0
+
+
+class ZipWriter():
+    """Minimal zip writer for entries with precomputed data, which `zipfile` cannot write.
+
+    Writes zip64 records for large files, large archives and archives with many entries. When `fp` is not
+    seekable, like a stream to a HTTP client, the crc of stored files follows their data in a data descriptor.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.streaming = not (hasattr(fp, 'seekable') and fp.seekable())
+        self.offset = fp.tell() if not self.streaming else 0
+        self.entries = []
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.offset += len(data)
+
+    def _local_header(self, entry, zip64, flags=0x800):
+        name = entry.arcname.encode('utf-8')
+        extra = b''
+        compress_size, file_size = entry.compress_size, entry.file_size
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+            compress_size = file_size = ZIP64_MARKER
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, flags, entry.method, entry.dos_time,
+                           entry.dos_date, entry.crc, compress_size, file_size, len(name), len(extra)) + name + extra
+
+    def write_stored(self, entry):
+        """Copy the file of `entry` into the archive, the crc is computed while copying and patched afterwards."""
+        # the compressed size equals the file size, so it is known whether zip64 is needed beforehand
+        zip64 = entry.file_size >= ZIP64_LIMIT
+        entry.compress_size = entry.file_size
+        entry.header_offset = self.offset
+        self._write(self._local_header(entry, zip64, flags=0x808 if self.streaming else 0x800))
+        crc = 0
+        with open(entry.path, 'rb') as fp:
+            while True:
+                chunk = fp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = binascii.crc32(chunk, crc)
+                self._write(chunk)
+        entry.crc = crc
+        if self.streaming:
+            self._write(struct.pack('<IIQQ' if zip64 else '<IIII', 0x08074b50, crc, entry.compress_size,
+                                    entry.file_size))
+        else:
+            self.fp.seek(entry.header_offset + 14)
+            self.fp.write(struct.pack('<I', crc))
+            self.fp.seek(self.offset)
+        self.entries.append(entry)
+
+    def write_deflated(self, entry, crc, data, compress_size):
+        entry.crc = crc
+        entry.compress_size = compress_size
+        entry.header_offset = self.offset
+        self._write(self._local_header(entry, entry.file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT))
+        while True:
+            chunk = data.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self._write(chunk)
+        self.entries.append(entry)
+
+    def close(self):
+        """Write the central directory."""
+        start = self.offset
+        for entry in self.entries:
+            name = entry.arcname.encode('utf-8')
+            zip64_fields = []
+            file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+            if file_size >= ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+                file_size = ZIP64_MARKER
+            if compress_size >= ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+                compress_size = ZIP64_MARKER
+            if header_offset >= ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = ZIP64_MARKER
+            extra = b''
+            if zip64_fields:
+                extra = struct.pack('<HH' + 'Q' * len(zip64_fields), 1, 8 * len(zip64_fields), *zip64_fields)
+            version = 45 if zip64_fields else 20
+            self._write(
+                struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, 0x800, entry.method,
+                            entry.dos_time, entry.dos_date, entry.crc, compress_size, file_size, len(name),
+                            len(extra), 0, 0, 0, (entry.mode & 0xFFFF) << 16, header_offset) + name + extra)
+
+        end = self.offset
+        count, size, offset = len(self.entries), end - start, start
+        if count >= ZIP_FILECOUNT_LIMIT or size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT:
+            self._write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, size, offset))
+            self._write(struct.pack('<IIQI', 0x07064b50, 0, end, 1))
+            count, size, offset = ZIP64_COUNT_MARKER, ZIP64_MARKER, ZIP64_MARKER
+        self._write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, size, offset, 0))
+
+
+def _archive_entries(output_dir, exclude_preproc=True):
+    entries = []
+    for root, dirs, files in os.walk(output_dir):
+        dirs.sort()
+        if not exclude_preproc or 'preproc' not in root:
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                entries.append(_Entry(os.path.relpath(path, output_dir), path))
+    return entries
+
+
+def write_archive(output_dir, fp, exclude_preproc=True, workers=4, progress=None):
+    """Write the files in `output_dir` as zip archive to the file object `fp`.
+
+    Files in compressed formats, like png plots and netcdf4 files, are stored as they are. All other files, like
+    logs and text files, are deflated in `workers` parallel threads, while the archive is written in order. The
+    optional `progress` callback is called with the number of bytes written and the total number of bytes.
+    """
+    entries = _archive_entries(output_dir, exclude_preproc)
+    total = sum(entry.file_size for entry in entries)
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # at most a few files per worker are compressed ahead of the writer, to limit memory and disk use
+        pending = [entry for entry in entries if entry.method == ZIP_DEFLATED]
+        futures = dict()
+
+        def _submit():
+            while pending and len(futures) < 2 * workers:
+                entry = pending.pop(0)
+                futures[entry] = executor.submit(_deflate, entry.path)
+
+        writer = ZipWriter(fp)
+        try:
+            for entry in entries:
+                _submit()
+                if entry.method == ZIP_STORED:
+                    writer.write_stored(entry)
+                else:
+                    crc, data, compress_size = futures.pop(entry).result()
+                    with data:
+                        writer.write_deflated(entry, crc, data, compress_size)
+                done += entry.file_size
+                if progress:
+                    progress(done, total)
+            writer.close()
+        finally:
+            for future in futures.values():
+                future.cancel()
+    return len(entries), total
+
+
+def build_archive(output_dir, archive_file, exclude_preproc=True, workers=4, progress=None):
+    """Write the files in `output_dir` to the zip archive `archive_file`, see `write_archive`."""
+    with open(archive_file, 'wb') as fp:
+        count, total = write_archive(output_dir, fp, exclude_preproc, workers, progress)
+    LOGGER.debug("written %s files of %s bytes to archive %s", count, total, archive_file)
+    return archive_file
+
+
+def defer_archive(output_dir, archive_file, lazy_dir, exclude_preproc=True):
+    """Write a placeholder to `archive_file` instead of the archive of `output_dir`.
+
+    The output dir is linked into `lazy_dir`, which outlives the workdir of the job, and the archive is created
+    from it when it is downloaded for the first time, see `stream_archive`.
+    """
+    os.makedirs(lazy_dir, exist_ok=True)
+    tree = os.path.join(tempfile.mkdtemp(dir=lazy_dir, prefix='archive-'), 'output')
+    _copy_tree(output_dir, tree)
+    # the mtime of the tree marks the end of the job for evict_archives
+    os.utime(tree)
+    with open(archive_file, 'wb') as fp:
+        fp.write(LAZY_ARCHIVE_MAGIC)
+        fp.write(json.dumps(dict(tree=tree, exclude_preproc=exclude_preproc)).encode('utf-8'))
+    return archive_file
+
+
+def read_placeholder(path):
+    """Return the settings written by `defer_archive` to `path`, or None when `path` is a regular file."""
+    with open(path, 'rb') as fp:
+        if fp.read(len(LAZY_ARCHIVE_MAGIC)) != LAZY_ARCHIVE_MAGIC:
+            return None
+        return json.loads(fp.read().decode('utf-8'))
+
+
+def materialized_archive(tree):
+    """Return the path the archive of a deferred output tree is kept at once it has been created."""
+    return os.path.join(os.path.dirname(tree), 'archive.zip')
+
+
+class _ClientGone(Exception):
+    pass
+
+
+class _QueueWriter():
+    """Not seekable file object handing the written data in chunks to a queue, and copying it to `tee`."""
+    def __init__(self, chunks, closed, tee=None):
+        self.chunks = chunks
+        self.closed = closed
+        self.tee = tee
+        self.buffer = bytearray()
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        if self.tee:
+            self.tee.write(data)
+        self.buffer += data
+        if len(self.buffer) >= STREAM_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise _ClientGone()
+
+
+def stream_archive(tree, exclude_preproc=True, workers=4, materialize=True):
+    """Yield the zip archive of `tree` in chunks while it is written.
+
+    With `materialize` the archive is written to `materialized_archive(tree)` as well, so later downloads do not
+    need to create it again. An archive which is not downloaded completely is not kept.
+    """
+    chunks = queue.Queue(maxsize=16)
+    closed = threading.Event()
+    archive_file = materialized_archive(tree)
+
+    def _produce():
+        tmp_file = None
+        tee = None
+        writer = _QueueWriter(chunks, closed)
+        try:
+            if materialize:
+                fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(archive_file), prefix='.archive-')
+                tee = writer.tee = os.fdopen(fd, 'wb')
+            write_archive(tree, writer, exclude_preproc, workers)
+            writer.flush()
+            if tee:
+                tee.close()
+                os.replace(tmp_file, archive_file)
+                tmp_file = None
+            writer.put(None)
+        except _ClientGone:
+            LOGGER.debug("download of archive %s aborted", archive_file)
+        except Exception as e:
+            LOGGER.exception("creating archive %s failed", archive_file)
+            try:
+                writer.put(e)
+            except _ClientGone:
+                pass
+        finally:
+            if tee:
+                tee.close()
+            if tmp_file:
+                os.remove(tmp_file)
+
+    threading.Thread(target=_produce, daemon=True).start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        closed.set()
+
+
+def evict_archives(lazy_dir, ttl, keep):
+    """Clean up `lazy_dir`.
+
+    Archives which have not been downloaded for `ttl` seconds are removed, they are created again on the next
+    download. Output trees are removed `keep` seconds after their job finished.
+    """
+    now = time.time()
+    try:
+        names = os.listdir(lazy_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        tree = os.path.join(lazy_dir, name, 'output')
+        try:
+            if now - os.path.getmtime(tree) > keep:
+                LOGGER.debug("removing deferred archive %s", tree)
+                shutil.rmtree(os.path.dirname(tree), ignore_errors=True)
+                continue
+            archive_file = materialized_archive(tree)
+            if os.path.exists(archive_file) and now - os.path.getmtime(archive_file) > ttl:
+                LOGGER.debug("removing archive %s", archive_file)
+                os.remove(archive_file)
+        except OSError:
+            continue
+
+
+def get_workers():
+    """Return the number of threads compressing files configured in the `archive` section."""
+    return int(configuration.get_config_value('archive', 'workers') or 4)
+
+
+def get_lazy_settings():
+    """Return the folder, the time to live of created archives and the time to keep deferred archives configured in
+    the `archive` section."""
+    lazy_dir = configuration.get_config_value('archive', 'lazy_dir') or os.path.join(
+        configuration.get_config_value('server', 'workdir') or tempfile.gettempdir(), 'c3s_magic_wps-archives')
+    ttl = int(configuration.get_config_value('archive', 'lazy_ttl') or 3600)
+    keep = float(configuration.get_config_value('archive', 'lazy_keep_days') or 7) * 24 * 3600
+    return lazy_dir, ttl, keep
@@ -5,23 +5,24 @@
 # http://werkzeug.pocoo.org/docs/0.12/debug/
 ###########################################################
 
+# The commands import the modules they need when they run, so commands like status do not load pywps and the
+# processes. See "c3s_magic_wps imports" for the time taken to import the modules.
+
 import os
-import psutil
-import click
-from jinja2 import Environment, PackageLoader
-from pywps import configuration
+import signal
+import sys
 
-from c3s_magic_wps import wsgi
+import click
 from six.moves.urllib.parse import urlparse
 
 PID_FILE = os.path.abspath(os.path.join(os.path.curdir, "pywps.pid"))
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
-template_env = Environment(loader=PackageLoader('c3s_magic_wps', 'templates'), autoescape=True)
-
 
 def write_user_config(**kwargs):
+    from jinja2 import Environment, PackageLoader
+    template_env = Environment(loader=PackageLoader('c3s_magic_wps', 'templates'), autoescape=True)
     config_templ = template_env.get_template('pywps.cfg')
     rendered_config = config_templ.render(**kwargs)
     config_file = get_user_config_path()
@@ -35,6 +36,7 @@ def get_user_config_path():
 
 
 def get_host():
+    from pywps import configuration
     url = configuration.get_config_value('server', 'url')
     url = url or 'http://localhost:5000/wps'
 
@@ -53,6 +55,7 @@ def get_host():
 def run_process_action(action=None):
     """Run an action with psutil on current process
     and return a status message."""
+    import psutil
     action = action or 'status'
     try:
         with open(PID_FILE, 'r') as fp:
@@ -61,6 +64,9 @@ def run_process_action(action=None):
             if action == 'stop':
                 p.terminate()
                 msg = "pid={}, status=terminated".format(p.pid)
+            elif action == 'reload':
+                p.send_signal(signal.SIGHUP)
+                msg = "pid={}, status=reloading".format(p.pid)
             else:
                 from psutil import _pprint_secs
                 msg = "pid={}, status={}, created={}".format(p.pid, p.status(), _pprint_secs(p.create_time()))
@@ -73,16 +79,34 @@ def run_process_action(action=None):
     click.echo(msg)
 
 
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
+
+
+def serve_files(application):
+    """Wrap the application with the middlewares serving the static files and the wps outputs.
+
+    Deferred archives in the outputs are served before the other files. The outputs of a job are in a folder named
+    by its id, they never change.
+    """
+    from pywps import configuration
+    from c3s_magic_wps.downloads import FileServer, LazyArchiveMiddleware
+    static_files = {
+        '/static': STATIC_DIR,
+        '/outputs': configuration.get_config_value('server', 'outputpath')
+    }
+    max_age = int(configuration.get_config_value('downloads', 'static_max_age') or 0)
+    return LazyArchiveMiddleware(FileServer(application, static_files, immutable=['/outputs'], max_age=max_age))
+
+
 def _run(application, bind_host=None, daemon=False):
     from werkzeug.serving import run_simple
     # call this *after* app is initialized ... needs pywps config.
     host, port = get_host()
+    # stop terminates the service, exit normally so the esmvaltool workers are shut down with it
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     bind_host = bind_host or host
     # need to serve the wps outputs
-    static_files = {
-        '/static': os.path.join(os.path.dirname(__file__), 'static'),
-        '/outputs': configuration.get_config_value('server', 'outputpath')
-    }
+    application = serve_files(application)
     run_simple(
         hostname=bind_host,
         port=port,
@@ -91,8 +115,59 @@ def _run(application, bind_host=None, daemon=False):
         use_reloader=False,
         threaded=True,
         # processes=2,
-        use_evalex=not daemon,
-        static_files=static_files)
+        use_evalex=not daemon)
+
+
+def _serve(cfgfiles, bind_host=None, daemon=False, workers=4, threads=4, keep_alive=5):
+    """Run the service with gunicorn, a pre-fork server with several worker processes.
+
+    The application is created by the gunicorn master, after it detached in daemon mode, and before the workers are
+    forked, so they share the esmvaltool worker pool. On SIGHUP the application is created again from the
+    configuration files, and the workers are replaced gracefully.
+    """
+    try:
+        from gunicorn import util
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise click.ClickException('The --server mode needs gunicorn, install it with "pip install gunicorn".')
+    from pywps import configuration
+    from c3s_magic_wps import wsgi
+    # the address to bind is read from the configuration
+    configuration.load_configuration(wsgi.get_config_files(cfgfiles))
+
+    class Server(BaseApplication):
+        def __init__(self):
+            self.application = None
+            super(Server, self).__init__()
+
+        def load_config(self):
+            host, port = get_host()
+            self.cfg.set('bind', '{}:{}'.format(bind_host or host, port))
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('keepalive', keep_alive)
+            self.cfg.set('preload_app', True)
+            self.cfg.set('proc_name', 'c3s_magic_wps')
+            self.cfg.set('pidfile', PID_FILE)
+            self.cfg.set('daemon', daemon)
+
+        def load(self):
+            if self.application is None:
+                self.application = wsgi.create_app(cfgfiles)
+            # files are sent with sendfile by the workers
+            return serve_files(self.application)
+
+        def reload(self):
+            super(Server, self).reload()
+            self.application = None
+            self.callable = None
+
+    server = Server()
+    if daemon:
+        # only the gunicorn command line detaches itself, the application runs the arbiter in this process
+        util.daemonize(server.cfg.enable_stdio_inheritance)
+    server.run()
 
 
 @click.group(context_settings=CONTEXT_SETTINGS)
@@ -100,8 +175,8 @@ def _run(application, bind_host=None, daemon=False):
 def cli():
     """Command line to start/stop a PyWPS service.
 
-    Do not use this service in a production environment.
-    It's intended to be running in a test environment only!
+    Without the --server option of start, the service is intended to be
+    running in a test environment only!
     For more documentation, visit http://pywps.org/doc
     """
     pass
@@ -119,6 +194,64 @@ def stop():
     run_process_action(action='stop')
 
 
+@cli.command()
+def reload():
+    """Reload PyWPS service started with --server"""
+    run_process_action(action='reload')
+
+
+@cli.command()
+@click.argument('folders', nargs=-1, type=click.Path(exists=True, file_okay=False))
+def precompress(folders):
+    """Write compressed variants of the text files served by the service.
+
+    The static files are compressed when no FOLDERS are given.
+    """
+    from c3s_magic_wps.downloads import precompress as precompress_folder
+    for folder in folders or [STATIC_DIR]:
+        count = precompress_folder(folder)
+        click.echo("{} compressed files written in {}".format(count, folder))
+
+
+@cli.command()
+@click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+@click.option('--output', '-o', metavar='PATH', help='write the metrics to this scrape file instead of printing them.')
+def metrics(config, output):
+    """Show the metrics served by the /metrics endpoint of the service"""
+    from pywps import configuration
+    from c3s_magic_wps import metrics as service_metrics
+    cfgfiles = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
+    if os.path.exists(get_user_config_path()):
+        cfgfiles.append(get_user_config_path())
+    if config:
+        cfgfiles.append(config)
+    configuration.load_configuration(cfgfiles)
+    if output:
+        service_metrics.write_scrape_file(output)
+    else:
+        click.echo(service_metrics.render(service_metrics.collect()), nl=False)
+
+
+@cli.command()
+@click.argument('modules', nargs=-1)
+@click.option('--top', metavar='INT', default=5, help='number of the slowest packages shown per module.')
+def imports(modules, top):
+    """Show the time taken to import the modules of the service
+
+    Every module is imported in a new interpreter. The modules loaded by the command line, the esmvaltool workers and
+    the wsgi server are measured when no MODULES are given.
+    """
+    from c3s_magic_wps import importtime
+    for module in modules or importtime.MODULES:
+        try:
+            report = importtime.measure(module)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo("{:<44} {:>8.3f}s {:>5} modules".format(report.module, report.seconds, len(report.imports)))
+        for package, seconds in importtime.by_package(report.imports)[:top]:
+            click.echo("    {:<40} {:>8.3f}s".format(package, seconds))
+
+
 @cli.command()
 @click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
 @click.option('--bind-host', '-b', metavar='IP-ADDRESS', default='127.0.0.1', help='IP address used to bind service.')
@@ -132,8 +265,12 @@ def stop():
 @click.option('--log-file', metavar='PATH', default='pywps.log', help='log file in PyWPS configuration.')
 @click.option('--database', default='sqlite:///pywps-processes.sqlite', help='database in PyWPS configuration')
 @click.option('--rootpath', default='/tmp', help='Root path for computation')
+@click.option('--server', is_flag=True, help='run with the gunicorn production server.')
+@click.option('--workers', metavar='INT', default=4, help='number of worker processes of the --server mode.')
+@click.option('--threads', metavar='INT', default=4, help='number of threads per worker of the --server mode.')
+@click.option('--keep-alive', metavar='SECONDS', default=5, help='keep-alive timeout of the --server mode.')
 def start(config, bind_host, daemon, hostname, port, maxsingleinputsize, maxprocesses, parallelprocesses, log_level,
-          log_file, database, rootpath):
+          log_file, database, rootpath, server, workers, threads, keep_alive):
     """Start PyWPS service.
     This service is by default available at http://localhost:5000/wps
     """
@@ -158,7 +295,12 @@ def start(config, bind_host, daemon, hostname, port, maxsingleinputsize, maxproc
 
     if config:
         cfgfiles.append(config)
-    app = wsgi.create_app(cfgfiles)
+    if server:
+        # gunicorn writes the pid file, the application is created after the service detached in daemon mode
+        _serve(cfgfiles, bind_host=bind_host, daemon=daemon, workers=workers, threads=threads, keep_alive=keep_alive)
+        return
+    # the application is created by the serving process, so the esmvaltool workers are shut down with it
+    from c3s_magic_wps import wsgi
     # let's start the service ...
     # See:
     # * https://github.com/geopython/pywps-flask/blob/master/demo.py
@@ -177,12 +319,12 @@ def start(config, bind_host, daemon, hostname, port, maxsingleinputsize, maxproc
 
         if pid == 0:
             os.setsid()
-            _run(app, bind_host=bind_host, daemon=True)
+            _run(wsgi.create_app(cfgfiles), bind_host=bind_host, daemon=True)
         else:
             os._exit(0)
     else:
         # no daemon
-        _run(app, bind_host=bind_host)
+        _run(wsgi.create_app(cfgfiles), bind_host=bind_host)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+import collections
+import gzip
+import hashlib
+import threading
+
+from six.moves.urllib.parse import parse_qsl
+from werkzeug.http import parse_accept_header, parse_etags
+
+from .processes.utils.data_finder import DataFinder
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# requests answered from the cache
+CACHED_REQUESTS = ('getcapabilities', 'describeprocess')
+
+# number of documents kept, one per distinct query
+MAX_ENTRIES = 64
+
+_Document = collections.namedtuple('_Document', ['version', 'status', 'headers', 'body', 'gzip_body', 'etag'])
+
+
+def data_version():
+    """Return the version of the DataFinder index, the allowed values of the process inputs change with it."""
+    finder = DataFinder.get_instance()
+    finder.check_stale()
+    return finder.version
+
+
+def _query_key(query_string):
+    """Return the cache key of a GetCapabilities or DescribeProcess query string, or None for other requests."""
+    params = [(key.lower(), value) for key, value in parse_qsl(query_string, keep_blank_values=True)]
+    values = dict(params)
+    if values.get('service', '').lower() != 'wps' or values.get('request', '').lower() not in CACHED_REQUESTS:
+        return None
+    return tuple(sorted((key, value.lower() if key in ('service', 'request') else value) for key, value in params))
+
+
+class DescribeCache():
+    """WSGI middleware caching the GetCapabilities and DescribeProcess documents of the wps `app`.
+
+    The documents are rendered once per `version()`, by default the version of the DataFinder index providing the
+    allowed values of the model, experiment and ensemble inputs, and kept as bytes. They are served with a strong
+    ETag, so clients can revalidate them, and compressed when the client accepts it.
+    """
+    def __init__(self, app, version=data_version, max_entries=MAX_ENTRIES):
+        self.app = app
+        self.version = version
+        self.max_entries = max_entries
+        self._documents = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+
+    def _render(self, environ, version):
+        captured = []
+
+        def start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers]
+
+        app_iter = self.app(environ, start_response)
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        status, headers = captured
+        headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        return _Document(version, status, headers, body, gzip.compress(body, mtime=0),
+                         '"{}"'.format(hashlib.sha1(body).hexdigest()))
+
+    def _document(self, environ, key):
+        try:
+            version = self.version()
+        except Exception:
+            LOGGER.exception("cannot determine the version of the process descriptions, not caching them")
+            return self._render(environ, None)
+
+        with self._lock:
+            document = self._documents.get(key)
+        if document is not None and document.version == version:
+            return document
+
+        # render a document once, even if it is requested by several clients at the same time
+        with self._render_lock:
+            with self._lock:
+                document = self._documents.get(key)
+            if document is not None and document.version == version:
+                return document
+            document = self._render(environ, version)
+            if document.status.startswith('200'):
+                with self._lock:
+                    self._documents.pop(key, None)
+                    self._documents[key] = document
+                    while len(self._documents) > self.max_entries:
+                        self._documents.popitem(last=False)
+                LOGGER.debug("cached %s bytes of %s", len(document.body), environ.get('QUERY_STRING'))
+        return document
+
+    def __call__(self, environ, start_response):
+        key = None
+        if environ.get('REQUEST_METHOD', 'GET') == 'GET':
+            key = _query_key(environ.get('QUERY_STRING', ''))
+        if key is None:
+            return self.app(environ, start_response)
+
+        document = self._document(environ, key)
+        if not document.status.startswith('200'):
+            start_response(document.status, document.headers + [('Content-Length', str(len(document.body)))])
+            return [document.body]
+
+        body, etag = document.body, document.etag
+        headers = list(document.headers)
+        if parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))['gzip']:
+            body, etag = document.gzip_body, document.etag[:-1] + '-gzip"'
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.extend([
+            ('ETag', etag),
+            ('Cache-Control', 'no-cache'),
+            ('Vary', 'Accept-Encoding'),
+        ])
+        if environ.get('HTTP_IF_NONE_MATCH'):
+            etags = parse_etags(environ['HTTP_IF_NONE_MATCH'])
+            if etags.star_tag or etags.contains_weak(etag.strip('"')):
+                start_response('304 Not Modified', [header for header in headers if header[0] != 'Content-Type'])
+                return []
+
+        headers.append(('Content-Length', str(len(body))))
+        start_response(document.status, headers)
+        return [body]
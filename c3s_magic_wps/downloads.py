@@ -0,0 +1,299 @@
+import calendar
+import gzip
+import mimetypes
+import os
+import threading
+import time
+
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags, parse_range_header
+from werkzeug.security import safe_join
+
+from pywps import configuration
+
+from . import archive
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# seconds between two clean ups of the deferred archives
+EVICT_INTERVAL = 600
+
+# max-age of files which never change, one year
+IMMUTABLE_MAX_AGE = 31536000
+
+# text files served with a precompressed variant, the variants in order of preference
+PRECOMPRESSED_EXTENSIONS = ('.json', '.yml', '.yaml', '.md', '.txt', '.xml', '.csv', '.html', '.css', '.js', '.svg')
+PRECOMPRESSED_VARIANTS = (('br', '.br'), ('gzip', '.gz'))
+
+CONTENT_TYPES = {'.yml': 'text/yaml', '.yaml': 'text/yaml'}
+
+
+def _evict_loop():
+    while True:
+        time.sleep(EVICT_INTERVAL)
+        try:
+            lazy_dir, ttl, keep = archive.get_lazy_settings()
+            archive.evict_archives(lazy_dir, ttl, keep)
+        except Exception:
+            LOGGER.exception("cleaning up deferred archives failed")
+
+
+class LazyArchiveMiddleware():
+    """WSGI middleware serving the archives deferred by `archive.defer_archive`.
+
+    A request for a placeholder in the `outputpath` of the service is answered with the archive, which is streamed
+    to the client while it is created on the first download. All other requests are passed on to `app`.
+    """
+    def __init__(self, app, url_prefix='/outputs'):
+        self.app = app
+        self.url_prefix = url_prefix.rstrip('/') + '/'
+        self._evict_thread = None
+        self._lock = threading.Lock()
+
+    def _start_eviction(self):
+        with self._lock:
+            if self._evict_thread is None:
+                self._evict_thread = threading.Thread(target=_evict_loop, daemon=True)
+                self._evict_thread.start()
+
+    def _placeholder(self, environ):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.url_prefix) or not path.endswith('.zip'):
+            return None
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            return None
+        outputpath = configuration.get_config_value('server', 'outputpath')
+        filename = safe_join(outputpath, path[len(self.url_prefix):]) if outputpath else None
+        if not filename or not os.path.isfile(filename):
+            return None
+        try:
+            placeholder = archive.read_placeholder(filename)
+        except (IOError, OSError, ValueError):
+            return None
+        if placeholder is not None:
+            placeholder['name'] = os.path.basename(filename)
+        return placeholder
+
+    def __call__(self, environ, start_response):
+        placeholder = self._placeholder(environ)
+        if placeholder is None:
+            return self.app(environ, start_response)
+
+        self._start_eviction()
+        tree = placeholder['tree']
+        if not os.path.isdir(tree):
+            start_response('410 Gone', [('Content-Type', 'text/plain')])
+            return [b'The archive has expired.\n']
+
+        headers = [
+            ('Content-Type', 'application/zip'),
+            ('Content-Disposition', 'attachment; filename="{}"'.format(placeholder['name'])),
+        ]
+        head = environ.get('REQUEST_METHOD') == 'HEAD'
+
+        archive_file = archive.materialized_archive(tree)
+        try:
+            fp = open(archive_file, 'rb')
+        except FileNotFoundError:
+            start_response('200 OK', headers)
+            if head:
+                return []
+            return archive.stream_archive(tree, placeholder.get('exclude_preproc', True),
+                                          workers=archive.get_workers())
+
+        # mark the archive as recently downloaded
+        os.utime(archive_file)
+        headers.append(('Content-Length', str(os.fstat(fp.fileno()).st_size)))
+        start_response('200 OK', headers)
+        if head:
+            fp.close()
+            return []
+        return _wrap_file(environ, fp)
+
+
+class FileServer():
+    """WSGI middleware serving the files of the folders in `exports`, a mapping of url prefixes to folders.
+
+    Whole files are answered with the `wsgi.file_wrapper` of the server, which uses `sendfile` when the server
+    supports it. Responses carry a strong ETag, so clients can revalidate them with conditional requests, and single byte
+    ranges are supported for partial downloads of large files. The files in the subfolders of the `immutable`
+    prefixes, like the job outputs in folders named by the job id, never change and are cached by clients without
+    revalidation, other files are cached for `max_age` seconds. When the client accepts it, the precompressed `.br` or
+    `.gz` variant of a file created by `precompress` is sent. All other requests are passed on to `app`.
+    """
+    def __init__(self, app, exports, immutable=(), max_age=0):
+        self.app = app
+        self.exports = [(prefix.rstrip('/') + '/', folder) for prefix, folder in exports.items() if folder]
+        self.immutable = [prefix.rstrip('/') + '/' for prefix in immutable]
+        self.max_age = max_age
+
+    def _filename(self, path):
+        for prefix, folder in self.exports:
+            if path.startswith(prefix):
+                filename = safe_join(folder, path[len(prefix):])
+                if filename and os.path.isfile(filename):
+                    return filename
+        return None
+
+    def _cache_control(self, path):
+        for prefix in self.immutable:
+            if path.startswith(prefix) and '/' in path[len(prefix):]:
+                return 'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+        if self.max_age:
+            return 'public, max-age={}'.format(self.max_age)
+        return 'no-cache'
+
+    def __call__(self, environ, start_response):
+        filename = None
+        path = environ.get('PATH_INFO', '')
+        if environ.get('REQUEST_METHOD', 'GET') in ('GET', 'HEAD'):
+            filename = self._filename(path)
+        if filename is None:
+            return self.app(environ, start_response)
+
+        headers = [('Content-Type', _content_type(filename))]
+        encoding = None
+        if os.path.splitext(filename)[1] in PRECOMPRESSED_EXTENSIONS:
+            headers.append(('Vary', 'Accept-Encoding'))
+            encoding, filename = _precompressed(filename, environ.get('HTTP_ACCEPT_ENCODING', ''))
+            if encoding:
+                headers.append(('Content-Encoding', encoding))
+
+        fp = open(filename, 'rb')
+        stat = os.fstat(fp.fileno())
+        etag = _etag(stat, encoding)
+        headers.extend([
+            ('ETag', etag),
+            ('Last-Modified', http_date(stat.st_mtime)),
+            ('Cache-Control', self._cache_control(path)),
+            ('Accept-Ranges', 'bytes'),
+        ])
+        if _not_modified(environ, etag, stat.st_mtime):
+            fp.close()
+            start_response('304 Not Modified', [header for header in headers if header[0] != 'Content-Type'])
+            return []
+
+        start, stop, status = 0, stat.st_size, '200 OK'
+        if environ.get('HTTP_RANGE') and environ.get('HTTP_IF_RANGE', etag) == etag:
+            byte_range = parse_range_header(environ['HTTP_RANGE'])
+            if byte_range is not None and len(byte_range.ranges) == 1:
+                if byte_range.range_for_length(stat.st_size) is None:
+                    fp.close()
+                    start_response('416 Range Not Satisfiable', headers + [
+                        ('Content-Range', 'bytes */{}'.format(stat.st_size)),
+                        ('Content-Length', '0'),
+                    ])
+                    return []
+                start, stop = byte_range.range_for_length(stat.st_size)
+                headers.append(('Content-Range', byte_range.to_content_range_header(stat.st_size)))
+                status = '206 Partial Content'
+        headers.append(('Content-Length', str(stop - start)))
+        start_response(status, headers)
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            fp.close()
+            return []
+        fp.seek(start)
+        return _wrap_file(environ, fp, None if status == '200 OK' else stop - start)
+
+
+def _content_type(filename):
+    ext = os.path.splitext(filename)[1]
+    return CONTENT_TYPES.get(ext) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def _etag(stat, encoding=None):
+    """Return a strong ETag of a file, its content changes with its size or modification time."""
+    etag = '{:x}-{:x}'.format(stat.st_mtime_ns, stat.st_size)
+    if encoding:
+        etag += '-' + encoding
+    return '"{}"'.format(etag)
+
+
+def _not_modified(environ, etag, mtime):
+    """Return True when the conditional request in `environ` is answered with 304 Not Modified."""
+    if environ.get('HTTP_IF_NONE_MATCH'):
+        etags = parse_etags(environ['HTTP_IF_NONE_MATCH'])
+        return etags.star_tag or etags.contains_weak(etag.strip('"'))
+    if environ.get('HTTP_IF_MODIFIED_SINCE'):
+        since = parse_date(environ['HTTP_IF_MODIFIED_SINCE'])
+        return since is not None and int(mtime) <= calendar.timegm(since.utctimetuple())
+    return False
+
+
+def _precompressed(filename, accept_encoding):
+    """Return the encoding and file name of the best precompressed variant of `filename` the client accepts."""
+    accepted = parse_accept_header(accept_encoding)
+    mtime = os.stat(filename).st_mtime
+    for encoding, suffix in PRECOMPRESSED_VARIANTS:
+        if not accepted[encoding]:
+            continue
+        variant = filename + suffix
+        try:
+            # a variant older than the file is outdated
+            if os.stat(variant).st_mtime >= mtime:
+                return encoding, variant
+        except OSError:
+            continue
+    return None, filename
+
+
+def precompress(folder, extensions=PRECOMPRESSED_EXTENSIONS):
+    """Write the `.gz` variant, and the `.br` variant when `brotli` is installed, of the text files in `folder`.
+
+    Variants are only kept when they are smaller than the file, and only written again when the file changed.
+    Returns the number of written variants.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    count = 0
+    for dirpath, _, files in os.walk(folder):
+        for name in files:
+            if os.path.splitext(name)[1] not in extensions:
+                continue
+            filename = os.path.join(dirpath, name)
+            mtime = os.stat(filename).st_mtime
+            with open(filename, 'rb') as fp:
+                data = None
+                for encoding, suffix in PRECOMPRESSED_VARIANTS:
+                    variant = filename + suffix
+                    if os.path.exists(variant) and os.stat(variant).st_mtime >= mtime:
+                        continue
+                    if encoding == 'br' and brotli is None:
+                        continue
+                    if data is None:
+                        data = fp.read()
+                    compressed = brotli.compress(data) if encoding == 'br' else gzip.compress(data, mtime=0)
+                    if len(compressed) >= len(data):
+                        continue
+                    with open(variant + '.tmp', 'wb') as out:
+                        out.write(compressed)
+                    os.replace(variant + '.tmp', variant)
+                    count += 1
+    LOGGER.info("precompressed %s files in %s", count, folder)
+    return count
+
+
+def _wrap_file(environ, fp, length=None):
+    """Return the body of a response with the content of `fp` from its current position.
+
+    The file wrapper of the server sends the whole file, so it is only used when `length` is None, the `length` bytes
+    of a byte range are read in chunks.
+    """
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if file_wrapper and length is None:
+        return file_wrapper(fp, archive.STREAM_CHUNK_SIZE)
+    return _iter_file(fp, length)
+
+
+def _iter_file(fp, length=None):
+    with fp:
+        while length is None or length > 0:
+            chunk = fp.read(archive.STREAM_CHUNK_SIZE if length is None else min(length, archive.STREAM_CHUNK_SIZE))
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
@@ -1,20 +1,65 @@
 import argparse
+import asyncio
+import collections
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import time
+import xml.etree.ElementTree as ET
+
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+import yaml
+
+NAMESPACES = {
+    'wps': 'http://www.opengis.net/wps/1.0.0',
+    'ows': 'http://www.opengis.net/ows/1.1',
+    'xlink': 'http://www.w3.org/1999/xlink',
+}
+
+# columns of a job in a batch matrix, all other columns are passed as inputs of the process
+JOB_COLUMNS = ['process', 'model', 'experiment', 'ensemble', 'start_year', 'end_year']
+SUMMARY_COLUMNS = ['process', 'inputs', 'status', 'seconds', 'message', 'status_location']
+
+# request kinds of a benchmark
+BENCH_REQUESTS = ['getcapabilities', 'describeprocess', 'meta', 'sleep']
+
+
+def execute_query(scheme, wps_service, port, process, inputs, asynchronous=True):
+    """Return the url of an Execute request, `inputs` is a list of (identifier, value) tuples."""
+    data_inputs = ''.join(f'{identifier}={value};' for identifier, value in inputs)
+    query = f'{scheme}://{wps_service}:{port}/wps?service=wps&request=Execute&version=1.0.0&identifier={process}'
+    if asynchronous:
+        query += '&storeExecuteResponse=true&status=true'
+    query += f'&DataInputs={data_inputs}'
+    return query
+
+
+def _session(concurrency):
+    """Return a session keeping a connection per concurrent request open."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 def execute(scheme, wps_service, port, process, models, experiments, ensembles, start_year=None, end_year=None):
-    inputs = f'DataInputs='
+    inputs = []
     if models and experiments and ensembles:
         for model, experiment, ensemble in zip(models, experiments, ensembles):
-            inputs += f'model={model};experiment={experiment};ensemble={ensemble};'
+            inputs.extend([('model', model), ('experiment', experiment), ('ensemble', ensemble)])
 
     if start_year:
-        inputs += f'start_year={start_year};'
+        inputs.append(('start_year', start_year))
     if end_year:
-        inputs += f'end_year={end_year}'
+        inputs.append(('end_year', end_year))
 
-    query = f'{scheme}://{wps_service}:{port}/wps?service=wps&request=Execute&version=1.0.0&identifier={process}'
-    query += f'&storeExecuteResponse=true&status=true&{inputs}'
+    query = execute_query(scheme, wps_service, port, process, inputs)
 
     print(f'Executing query: {query}')
     response = requests.get(query)
@@ -26,6 +71,298 @@ def execute(scheme, wps_service, port, process, models, experiments, ensembles,
         response.raise_for_status()
 
 
+def load_matrix(path):
+    """Return the jobs of a batch, dicts with the process and its inputs, from a csv or yaml file.
+
+    A csv file has a job per row with a `process` column and a column per input. A yaml file has a list of jobs,
+    the values of a job can be lists, which are expanded to a job for every combination of values.
+    """
+    if os.path.splitext(path)[1].lower() in ('.yml', '.yaml'):
+        with open(path) as fp:
+            entries = yaml.safe_load(fp) or []
+        jobs = []
+        for entry in entries:
+            keys = list(entry)
+            values = [value if isinstance(value, list) else [value] for value in entry.values()]
+            jobs.extend(dict(zip(keys, combination)) for combination in itertools.product(*values))
+    else:
+        with open(path, newline='') as fp:
+            jobs = list(csv.DictReader(fp))
+    return [{key: value for key, value in job.items() if value not in (None, '')} for job in jobs]
+
+
+def _job_inputs(job):
+    columns = [column for column in JOB_COLUMNS[1:] if column in job]
+    columns += sorted(column for column in job if column not in JOB_COLUMNS)
+    return [(column, job[column]) for column in columns]
+
+
+def parse_status(document):
+    """Return the status (accepted, started, succeeded or failed), the message, the status location and the output
+    references of an Execute response."""
+    root = ET.fromstring(document)
+    if root.tag == '{%s}ExceptionReport' % NAMESPACES['ows']:
+        return 'failed', ' '.join(root.itertext()).strip(), None, {}
+
+    status_location = root.get('statusLocation')
+    status, message = 'accepted', ''
+    status_element = root.find('wps:Status', NAMESPACES)
+    if status_element is not None and len(status_element):
+        element = status_element[0]
+        status = element.tag.split('}')[1].replace('Process', '').lower()
+        message = ' '.join(element.itertext()).strip()
+
+    references = {}
+    for output in root.findall('wps:ProcessOutputs/wps:Output', NAMESPACES):
+        reference = output.find('wps:Reference', NAMESPACES)
+        if reference is None:
+            continue
+        href = reference.get('href') or reference.get('{%s}href' % NAMESPACES['xlink'])
+        # outputs without a file, like the profile of a run without profiling, have an empty reference
+        if href:
+            references[output.findtext('ows:Identifier', namespaces=NAMESPACES)] = href
+    return status, message, status_location, references
+
+
+class BatchClient():
+    """Submit Execute requests concurrently and poll their status until they finish.
+
+    Requests are sent from a pool of `concurrency` threads sharing a session with a pool of connections, and are
+    scheduled by an asyncio event loop. The status of a job is polled every `poll_interval` seconds, the interval
+    grows with every poll up to `max_poll_interval`.
+    """
+    def __init__(self, scheme, wps_service, port, concurrency=8, poll_interval=2, max_poll_interval=60,
+                 timeout=6 * 3600, download_dir=None):
+        self.scheme = scheme
+        self.wps_service = wps_service
+        self.port = port
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.download_dir = download_dir
+
+        self.session = _session(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _get(self, url):
+        response = self.session.get(url, timeout=60)
+        response.raise_for_status()
+        return response.content
+
+    def _download(self, url, path):
+        with self.session.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as fp:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    fp.write(chunk)
+
+    async def _call(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, function, *args)
+
+    async def download(self, number, job, references, result):
+        """Download the outputs of a job, a failed download is added to the message and does not fail the job."""
+        job_dir = os.path.join(self.download_dir, f'{number:04d}_{job["process"]}')
+        os.makedirs(job_dir, exist_ok=True)
+        errors = []
+        for identifier, url in references.items():
+            filename = identifier + os.path.splitext(url.split('?')[0])[1]
+            try:
+                await self._call(self._download, url, os.path.join(job_dir, filename))
+            except Exception as e:
+                errors.append(f'{identifier}: {e}')
+        if errors:
+            result['message'] = ' '.join([result['message'], 'download failed:', '; '.join(errors)]).strip()
+
+    async def run_job(self, number, job, semaphore):
+        inputs = _job_inputs(job)
+        result = dict(process=job.get('process'), inputs=';'.join(f'{key}={value}' for key, value in inputs),
+                      status='failed', message='', status_location='')
+        started = time.time()
+        async with semaphore:
+            try:
+                query = execute_query(self.scheme, self.wps_service, self.port, job['process'], inputs)
+                status, message, status_location, references = parse_status(await self._call(self._get, query))
+                result['status_location'] = status_location or ''
+
+                interval = self.poll_interval
+                while status in ('accepted', 'started', 'paused') and status_location:
+                    if time.time() - started > self.timeout:
+                        status, message = 'timeout', f'no result after {self.timeout} seconds'
+                        break
+                    await asyncio.sleep(interval)
+                    interval = min(interval * 1.5, self.max_poll_interval)
+                    status, message, _, references = parse_status(await self._call(self._get, status_location))
+
+                result.update(status=status, message=message)
+                if status == 'succeeded' and self.download_dir:
+                    await self.download(number, job, references, result)
+            except Exception as e:
+                result['message'] = str(e)
+        result['seconds'] = round(time.time() - started, 1)
+        print(f'{result["process"]} {result["inputs"]}: {result["status"]} {result["message"]}')
+        return result
+
+    async def _run(self, jobs):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*[self.run_job(number, job, semaphore) for number, job in enumerate(jobs)])
+
+    def run(self, jobs):
+        """Run all jobs and return a summary dict per job."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(self._run(jobs))
+        finally:
+            loop.close()
+            self._executor.shutdown()
+            self.session.close()
+
+
+def write_summary(results, path):
+    """Write the summary of a batch as csv file and print it as table."""
+    with open(path, 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=SUMMARY_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+    columns = SUMMARY_COLUMNS[:4]
+    widths = [max([len(column)] + [len(str(result[column])) for result in results]) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print('  '.join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+    succeeded = sum(result['status'] == 'succeeded' for result in results)
+    print(f'{succeeded} of {len(results)} jobs succeeded, summary written to {path}')
+    return succeeded == len(results)
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of the sorted `values`."""
+    if not values:
+        return None
+    return values[max(0, min(len(values), math.ceil(percent / 100 * len(values))) - 1)]
+
+
+def _exception_code(content, status_code):
+    """Return the exception code of an ExceptionReport, like ServerBusy, or the HTTP status code."""
+    try:
+        exception = ET.fromstring(content).find('ows:Exception', NAMESPACES)
+    except ET.ParseError:
+        exception = None
+    if exception is not None and exception.get('exceptionCode'):
+        return exception.get('exceptionCode')
+    return f'HTTP {status_code}'
+
+
+def parse_mix(mix):
+    """Return the weights of the request kinds of a benchmark from a string like `getcapabilities=4,sleep=1`."""
+    weights = {}
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip().lower()
+        if kind not in BENCH_REQUESTS:
+            raise ValueError(f'unknown request {kind}, choose from {", ".join(BENCH_REQUESTS)}')
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+class LoadTest():
+    """Send a mix of requests at a fixed concurrency and measure their latency.
+
+    `mix` maps the request kinds in BENCH_REQUESTS to their weights. Executions of `sleep` and `meta` are synchronous,
+    so their latency includes the time the request waits for a free process of the service.
+    """
+    def __init__(self, scheme, wps_service, port, mix, concurrency=16, sleep_delay=0.01, seed=0):
+        self.base_url = f'{scheme}://{wps_service}:{port}/wps'
+        self.queries = {
+            'getcapabilities': f'{self.base_url}?service=wps&request=GetCapabilities&version=1.0.0',
+            'describeprocess': f'{self.base_url}?service=wps&request=DescribeProcess&version=1.0.0&identifier=all',
+            'meta': execute_query(scheme, wps_service, port, 'meta', [], asynchronous=False),
+            'sleep': execute_query(scheme, wps_service, port, 'sleep', [('delay', sleep_delay)], asynchronous=False),
+        }
+        self.mix = mix
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+        self.session = _session(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _request(self, kind):
+        """Send a request and return its latency in seconds and the error, None if it succeeded."""
+        started = time.perf_counter()
+        try:
+            response = self.session.get(self.queries[kind], timeout=600)
+            content = response.content
+            error = None if response.status_code == 200 else _exception_code(content, response.status_code)
+            if error is None and kind in ('meta', 'sleep') and parse_status(content)[0] != 'succeeded':
+                error = 'execution failed'
+        except Exception as e:
+            error = type(e).__name__
+        return time.perf_counter() - started, error
+
+    async def _worker(self, kinds, samples):
+        loop = asyncio.get_event_loop()
+        while kinds:
+            kind = kinds.pop()
+            latency, error = await loop.run_in_executor(self._executor, self._request, kind)
+            samples.append((kind, latency, error))
+
+    def run(self, count):
+        """Send `count` requests and return the report."""
+        kinds = self.random.choices(list(self.mix), weights=list(self.mix.values()), k=count)
+        samples = []
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        started = time.perf_counter()
+        try:
+            loop.run_until_complete(asyncio.gather(*[self._worker(kinds, samples) for _ in range(self.concurrency)]))
+        finally:
+            loop.close()
+            self._executor.shutdown()
+            self.session.close()
+        return bench_report(samples, time.perf_counter() - started, self.concurrency)
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def bench_report(samples, duration, concurrency):
+    """Summarize (kind, latency, error) samples per request kind and in total."""
+    def summary(selected):
+        latencies = sorted(latency * 1000 for _, latency, _ in selected)
+        errors = collections.Counter(error for _, _, error in selected if error)
+        return {
+            'requests': len(selected),
+            'errors': sum(errors.values()),
+            'error_rate': round(sum(errors.values()) / len(selected), 4) if selected else 0,
+            'error_kinds': dict(errors),
+            'throughput': round(len(selected) / duration, 2) if duration else None,
+            'mean_ms': _round(sum(latencies) / len(latencies) if latencies else None),
+            'p50_ms': _round(percentile(latencies, 50)),
+            'p95_ms': _round(percentile(latencies, 95)),
+            'p99_ms': _round(percentile(latencies, 99)),
+        }
+
+    kinds = sorted(set(kind for kind, _, _ in samples))
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'duration_s': round(duration, 3),
+        'concurrency': concurrency,
+        'total': summary(samples),
+        'requests': {kind: summary([sample for sample in samples if sample[0] == kind]) for kind in kinds},
+    }
+
+
+def print_report(report):
+    columns = ['requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms']
+    rows = [(kind, summary) for kind, summary in sorted(report['requests'].items())] + [('total', report['total'])]
+    print('request'.ljust(16) + ''.join(column.rjust(12) for column in columns))
+    for kind, summary in rows:
+        values = ['{:.1f}'.format(summary[column]) if isinstance(summary[column], float) else str(summary[column])
+                  for column in columns]
+        print(kind.ljust(16) + ''.join(value.rjust(12) for value in values))
+
+
 def canary():
     parser = argparse.ArgumentParser(description="""Command line to interact with a WPS service.
 
@@ -49,9 +386,50 @@ def canary():
     execute_parser.add_argument('--start-year', type=int, required=False, help='The start year')
     execute_parser.add_argument('--end-year', type=int, required=False, help='The end year')
 
+    batch_parser = subparsers.add_parser('batch',
+                                         description='Execute the jobs of a csv or yaml matrix concurrently',
+                                         parents=[common])
+    batch_parser.add_argument('matrix', type=str, help='csv or yaml file with a process and its inputs per job')
+    batch_parser.add_argument('--concurrency', type=int, default=8, help='number of jobs submitted at the same time')
+    batch_parser.add_argument('--poll-interval', type=float, default=2, help='first interval of status polls')
+    batch_parser.add_argument('--max-poll-interval', type=float, default=60, help='max interval of status polls')
+    batch_parser.add_argument('--timeout', type=float, default=6 * 3600, help='seconds to wait for a job')
+    batch_parser.add_argument('--download-dir', type=str, help='folder to download the outputs of the jobs to')
+    batch_parser.add_argument('--summary', type=str, default='summary.csv', help='csv file of the summary')
+
+    bench_parser = subparsers.add_parser('bench', description='Measure the latency of a mix of requests',
+                                         parents=[common])
+    bench_parser.add_argument('--mix', type=str, default='getcapabilities=4,describeprocess=2,meta=1,sleep=1',
+                              help='weights of the requests, from {}'.format(', '.join(BENCH_REQUESTS)))
+    bench_parser.add_argument('--requests', type=int, default=200, help='number of requests to send')
+    bench_parser.add_argument('--concurrency', type=int, default=16, help='number of requests sent at the same time')
+    bench_parser.add_argument('--sleep-delay', type=float, default=0.01, help='delay of the sleep process')
+    bench_parser.add_argument('--seed', type=int, default=0, help='seed of the random order of the requests')
+    bench_parser.add_argument('--output', type=str, help='json file to write the results to')
+
     args = parser.parse_args()
 
     print(args)
+    if args.command == 'bench':
+        test = LoadTest(args.scheme, args.wps_service, args.port, parse_mix(args.mix), concurrency=args.concurrency,
+                        sleep_delay=args.sleep_delay, seed=args.seed)
+        report = test.run(args.requests)
+        print_report(report)
+        if args.output:
+            report['mix'] = parse_mix(args.mix)
+            with open(args.output, 'w') as fp:
+                json.dump(report, fp, indent=2)
+        return
+
+    if args.command == 'batch':
+        client = BatchClient(args.scheme, args.wps_service, args.port, concurrency=args.concurrency,
+                             poll_interval=args.poll_interval, max_poll_interval=args.max_poll_interval,
+                             timeout=args.timeout, download_dir=args.download_dir)
+        results = client.run(load_matrix(args.matrix))
+        if not write_summary(results, args.summary):
+            raise SystemExit(1)
+        return
+
     execute(
         args.scheme,
         args.wps_service,
@@ -0,0 +1,61 @@
+"""Report the time taken to import the modules of the service.
+
+Every module is imported in a new interpreter started with ``-X importtime``, which writes the time taken by every
+import to stderr (Python 3.7 and later). Older interpreters only report the total time.
+"""
+import collections
+import re
+import subprocess
+import sys
+
+# modules loaded by the command line, the esmvaltool workers and the wsgi server
+MODULES = ['c3s_magic_wps.cli', 'c3s_magic_wps.worker_pool', 'c3s_magic_wps.runner', 'c3s_magic_wps.wsgi']
+
+# written to stderr before the module is imported, the imports of the interpreter startup come before it
+_MARKER = '-- import --'
+
+_SCRIPT = """
+import importlib
+import sys
+import time
+sys.stderr.write('{}\\n')
+sys.stderr.flush()
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(time.perf_counter() - start)
+""".format(_MARKER)
+
+# import time: self [us] | cumulative | imported package
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)\s*$')
+
+Import = collections.namedtuple('Import', ['module', 'seconds', 'cumulative_seconds'])
+
+ImportReport = collections.namedtuple('ImportReport', ['module', 'seconds', 'imports'])
+
+
+def parse(text):
+    """Return the imports of the ``-X importtime`` output `text`."""
+    imports = []
+    for line in text.splitlines():
+        match = _LINE.match(line)
+        if match:
+            imports.append(Import(match.group(3), int(match.group(1)) / 1e6, int(match.group(2)) / 1e6))
+    return imports
+
+
+def by_package(imports):
+    """Return the time taken by the imports of every top-level package, the slowest first."""
+    seconds = collections.Counter()
+    for item in imports:
+        seconds[item.module.split('.')[0]] += item.seconds
+    return seconds.most_common()
+
+
+def measure(module, python=None):
+    """Import `module` in a new interpreter and return the ImportReport."""
+    completed = subprocess.run([python or sys.executable, '-X', 'importtime', '-c', _SCRIPT, module],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if completed.returncode:
+        error = completed.stderr.strip().splitlines() or ['exit status {}'.format(completed.returncode)]
+        raise RuntimeError('cannot import {}: {}'.format(module, error[-1]))
+    return ImportReport(module, float(completed.stdout.split()[-1]), parse(completed.stderr.split(_MARKER)[-1]))
@@ -0,0 +1,142 @@
+import contextlib
+import fcntl
+import importlib
+import json
+import os
+import resource
+import time
+
+import psutil
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# file in the workdir of a job with the measurements of its phases
+SIDECAR = 'timings.json'
+
+_sinks = []
+_configured_sinks = None
+
+
+def add_sink(sink):
+    """Add a metrics sink, a callable receiving the measurement of every phase as a dict."""
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def log_sink(measurement):
+    LOGGER.info("%s took %.1f seconds, %.1f cpu seconds (%.1f in subprocesses), peak rss %s MB, read %s bytes, "
+                "written %s bytes", measurement['phase'], measurement['wall_seconds'], measurement['cpu_seconds'],
+                measurement['child_cpu_seconds'], measurement['peak_rss_mb'], measurement['read_bytes'],
+                measurement['write_bytes'])
+
+
+def _load_sink(name):
+    module, _, attribute = name.partition(':')
+    return getattr(importlib.import_module(module), attribute)
+
+
+def get_sinks():
+    """Return the added sinks and the sinks configured in the `instrumentation` section."""
+    global _configured_sinks
+    if _configured_sinks is None:
+        names = configuration.get_config_value('instrumentation', 'sinks') or ''
+        _configured_sinks = []
+        for name in names.replace(',', ' ').split():
+            try:
+                _configured_sinks.append(_load_sink(name))
+            except (ImportError, AttributeError, ValueError):
+                LOGGER.exception("cannot load the metrics sink %s", name)
+    return _configured_sinks + _sinks
+
+
+def _usage():
+    process = psutil.Process()
+    try:
+        io = process.io_counters()
+    except (AttributeError, psutil.Error):
+        io = None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'time': time.time(),
+        'cpu': own.ru_utime + own.ru_stime,
+        'child_cpu': children.ru_utime + children.ru_stime,
+        # kilobytes on linux
+        'maxrss': max(own.ru_maxrss, children.ru_maxrss),
+        'read_bytes': io.read_bytes if io else None,
+        'write_bytes': io.write_bytes if io else None,
+    }
+
+
+def _difference(end, start, key):
+    if end[key] is None or start[key] is None:
+        return None
+    return end[key] - start[key]
+
+
+def write_sidecar(workdir, measurement):
+    """Add a measurement to the sidecar file in the workdir of a job."""
+    path = os.path.join(workdir, SIDECAR)
+    with open(path, 'a+') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        fp.seek(0)
+        content = fp.read()
+        measurements = json.loads(content)['phases'] if content else []
+        measurements.append(measurement)
+        fp.seek(0)
+        fp.truncate()
+        json.dump({'phases': measurements}, fp, indent=2)
+
+
+def read_sidecar(workdir):
+    """Return the measurements in the sidecar file in the workdir of a job."""
+    try:
+        with open(os.path.join(workdir, SIDECAR)) as fp:
+            return json.load(fp)['phases']
+    except (IOError, OSError, ValueError, KeyError):
+        return []
+
+
+@contextlib.contextmanager
+def phase(name, workdir, **labels):
+    """Measure a phase of the job in `workdir`.
+
+    The wall time, the cpu time of this process and of its finished subprocesses, the peak resident memory and the
+    bytes read and written are written to the sidecar file in the workdir and passed on to the metrics sinks, with the
+    `labels`. The cpu time and the bytes are counted for the whole process, including other threads. The peak memory
+    is the high-water mark of the process up to the end of the phase.
+    """
+    start = _usage()
+    measurement = dict(labels, phase=name, workdir=workdir, started=start['time'])
+    success = False
+    try:
+        yield measurement
+        success = True
+    finally:
+        end = _usage()
+        measurement.update(
+            success=success,
+            wall_seconds=end['time'] - start['time'],
+            cpu_seconds=end['cpu'] - start['cpu'],
+            child_cpu_seconds=end['child_cpu'] - start['child_cpu'],
+            peak_rss_mb=round(end['maxrss'] / 1024, 1),
+            read_bytes=_difference(end, start, 'read_bytes'),
+            write_bytes=_difference(end, start, 'write_bytes'),
+        )
+        try:
+            write_sidecar(workdir, measurement)
+        except (OSError, ValueError):
+            LOGGER.exception("cannot write the measurement of %s to %s", name, workdir)
+        for sink in get_sinks():
+            try:
+                sink(measurement)
+            except Exception:
+                LOGGER.exception("metrics sink %r failed", sink)
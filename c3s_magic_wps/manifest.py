@@ -0,0 +1,100 @@
+import collections
+import fnmatch
+import os
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# number of manifests kept per process, a job only needs the manifest of its own output
+MAX_MANIFESTS = 8
+
+
+def _match_parts(parts, patterns):
+    """Match path components like `glob` does, wildcards do not match the separator or leading dots."""
+    if len(parts) != len(patterns):
+        return False
+    for part, pattern in zip(parts, patterns):
+        if part.startswith('.') and not pattern.startswith('.'):
+            return False
+        if not fnmatch.fnmatchcase(part, pattern):
+            return False
+    return True
+
+
+def _split(relpath):
+    relpath = os.path.normpath(relpath)
+    return [] if relpath == os.curdir else relpath.split(os.sep)
+
+
+class OutputManifest():
+    """Index of the files in an esmvaltool output tree.
+
+    The tree is walked once, and the files are indexed by their folder and extension, so looking up the outputs of
+    a process does not touch the file system again.
+    """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.index = collections.defaultdict(list)
+        count = 0
+        for dirpath, dirs, files in os.walk(self.root):
+            dirs.sort()
+            reldir = tuple(_split(os.path.relpath(dirpath, self.root)))
+            for name in sorted(files):
+                self.index[(reldir, os.path.splitext(name)[1])].append(name)
+                count += 1
+        LOGGER.debug("indexed %s output files in %s", count, self.root)
+
+    def contains(self, path):
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def find(self, pattern):
+        """Return the files matching the glob `pattern`, an absolute path in the tree, in sorted order."""
+        return self.find_all([pattern])[pattern]
+
+    def find_all(self, patterns):
+        """Return the files matching each of the glob `patterns` in a single pass over the manifest."""
+        lookups = []
+        for pattern in patterns:
+            parts = _split(os.path.relpath(pattern, self.root))
+            if not parts or parts[0] == os.pardir:
+                continue
+            ext = os.path.splitext(parts[-1])[1]
+            # files are looked up by extension when the pattern ends in a literal one, a name pattern like `foo*`
+            # also matches files with an extension
+            if not ext or any(c in ext for c in '*?['):
+                ext = None
+            lookups.append((pattern, parts[:-1], parts[-1], ext))
+
+        matches = {pattern: [] for pattern in patterns}
+        for (reldir, file_ext), names in self.index.items():
+            for pattern, dir_patterns, name_pattern, ext in lookups:
+                if ext is not None and file_ext != ext:
+                    continue
+                if not _match_parts(list(reldir), dir_patterns):
+                    continue
+                for name in names:
+                    if _match_parts([name], [name_pattern]):
+                        matches[pattern].append(os.path.join(self.root, *(reldir + (name,))))
+        return {pattern: sorted(found) for pattern, found in matches.items()}
+
+
+_manifests = collections.OrderedDict()
+
+
+def add_manifest(root):
+    """Index the output tree at `root` and use it for lookups of paths in this tree."""
+    manifest = OutputManifest(root)
+    _manifests.pop(manifest.root, None)
+    _manifests[manifest.root] = manifest
+    while len(_manifests) > MAX_MANIFESTS:
+        _manifests.popitem(last=False)
+    return manifest
+
+
+def get_manifest(path):
+    """Return the manifest of the output tree containing `path`, indexing `path` when there is none."""
+    for manifest in reversed(list(_manifests.values())):
+        if manifest.contains(path):
+            return manifest
+    return add_manifest(path)
@@ -0,0 +1,292 @@
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from pywps import configuration
+
+from . import runtimes, scheduler, worker_pool
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+PREFIX = 'c3s_magic_wps_'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds of the buckets of the runtime histograms in seconds
+RUNTIME_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200)
+
+# seconds the disk usage of the folders is kept, walking the outputs is expensive
+DISK_USAGE_TTL = 60
+
+# status codes of the jobs in the pywps database
+_SUCCEEDED, _FAILED = 4, 5
+
+_COUNTERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+"""
+
+
+class Counters():
+    """Counters shared by all processes of the service, like the lookups in the caches, kept in SQLite."""
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(_COUNTERS_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def increment(self, name, amount=1, **labels):
+        key = json.dumps(labels, sort_keys=True)
+        with self._connect() as connection:
+            connection.execute('INSERT OR IGNORE INTO counters (name, labels, value) VALUES (?, ?, 0)', (name, key))
+            connection.execute('UPDATE counters SET value = value + ? WHERE name = ? AND labels = ?',
+                               (amount, name, key))
+
+    def values(self, name):
+        """Return the labels and values of a counter."""
+        with self._connect() as connection:
+            rows = connection.execute('SELECT labels, value FROM counters WHERE name = ? ORDER BY labels',
+                                      (name, )).fetchall()
+        return [(json.loads(labels), value) for labels, value in rows]
+
+
+_counters = dict()
+
+
+def get_counters():
+    """Return the Counters configured in the `metrics` section."""
+    path = configuration.get_config_value('metrics', 'counters_db') or os.path.join(
+        configuration.get_config_value('server', 'workdir') or tempfile.gettempdir(), 'c3s_magic_wps-counters.sqlite')
+    if path not in _counters:
+        _counters[path] = Counters(path)
+    return _counters[path]
+
+
+def count(name, amount=1, **labels):
+    """Increment a shared counter, a failure is logged and does not affect the job."""
+    if not amount:
+        return
+    try:
+        get_counters().increment(name, amount, **labels)
+    except Exception:
+        LOGGER.exception("cannot count %s", name)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(families):
+    """Return the metric families in the Prometheus text format.
+
+    A family is a tuple of its name, type, help text and samples, a sample a tuple of the suffix of the name, the labels
+    and the value.
+    """
+    lines = []
+    for name, kind, text, samples in families:
+        lines.append('# HELP {}{} {}'.format(PREFIX, name, text))
+        lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+        for suffix, labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(key, _escape(labels[key])) for key in sorted(labels))
+            lines.append('{}{}{}{} {}'.format(PREFIX, name, suffix, '{' + label_text + '}' if label_text else '',
+                                              _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def histogram(observations, buckets=RUNTIME_BUCKETS):
+    """Return the samples of a histogram of the `(labels, value)` observations, per distinct labels."""
+    groups = dict()
+    for labels, value in observations:
+        groups.setdefault(tuple(sorted(labels.items())), []).append(value)
+    samples = []
+    for key, values in sorted(groups.items()):
+        labels = dict(key)
+        for bound in tuple(buckets) + (float('inf'), ):
+            samples.append(('_bucket', dict(labels, le=_format_value(bound)),
+                            sum(1 for value in values if value <= bound)))
+        samples.append(('_sum', labels, sum(values)))
+        samples.append(('_count', labels, len(values)))
+    return samples
+
+
+def _job_families():
+    # imported here, the jobs count the cache requests without loading the database models
+    from pywps import dblog
+    from sqlalchemy import func
+
+    session = dblog.get_session()
+    try:
+        rows = session.query(dblog.ProcessInstance.identifier, dblog.ProcessInstance.status,
+                             func.count(dblog.ProcessInstance.uuid)) \
+            .filter(dblog.ProcessInstance.operation == 'execute') \
+            .group_by(dblog.ProcessInstance.identifier, dblog.ProcessInstance.status).all()
+    finally:
+        session.close()
+    running, stored = dblog.get_process_counts()
+
+    submitted, succeeded, failed = dict(), dict(), dict()
+    for identifier, status, jobs in rows:
+        submitted[identifier] = submitted.get(identifier, 0) + jobs
+        if status == _SUCCEEDED:
+            succeeded[identifier] = succeeded.get(identifier, 0) + jobs
+        elif status == _FAILED:
+            failed[identifier] = failed.get(identifier, 0) + jobs
+    return [
+        ('jobs_submitted_total', 'counter', 'Jobs submitted per process.',
+         [('', {'process': identifier}, jobs) for identifier, jobs in sorted(submitted.items())]),
+        ('jobs_succeeded_total', 'counter', 'Jobs succeeded per process.',
+         [('', {'process': identifier}, jobs) for identifier, jobs in sorted(succeeded.items())]),
+        ('jobs_failed_total', 'counter', 'Jobs failed per process.',
+         [('', {'process': identifier}, jobs) for identifier, jobs in sorted(failed.items())]),
+        ('jobs_running', 'gauge', 'Jobs running.', [('', {}, running)]),
+        ('jobs_queued', 'gauge', 'Jobs queued by pywps, waiting for one of the parallelprocesses.',
+         [('', {}, stored)]),
+    ]
+
+
+def _runtime_families():
+    runs = runtimes.get_runtime_store().runs()
+    return [
+        ('phase_seconds', 'histogram', 'Runtime of the phases of the jobs per process.',
+         histogram(({'process': process, 'phase': phase}, seconds) for process, phase, seconds in runs)),
+    ]
+
+
+def _scheduler_families():
+    queue = scheduler.get_job_queue()
+    samples = [('', {'lane': lane}, len(queue.waiting(lane))) for lane in scheduler.LANES]
+    families = [('esmvaltool_waiting_jobs', 'gauge', 'Jobs waiting for a slot of their lane.', samples)]
+
+    pool = worker_pool.current_worker_pool()
+    if pool is not None:
+        size, idle = pool.size(), pool.idle()
+        families.append(('esmvaltool_workers', 'gauge', 'Esmvaltool worker processes.',
+                         [('', {'state': 'busy'}, max(size - idle, 0)), ('', {'state': 'idle'}, idle)]))
+    return families
+
+
+def _data_families():
+    # imported here, the processes import the runner which counts the cache requests
+    from .processes.utils.data_finder import DataFinder
+
+    finder = DataFinder.loaded_instance()
+    if finder is None:
+        return []
+    return [
+        ('data_index_datasets', 'gauge', 'Datasets in the index of the model data.', [('', {}, len(finder.index[0]))]),
+        ('data_index_age_seconds', 'gauge', 'Seconds since the model data was scanned.',
+         [('', {}, time.time() - finder.scanner.scanned)]),
+    ]
+
+
+def _cache_families():
+    requests = get_counters().values('cache_requests')
+    ratios = []
+    for cache in sorted({labels['cache'] for labels, _ in requests}):
+        hits = sum(value for labels, value in requests if labels == {'cache': cache, 'result': 'hit'})
+        total = sum(value for labels, value in requests if labels['cache'] == cache)
+        ratios.append(('', {'cache': cache}, hits / total if total else 0))
+    return [
+        ('cache_requests_total', 'counter', 'Lookups in the result and preprocessing caches.',
+         [('', labels, value) for labels, value in requests]),
+        ('cache_hit_ratio', 'gauge', 'Share of the lookups found in the cache.', ratios),
+    ]
+
+
+_disk_usage = dict()
+
+
+def disk_usage(path):
+    """Return the bytes and number of files in a folder, kept for DISK_USAGE_TTL seconds."""
+    cached = _disk_usage.get(path)
+    if cached is None or time.time() - cached[0] > DISK_USAGE_TTL:
+        size = files = 0
+        for root, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    size += os.lstat(os.path.join(root, filename)).st_size
+                except OSError:
+                    continue
+                files += 1
+        cached = _disk_usage[path] = (time.time(), size, files)
+    return cached[1:]
+
+
+def _disk_families():
+    folders = {
+        'outputs': configuration.get_config_value('server', 'outputpath'),
+        'result_cache': configuration.get_config_value('cache', 'result_dir'),
+        'preproc_cache': configuration.get_config_value('cache', 'preproc_dir'),
+    }
+    usage = {name: disk_usage(path) for name, path in folders.items() if path and os.path.isdir(path)}
+    return [
+        ('disk_usage_bytes', 'gauge', 'Bytes used by the outputs and caches.',
+         [('', {'folder': name}, size) for name, (size, _) in sorted(usage.items())]),
+        ('disk_usage_files', 'gauge', 'Files in the outputs and caches.',
+         [('', {'folder': name}, files) for name, (_, files) in sorted(usage.items())]),
+    ]
+
+
+COLLECTORS = [_job_families, _runtime_families, _scheduler_families, _data_families, _cache_families, _disk_families]
+
+
+def collect():
+    """Return the metric families of the service, a failing source is logged and left out."""
+    families = []
+    for collector in COLLECTORS:
+        try:
+            families.extend(collector())
+        except Exception:
+            LOGGER.exception("cannot collect the metrics of %s", collector.__name__)
+    return families
+
+
+def write_scrape_file(path):
+    """Write the metrics to a file, for the textfile collector of the node exporter or for testing."""
+    tmp_file = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_file, 'w') as fp:
+        fp.write(render(collect()))
+    os.replace(tmp_file, path)
+
+
+class MetricsEndpoint():
+    """WSGI middleware answering GET requests of `path` with the metrics of the service in the Prometheus format."""
+    def __init__(self, app, path='/metrics'):
+        self.app = app
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self.path or environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+        body = render(collect()).encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', CONTENT_TYPE),
+            ('Content-Length', str(len(body))),
+            ('Cache-Control', 'no-cache'),
+        ])
+        return [body] if environ.get('REQUEST_METHOD', 'GET') == 'GET' else []
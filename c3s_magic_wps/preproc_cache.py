@@ -0,0 +1,185 @@
+import contextlib
+import hashlib
+import inspect
+import json
+import os
+import re
+
+from pywps import configuration
+
+from . import metrics
+from .result_cache import _esmvaltool_version, _link_or_copy
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# facets of a preprocessed dataset which are part of the cache key, next to the preprocessor settings
+KEY_FACETS = ['project', 'dataset', 'exp', 'ensemble', 'mip', 'short_name', 'start_year', 'end_year']
+
+# preprocessor functions combining several datasets, tasks using them are never cached
+DEFAULT_MULTI_MODEL_FUNCTIONS = {'multi_model_statistics', 'mask_fillvalues'}
+
+# esmvaltool versions whose PreprocessingTask is wrapped by the cache
+SUPPORTED_ESMVALTOOL_VERSIONS = ('2.0a2', )
+
+
+class PreprocCache():
+    """Cache of preprocessed datasets shared by all jobs.
+
+    An entry is a single preprocessed netcdf file keyed by a hash of the dataset facets, the preprocessor settings,
+    the ESMValTool version and the input files. Entries are evicted least recently used first when the cache grows
+    beyond `max_size` bytes.
+    """
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, product, run_output_dir):
+        """Return the cache key of an esmvaltool PreprocessorFile.
+
+        Paths in the output dir of the run (`run_output_dir`) differ for every job, so they are left out.
+        """
+        facets = {name: product.attributes.get(name) for name in KEY_FACETS}
+        settings = json.dumps(product.settings, sort_keys=True, default=str)
+        settings = re.sub(re.escape(run_output_dir) + r'[^"]*', '{output}', settings)
+        inputs = []
+        for filename in sorted(getattr(product, 'files', None) or []):
+            stat = os.stat(filename)
+            inputs.append((filename, stat.st_size, stat.st_mtime_ns))
+        content = dict(facets=facets, settings=settings, esmvaltool=_esmvaltool_version(), inputs=inputs)
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key + '.nc')
+
+    def restore(self, key, filename):
+        """Link the cached file to `filename`, returns False when `key` is not cached."""
+        entry = self._entry(key)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            _link_or_copy(entry, filename)
+        except (IOError, OSError):
+            return False
+        # mark the entry as recently used
+        os.utime(entry)
+        return True
+
+    def store(self, key, filename):
+        if not os.path.isfile(filename):
+            return
+        tmp_file = os.path.join(self.cache_dir, '.tmp-{}-{}'.format(os.getpid(), key))
+        try:
+            _link_or_copy(filename, tmp_file)
+            os.replace(tmp_file, self._entry(key))
+        except OSError:
+            LOGGER.debug("preprocessed file %s not stored", filename, exc_info=True)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in `max_size`."""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            LOGGER.debug("evicting preprocessed file %s from cache", path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def cached_task_run(cache, run, write_metadata, run_output_dir, multi_model_functions=DEFAULT_MULTI_MODEL_FUNCTIONS):
+    """Wrap the `_run` method of an esmvaltool PreprocessingTask to consult `cache`.
+
+    Products found in the cache are linked into the preproc dir, the task only preprocesses the missing ones and
+    adds them to the cache. The metadata of the task is written for all products.
+    """
+    def _run(task, input_files):
+        products = task.products
+        if any(step in multi_model_functions for product in products for step in product.settings):
+            return run(task, input_files)
+
+        keys = {product.filename: cache.key(product, run_output_dir) for product in products}
+        missing = [product for product in products if not cache.restore(keys[product.filename], product.filename)]
+        LOGGER.info("%s of %s preprocessed datasets restored from cache", len(products) - len(missing),
+                    len(products))
+        metrics.count('cache_requests', len(products) - len(missing), cache='preproc', result='hit')
+        metrics.count('cache_requests', len(missing), cache='preproc', result='miss')
+        if missing:
+            task.products = type(products)(missing)
+            try:
+                run(task, input_files)
+            finally:
+                task.products = products
+            for product in missing:
+                cache.store(keys[product.filename], product.filename)
+        return write_metadata(products, task.write_ncl_interface)
+
+    return _run
+
+
+def _unsupported(preprocessor):
+    """Return why the PreprocessingTask of the esmvaltool `preprocessor` module cannot be wrapped, None if it can."""
+    version = _esmvaltool_version()
+    if version not in SUPPORTED_ESMVALTOOL_VERSIONS:
+        return 'esmvaltool {} is not supported'.format(version)
+    task = getattr(preprocessor, 'PreprocessingTask', None)
+    if not callable(getattr(task, '_run', None)) or not callable(getattr(preprocessor, 'write_metadata', None)):
+        return 'esmvaltool has no PreprocessingTask._run or write_metadata'
+    if 'write_ncl_interface' not in inspect.signature(task.__init__).parameters:
+        return 'the PreprocessingTask of esmvaltool has no write_ncl_interface'
+    return None
+
+
+@contextlib.contextmanager
+def enabled(cache, run_output_dir):
+    """Let esmvaltool preprocessing tasks started in this context consult `cache`.
+
+    Does nothing when `cache` is None, or when the PreprocessingTask of the installed esmvaltool differs from the one
+    the cache was written for.
+    """
+    if cache is None:
+        yield
+        return
+
+    from esmvaltool import preprocessor
+    reason = _unsupported(preprocessor)
+    if reason:
+        LOGGER.warning("preprocessing without the cache, %s", reason)
+        yield
+        return
+
+    original = preprocessor.PreprocessingTask._run
+    preprocessor.PreprocessingTask._run = cached_task_run(
+        cache, original, preprocessor.write_metadata, run_output_dir,
+        getattr(preprocessor, 'MULTI_MODEL_FUNCTIONS', DEFAULT_MULTI_MODEL_FUNCTIONS))
+    try:
+        yield
+    finally:
+        preprocessor.PreprocessingTask._run = original
+
+
+def get_preproc_cache():
+    """Return the PreprocCache configured in the `cache` section, or None when it is disabled."""
+    cache_dir = configuration.get_config_value('cache', 'preproc_dir')
+    if not cache_dir:
+        return None
+    max_size_mb = int(configuration.get_config_value('cache', 'preproc_max_size_mb') or 51200)
+    return PreprocCache(cache_dir, max_size_mb * 1024 * 1024)
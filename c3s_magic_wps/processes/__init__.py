@@ -1,29 +1,43 @@
-from .wps_sleep import Sleep
-from .wps_meta import Meta
-from .wps_preproc_example import PreprocessExample
-from .wps_consecdrydays import ConsecDryDays
-from .wps_cvdp import CVDP
-from .wps_ensclus import EnsClus
-from .wps_shapeselect import ShapeSelect
-from .wps_blocking import Blocking
-from .wps_zmnam import ZMNAM
-from .wps_teleconnections import Teleconnections
-from .wps_weather_regimes import WeatherRegimes
-from .wps_modes_variability import ModesVariability
-from .wps_combined_indices import CombinedIndices
-from .wps_multimodel_products import MultimodelProducts
-from .wps_heatwaves_coldwaves import HeatwavesColdwaves
-from .wps_diurnal_temperature_index import DiurnalTemperatureIndex
-from .wps_capacity_factor import CapacityFactor
-from .wps_extreme_index import ExtremeIndex
-from .wps_drought_indicator import DroughtIndicator
-from .wps_quantilebias import QuantileBias
-from .wps_toymodel import Toymodel
-from .wps_rainfarm import RainFARM
-from .wps_hyint import HyInt
-from .wps_perfmetrics import Perfmetrics
-from .wps_smpi import SMPI
-from .wps_extreme_events import ExtremeEvents
+"""The processes of the service.
+
+The modules of the processes are imported when the processes are used for the first time, so importing the utilities
+of the processes, like the DataFinder, does not load pywps and every process. Python 3.6 has no module `__getattr__`,
+there the classes of the processes are imported with the package.
+"""
+import collections.abc
+import importlib
+import sys
+import threading
+
+# module of every process, imported when the process is used
+PROCESS_MODULES = {
+    'Meta': 'wps_meta',
+    'CVDP': 'wps_cvdp',
+    'EnsClus': 'wps_ensclus',
+    'Sleep': 'wps_sleep',
+    'Blocking': 'wps_blocking',
+    'PreprocessExample': 'wps_preproc_example',
+    'ZMNAM': 'wps_zmnam',
+    'Teleconnections': 'wps_teleconnections',
+    'WeatherRegimes': 'wps_weather_regimes',
+    'ModesVariability': 'wps_modes_variability',
+    'CombinedIndices': 'wps_combined_indices',
+    'MultimodelProducts': 'wps_multimodel_products',
+    'HeatwavesColdwaves': 'wps_heatwaves_coldwaves',
+    'DiurnalTemperatureIndex': 'wps_diurnal_temperature_index',
+    'CapacityFactor': 'wps_capacity_factor',
+    'ExtremeIndex': 'wps_extreme_index',
+    'DroughtIndicator': 'wps_drought_indicator',
+    'ConsecDryDays': 'wps_consecdrydays',
+    'ShapeSelect': 'wps_shapeselect',
+    'QuantileBias': 'wps_quantilebias',
+    'RainFARM': 'wps_rainfarm',
+    'Toymodel': 'wps_toymodel',
+    'HyInt': 'wps_hyint',
+    'Perfmetrics': 'wps_perfmetrics',
+    'SMPI': 'wps_smpi',
+    'ExtremeEvents': 'wps_extreme_events',
+}
 
 __all__ = sorted(
     [
@@ -52,34 +66,45 @@ __all__ = sorted(
     ]
 )
 
-processes = sorted(
-    [
-        Meta(),
-        CVDP(),
-        EnsClus(),
-        Sleep(),
-        Blocking(),
-        PreprocessExample(),
-        ZMNAM(),
-        Teleconnections(),
-        WeatherRegimes(),
-        ModesVariability(),
-        CombinedIndices(),
-        MultimodelProducts(),
-        HeatwavesColdwaves(),
-        DiurnalTemperatureIndex(),
-        CapacityFactor(),
-        ExtremeIndex(),
-        DroughtIndicator(),
-        ConsecDryDays(),
-        ShapeSelect(),
-        QuantileBias(),
-        RainFARM(),
-        Toymodel(),
-        HyInt(),
-        Perfmetrics(),
-        SMPI(),
-        ExtremeEvents(),
-    ],
-    key=lambda process: process.title,
-)
+
+def _process_class(name):
+    return getattr(importlib.import_module('.' + PROCESS_MODULES[name], __name__), name)
+
+
+def __getattr__(name):
+    if name not in PROCESS_MODULES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    return _process_class(name)
+
+
+if sys.version_info < (3, 7):
+    for _name in PROCESS_MODULES:
+        globals()[_name] = _process_class(_name)
+
+
+def create_processes():
+    """Return new instances of the processes sorted by title, their inputs list the model data available now."""
+    return sorted([_process_class(name)() for name in PROCESS_MODULES], key=lambda process: process.title)
+
+
+class _Processes(collections.abc.Sequence):
+    """The instances of the processes sorted by title, created when the list is used for the first time."""
+    def __init__(self):
+        self._processes = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._processes is None:
+            with self._lock:
+                if self._processes is None:
+                    self._processes = create_processes()
+        return self._processes
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __len__(self):
+        return len(self._load())
+
+
+processes = _Processes()
@@ -2,8 +2,11 @@ from .esmvaltool_utils import (
     year_ranges,
     default_outputs,
     model_experiment_ensemble,
+    available_model_experiment_ensemble,
     outputs_from_plot_names,
     outputs_from_data_names,
 )
 
+from .output_specs import OutputSpec, collect_outputs
+
 from .data_finder import DataFinder
@@ -0,0 +1,202 @@
+import os
+import json
+import logging
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+LOGGER = logging.getLogger("PYWPS")
+
+# bump when the layout of the cache file changes, older caches are then ignored
+CACHE_VERSION = 1
+
+# directories modified this close to the previous scan are always listed again, as a change within the
+# timestamp resolution of the file system does not show up in the mtime
+RACY_WINDOW_NS = 2 * 10**9
+
+
+def _list_directory(path, relpath, mtime, previous, trusted_before):
+    """Return the names and mtimes of the sub directories of `path`.
+
+    When the mtime of the directory is unchanged compared to the `previous` scan, and older than `trusted_before`,
+    the cached names are used instead of listing the directory again.
+    """
+    cached = previous.get(relpath)
+    if cached is not None and cached[0] == mtime and mtime < trusted_before:
+        try:
+            return [(name, os.stat(os.path.join(path, name)).st_mtime_ns) for name in cached[1]]
+        except FileNotFoundError:
+            # the cache is inconsistent with the file system, fall back to listing the directory
+            LOGGER.debug("cached entry for `%s` is out of date", relpath)
+
+    children = []
+    with os.scandir(path) as it:
+        for entry in it:
+            # is_dir uses the d_type returned by the directory listing, so files are never stat'ed
+            if entry.is_dir():
+                children.append((entry.name, entry.stat().st_mtime_ns))
+    return children
+
+
+def _scan_subtree(path, relpath, mtime, previous, trusted_before):
+    """Scan the directory at `path` and everything below it.
+
+    Children of unchanged directories are still visited, as a change deeper in the tree does not update the mtime
+    of the parent directories.
+    """
+    entries = dict()
+    stack = [(path, relpath, mtime)]
+    while stack:
+        path, relpath, mtime = stack.pop()
+        children = _list_directory(path, relpath, mtime, previous, trusted_before)
+        entries[relpath] = (mtime, [name for name, _ in children])
+
+        # push in reverse so the children are visited in listing order
+        for name, child_mtime in reversed(children):
+            stack.append((os.path.join(path, name), os.path.join(relpath, name), child_mtime))
+
+    return entries
+
+
+class ArchiveScanner():
+    """Scans the folders of the archive into the tree used by the DataFinder.
+
+    The result of a scan is kept as a flat mapping of relative directory path to the directory mtime and the names
+    of its sub directories. Subtrees below `fanout_depth` are scanned in parallel threads, and a rescan only lists
+    directories whose mtime changed since the previous scan.
+    """
+    def __init__(self, root, workers=8, fanout_depth=2):
+        self.root = root
+        self.workers = workers
+        self.fanout_depth = fanout_depth
+        self.entries = dict()
+        self.scanned = None
+
+    def scan(self):
+        """Scan (or rescan) the archive and return the number of directories that changed."""
+        previous = self.entries
+        entries = dict()
+        trusted_before = int((self.scanned or 0) * 10**9) - RACY_WINDOW_NS
+        scanned = time.time()
+
+        # walk the top levels of the tree serially to find the subtrees to fan out over the thread pool
+        level = [(self.root, '', os.stat(self.root).st_mtime_ns)]
+        for _ in range(self.fanout_depth):
+            next_level = []
+            for path, relpath, mtime in level:
+                children = _list_directory(path, relpath, mtime, previous, trusted_before)
+                entries[relpath] = (mtime, [name for name, _ in children])
+                for name, child_mtime in children:
+                    next_level.append((os.path.join(path, name), os.path.join(relpath, name), child_mtime))
+            level = next_level
+
+        if level:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [
+                    executor.submit(_scan_subtree, path, relpath, mtime, previous, trusted_before)
+                    for path, relpath, mtime in level
+                ]
+                for future in futures:
+                    entries.update(future.result())
+
+        changed = sum(1 for relpath, entry in entries.items() if previous.get(relpath) != entry)
+        changed += sum(1 for relpath in previous if relpath not in entries)
+        LOGGER.debug("scanned %s directories in `%s`, %s changed", len(entries), self.root, changed)
+
+        self.entries = entries
+        self.scanned = scanned
+        return changed
+
+    def tree(self, name='root'):
+        """Return the scanned directories as nested dicts with `name` and `contents` keys, like `tree -J`."""
+        def _entry(relpath, name):
+            result = dict()
+            result['name'] = name
+
+            children = self.entries[relpath][1]
+            if children:
+                result['contents'] = [_entry(os.path.join(relpath, child), child) for child in children]
+
+            return result
+
+        return _entry('', name)
+
+    def save(self, cache_file):
+        """Write the scan result to `cache_file`.
+
+        The directories are stored column wise as a list of paths and a list of mtimes, encoded with msgpack when
+        available and as compact json otherwise. The file is written to a temporary file first and renamed, so
+        readers never see a partially written cache.
+        """
+        paths = []
+        mtimes = []
+        stack = ['']
+        while stack:
+            relpath = stack.pop()
+            mtime, children = self.entries[relpath]
+            paths.append(relpath)
+            mtimes.append(mtime)
+            stack.extend(os.path.join(relpath, child) for child in reversed(children))
+
+        cache = dict(version=CACHE_VERSION, archive_root=self.root, scanned=self.scanned, paths=paths, mtimes=mtimes)
+
+        cache_dir = os.path.dirname(os.path.abspath(cache_file))
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir, prefix='.' + os.path.basename(cache_file))
+        try:
+            with os.fdopen(fd, 'wb') as write_file:
+                if msgpack:
+                    write_file.write(msgpack.packb(cache, use_bin_type=True))
+                else:
+                    write_file.write(json.dumps(cache, separators=(',', ':')).encode('utf-8'))
+            os.replace(tmp_file, cache_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+        LOGGER.debug("written meta data of %s directories to '%s'", len(paths), cache_file)
+
+    def load(self, cache_file):
+        """Read a scan result written by `save`.
+
+        Returns False, leaving the scanner untouched, when the cache cannot be read, was written by another version
+        or belongs to another archive.
+        """
+        try:
+            with open(cache_file, 'rb') as read_file:
+                content = read_file.read()
+            if content[:1] == b'{':
+                cache = json.loads(content.decode('utf-8'))
+            elif msgpack:
+                cache = msgpack.unpackb(content, raw=False)
+            else:
+                LOGGER.warning("cannot read meta cache '%s', msgpack is not installed", cache_file)
+                return False
+        except Exception as e:
+            LOGGER.warning("cannot read meta cache '%s': %s", cache_file, e)
+            return False
+
+        if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+            LOGGER.info("ignoring meta cache '%s' written by another version", cache_file)
+            return False
+
+        if cache['archive_root'] != self.root:
+            LOGGER.info("ignoring meta cache '%s' of archive `%s`", cache_file, cache['archive_root'])
+            return False
+
+        # paths are stored parents first, with children in listing order
+        entries = dict()
+        for relpath, mtime in zip(cache['paths'], cache['mtimes']):
+            entries[relpath] = (mtime, [])
+            if relpath:
+                entries[os.path.dirname(relpath)][1].append(os.path.basename(relpath))
+
+        self.entries = entries
+        self.scanned = cache['scanned']
+        LOGGER.debug("loaded meta data of %s directories from '%s'", len(entries), cache_file)
+        return True
@@ -1,34 +1,26 @@
 import os
 import tempfile
 import glob
+import itertools
 import json
 import sys
-import copy
+import threading
+import time
 
 import logging
 
 from pywps import configuration
 
-LOGGER = logging.getLogger("PYWPS")
-
-# Builds up a tree of folders with their contentaining folders
-# Not unlike the output of the "tree -J" command in linux
+from .archive_scanner import ArchiveScanner
 
+LOGGER = logging.getLogger("PYWPS")
 
-def _dir_entry(path, name):
-    result = dict()
-    result['name'] = name
-
-    contents = []
-    for dir in os.listdir(path):
-        subdir = os.path.join(path, dir)
-        if (os.path.isdir(subdir)):
-            contents.append(_dir_entry(subdir, dir))
+# index versions are unique over all DataFinder instances, so they can be used as cache keys
+_index_versions = itertools.count(1)
 
-    if len(contents) > 0:
-        result['contents'] = contents
 
-    return result
+def _tree_key(required_variables, required_frequency):
+    return (tuple(sorted(set(required_variables))), required_frequency)
 
 
 def _get_children_of(a_dict):
@@ -38,16 +30,39 @@ def _get_children_of(a_dict):
         return []
 
 
-def _has_chilren(a_dict):
-    if 'contents' in a_dict:
-        # make sure we return a boolean
-        return len(a_dict['contents']) != 0
-    return False
+# Build an inverted index of the tree: every organization/model/experiment/frequency/mip/realm/ensemble
+# path gets a compact integer id, and (frequency, variable) maps to the set of ids providing that variable
+def _build_index(data):
+    datasets = []
+    frequency_index = dict()
+    variable_index = dict()
+
+    for organization in _get_children_of(data):
+        for model in _get_children_of(organization):
+            for experiment in _get_children_of(model):
+                for frequency in _get_children_of(experiment):
+                    for mip in _get_children_of(frequency):
+                        for realm in _get_children_of(mip):
+                            for ensemble in _get_children_of(realm):
+                                dataset_id = len(datasets)
+                                datasets.append((organization['name'], model['name'], experiment['name'],
+                                                 frequency['name'], mip['name'], realm['name'], ensemble['name']))
+                                frequency_index.setdefault(frequency['name'], set()).add(dataset_id)
+                                for variable in _get_children_of(ensemble):
+                                    key = (frequency['name'], variable['name'])
+                                    variable_index.setdefault(key, set()).add(dataset_id)
+
+    LOGGER.debug("indexed %s datasets", len(datasets))
+    return datasets, frequency_index, variable_index
 
 
 class DataFinder():
     __instance = None
 
+    # (required_variables, required_frequency) keys of the processes, the pruned trees of these keys
+    # are serialized as soon as the index is built
+    registered_keys = set()
+
     @staticmethod
     def get_instance():
         if DataFinder.__instance is None:
@@ -55,6 +70,15 @@ class DataFinder():
 
         return DataFinder.__instance
 
+    @staticmethod
+    def loaded_instance():
+        """Return the instance when the model data has been scanned in this process, None otherwise."""
+        return DataFinder.__instance
+
+    @staticmethod
+    def register(required_variables=[], required_frequency='mon'):
+        DataFinder.registered_keys.add(_tree_key(required_variables, required_frequency))
+
     def __init__(self):
         self.archive_base = os.environ.get('CMIP_DATA_ROOT')
 
@@ -66,97 +90,162 @@ class DataFinder():
         if not os.path.isdir(self.archive_base):
             raise Exception('cmip5 folder not found at %s' % self.archive_base)
 
+        self.scanner = ArchiveScanner(self.archive_base, workers=int(os.environ.get('CMIP_SCAN_WORKERS', 8)))
+
         self.cache_file = os.environ.get('CMIP_META_CACHE_FILE')
+        # number of seconds after which the scan is validated against the archive again
+        self.cache_ttl = int(os.environ.get('CMIP_META_CACHE_TTL', 600))
+
+        self.version = None
+        self._serialized = dict()
+        self._refresh_thread = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
 
         if self.cache_file:
             LOGGER.info("using `%s` as file for storing cmip meta cache", self.cache_file)
 
-            if os.path.isfile(self.cache_file):
-                with open(self.cache_file, "r") as read_file:
-                    self.data = json.load(read_file)
-                    LOGGER.debug("loaded meta data from '%s'", self.cache_file)
-            else:
-                self.data = _dir_entry(self.archive_base, 'root')
-
-                with open(self.cache_file, "w") as write_file:
-                    json.dump(self.data, write_file)
-                    LOGGER.debug("written meta data to '%s'", self.cache_file)
+        if self.cache_file and self.scanner.load(self.cache_file):
+            # serve the cached scan right away, stale subtrees are refreshed lazily by `check_stale`
+            LOGGER.debug("loaded meta data from '%s'", self.cache_file)
         else:
-            # use root instead of the actual filename to
-            # not needlessly reveal the location of the files on disk
-            self.data = _dir_entry(self.archive_base, 'root')
+            self.scanner.scan()
+            if self.cache_file:
+                self.scanner.save(self.cache_file)
+
+        self._update()
+
+    def _update(self):
+        # use root instead of the actual filename to
+        # not needlessly reveal the location of the files on disk
+        data = self.scanner.tree('root')
+        index = _build_index(data)
+        with self._lock:
+            self.data = data
+            self.index = index
+            self.version = next(_index_versions)
+
+        # serialize the trees served by the meta process up front
+        self.get_tree_json()
+        for required_variables, required_frequency in sorted(DataFinder.registered_keys):
+            self.get_pruned_tree_json(required_variables, required_frequency)
+
+    # Rescan the archive, only listing directories that changed since the previous scan
+    def refresh(self):
+        with self._refresh_lock:
+            changed = self.scanner.scan()
+            if changed:
+                LOGGER.info("%s directories changed in `%s`, rebuilding index", changed, self.archive_base)
+                self._update()
+            if self.cache_file:
+                self.scanner.save(self.cache_file)
+        return changed
+
+    # Start a background refresh when the last scan is older than the cache ttl
+    def check_stale(self):
+        if time.time() - self.scanner.scanned < self.cache_ttl:
+            return False
+
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return True
+            self._refresh_thread = threading.Thread(target=self._refresh_in_background, daemon=True)
+            self._refresh_thread.start()
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            LOGGER.exception("refreshing meta data of `%s` failed", self.archive_base)
+
+    # Take the index version together with the tree and the index it belongs to
+    def _snapshot(self):
+        with self._lock:
+            return self.version, self.data, self.index
+
+    # Obtain the ids of all datasets of the index providing the required variables at the required frequency
+    def _find_datasets(self, index, required_variables=[], required_frequency='mon'):
+        _, frequency_index, variable_index = index
+        candidates = [frequency_index.get(required_frequency, set())]
+        for required_variable in set(required_variables):
+            candidates.append(variable_index.get((required_frequency, required_variable), set()))
+
+        # intersect starting with the smallest set to keep the intersection cheap
+        candidates.sort(key=len)
+        return candidates[0].intersection(*candidates[1:])
 
     # Obtain a pruned tree with models/experiments/ensembles containing the required variables and frequency only
     # Note, it cannot handle variables in multiple realms as of yet
     def get_pruned_tree(self, required_variables=[], required_frequency='mon'):
-        result = copy.deepcopy(self.data)
-
-        for organization in _get_children_of(result):
-            for model in _get_children_of(organization):
-                for experiment in _get_children_of(model):
-                    for frequency in _get_children_of(experiment):
-                        if frequency['name'] == required_frequency:
-                            for mip in _get_children_of(frequency):
-                                for realm in _get_children_of(mip):
-                                    for ensemble in _get_children_of(realm):
-
-                                        available_variables = []
-                                        for variable in _get_children_of(ensemble):
-                                            available_variables.append(variable['name'])
-
-                                        LOGGER.debug('required_variables ' + str(required_variables))
-                                        LOGGER.debug('available variables ' + str(available_variables))
-
-                                        if not all(required_variable in available_variables
-                                                   for required_variable in required_variables):
-                                            # LOGGER.debug('removing %s from %s' %(ensemble, model))
-                                            realm['contents'].remove(ensemble)
-                                        else:
-                                            # remove unneeded information for the tree to reduce size
-                                            del ensemble['contents']
-
-                                    if not _has_chilren(realm):
-                                        mip['contents'].remove(realm)
-                                if not _has_chilren(mip):
-                                    frequency['contents'].remove(mip)
-                            if not _has_chilren(frequency):
-                                experiment['contents'].remove(frequency)
-                        else:
-                            experiment['contents'].remove(frequency)
-                    if not _has_chilren(experiment):
-                        model['contents'].remove(experiment)
-                if not _has_chilren(model):
-                    organization['contents'].remove(model)
-            if not _has_chilren(organization):
-                result['contents'].remove(organization)
+        self.check_stale()
+        return self._pruned_tree(self._snapshot(), required_variables, required_frequency)
+
+    def _pruned_tree(self, snapshot, required_variables, required_frequency):
+        _, data, index = snapshot
+        datasets = index[0]
+        dataset_ids = self._find_datasets(index, required_variables, required_frequency)
+
+        result = dict()
+        result['name'] = data['name']
+        if 'contents' in data:
+            result['contents'] = []
+
+        nodes = dict()
+        # ids are assigned in tree order, so sorting them keeps the order of the original tree
+        for dataset_id in sorted(dataset_ids):
+            parent = result
+            path = ()
+            for name in datasets[dataset_id]:
+                path += (name, )
+                node = nodes.get(path)
+                if node is None:
+                    node = dict(name=name)
+                    parent.setdefault('contents', []).append(node)
+                    nodes[path] = node
+                parent = node
+
         return result
 
+    # Memoize the json of a tree per index version, a json of an older version never replaces a newer one
+    def _serialize(self, key, version, tree):
+        cached = self._serialized.get(key)
+        if cached is None or cached[0] != version:
+            serialized = (version, json.dumps(tree()))
+            with self._lock:
+                cached = self._serialized.get(key)
+                if cached is None or cached[0] < version:
+                    self._serialized[key] = serialized
+            cached = serialized
+        return cached[1]
+
+    # Obtain the complete tree serialized as json, memoized per index version
+    def get_tree_json(self):
+        version, data, _ = self._snapshot()
+        return self._serialize(None, version, lambda: data)
+
+    # Obtain the pruned tree serialized as json, memoized per index version
+    def get_pruned_tree_json(self, required_variables=[], required_frequency='mon'):
+        self.check_stale()
+        snapshot = self._snapshot()
+        return self._serialize(_tree_key(required_variables, required_frequency), snapshot[0],
+                               lambda: self._pruned_tree(snapshot, required_variables, required_frequency))
+
     # Obtain a list of all valid models, experiments, and esemble members for the wps.
     def get_model_experiment_ensemble(self, required_variables=[], required_frequency='mon'):
         models = set()
         experiments = set()
         ensembles = set()
 
-        for organization in _get_children_of(self.data):
-            for model in _get_children_of(organization):
-                for experiment in _get_children_of(model):
-                    for frequency in _get_children_of(experiment):
-                        if frequency['name'] == required_frequency:
-                            for mip in _get_children_of(frequency):
-                                for realm in _get_children_of(mip):
-                                    for ensemble in _get_children_of(realm):
-                                        available_variables = []
-                                        for variable in _get_children_of(ensemble):
-                                            available_variables.append(variable['name'])
-
-                                        LOGGER.debug('required_variables ' + str(required_variables))
-                                        LOGGER.debug('available variables ' + str(available_variables))
-
-                                        if all(required_variable in available_variables
-                                               for required_variable in required_variables):
-                                            models.add(model['name'])
-                                            experiments.add(experiment['name'])
-                                            ensembles.add(ensemble['name'])
+        self.check_stale()
+        _, _, index = self._snapshot()
+        datasets = index[0]
+        dataset_ids = self._find_datasets(index, required_variables, required_frequency)
+        for dataset_id in dataset_ids:
+            _, model, experiment, _, _, _, ensemble = datasets[dataset_id]
+            models.add(model)
+            experiments.add(experiment)
+            ensembles.add(ensemble)
 
         return (list(models), list(experiments), list(ensembles))
 
@@ -2,10 +2,12 @@ import json
 import logging
 import os
 import re
+from functools import partial
 
 from pywps import (FORMATS, ComplexInput, ComplexOutput, Format, LiteralInput, LiteralOutput, Process)
 from pywps.app.Common import Metadata
 
+from ... import profiling
 from ...util import static_directory
 
 from .data_finder import DataFinder
@@ -33,7 +35,7 @@ def year_ranges(start_end_defaults, start_name='start_year', end_name='end_year'
 
 
 def default_outputs():
-    return (
+    outputs = (
         LiteralOutput('success',
                       'Success',
                       abstract="""True if the metric has been successfully calculated.
@@ -55,6 +57,14 @@ def default_outputs():
                       as_reference=True,
                       supported_formats=[Format('text/plain')]),
     )
+    # without profiling the output would be an empty reference in every response
+    if profiling.is_enabled():
+        outputs += (ComplexOutput('profile',
+                                  'Profile',
+                                  abstract='Collapsed stacks of the ESMValTool processing for a flame graph.',
+                                  as_reference=True,
+                                  supported_formats=[Format('text/plain')]), )
+    return outputs
 
 
 def ensemble_comp(key):
@@ -73,20 +83,20 @@ def parse_model_lists():
                                                            key=ensemble_comp)
 
 
-def model_experiment_ensemble(model: str,
-                              experiment: str,
-                              ensemble: str,
-                              model_name: str = 'Model',
-                              experiment_name: str = 'Experiment',
-                              ensemble_name: str = 'Ensemble',
-                              min_occurs=1,
-                              max_occurs=150,
-                              required_variables=[],
-                              required_frequency='mon'):
-    # if not hasattr(model_experiment_ensemble, 'available_models'):
-    #     parse_model_lists()
+# memoized results of available_model_experiment_ensemble, invalidated when the DataFinder index changes
+_available_cache = dict()
 
+
+def available_model_experiment_ensemble(required_variables=[], required_frequency='mon'):
+    """Return the DataFinder index version and the sorted lists of available models, experiments and ensembles."""
     finder = DataFinder.get_instance()
+    key = (tuple(sorted(set(required_variables))), required_frequency)
+
+    version = finder.version
+    cached = _available_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached
+
     available_models, available_experiments, available_ensembles = finder.get_model_experiment_ensemble(
         required_variables=required_variables, required_frequency=required_frequency)
 
@@ -103,47 +113,62 @@ def model_experiment_ensemble(model: str,
     if not available_experiments:
         available_experiments = ['None']
 
+    cached = (version, (available_models, available_experiments, available_ensembles))
+    _available_cache[key] = cached
+    return cached
+
+
+def _resolve_available(required_variables, required_frequency, position, default):
+    """Return the allowed values of a model, experiment or ensemble input and its default."""
+    try:
+        _, available = available_model_experiment_ensemble(required_variables=required_variables,
+                                                           required_frequency=required_frequency)
+    except Exception as e:
+        # GetCapabilities lists the inputs too, it is answered without the model data, like an empty archive
+        LOGGER.debug("cannot look up the available model data: %s", e)
+        return ['None'], 'None'
+    allowed_values = available[position]
+    if default not in allowed_values:
+        default = allowed_values[0]
+    return allowed_values, default
+
+
+def model_experiment_ensemble(model: str,
+                              experiment: str,
+                              ensemble: str,
+                              model_name: str = 'Model',
+                              experiment_name: str = 'Experiment',
+                              ensemble_name: str = 'Ensemble',
+                              min_occurs=1,
+                              max_occurs=150,
+                              required_variables=[],
+                              required_frequency='mon'):
+    # if not hasattr(model_experiment_ensemble, 'available_models'):
+    #     parse_model_lists()
+
+    # the available models, experiments and ensembles are looked up when the process is created, the service creates
+    # its processes again when the DataFinder index changes
+    DataFinder.register(required_variables=required_variables, required_frequency=required_frequency)
+
     model_long_name = model_name.replace('_', ' ').capitalize()
     experiment_long_name = experiment_name.replace('_', ' ').capitalize()
     ensemble_long_name = ensemble_name.replace('_', ' ').capitalize()
 
-    default_model = model
-    if default_model not in available_models:
-        default_model = available_models[0]
-
-    default_ensemble = ensemble
-    if default_ensemble not in available_ensembles:
-        default_ensemble = available_ensembles[0]
-
-    default_experiment = experiment
-    if default_experiment not in available_experiments:
-        default_experiment = available_experiments[0]
+    def available_input(identifier, title, position, default, abstract):
+        allowed_values, default = _resolve_available(required_variables, required_frequency, position, default)
+        return LiteralInput(identifier,
+                            title,
+                            abstract=abstract,
+                            data_type='string',
+                            allowed_values=allowed_values,
+                            default=default,
+                            min_occurs=min_occurs,
+                            max_occurs=max_occurs)
 
     inputs = [
-        LiteralInput(model_name.lower(),
-                     model_long_name,
-                     abstract='Choose a model',
-                     data_type='string',
-                     allowed_values=available_models,
-                     default=default_model,
-                     min_occurs=min_occurs,
-                     max_occurs=max_occurs),
-        LiteralInput(experiment_name.lower(),
-                     experiment_long_name,
-                     abstract='Choose an experiment',
-                     data_type='string',
-                     allowed_values=available_experiments,
-                     default=default_experiment,
-                     min_occurs=min_occurs,
-                     max_occurs=max_occurs),
-        LiteralInput(ensemble_name.lower(),
-                     ensemble_long_name,
-                     abstract='Choose an ensemble',
-                     data_type='string',
-                     allowed_values=available_ensembles,
-                     default=default_ensemble,
-                     min_occurs=min_occurs,
-                     max_occurs=max_occurs),
+        available_input(model_name.lower(), model_long_name, 0, model, 'Choose a model'),
+        available_input(experiment_name.lower(), experiment_long_name, 1, experiment, 'Choose an experiment'),
+        available_input(ensemble_name.lower(), ensemble_long_name, 2, ensemble, 'Choose an ensemble'),
     ]
 
     return inputs
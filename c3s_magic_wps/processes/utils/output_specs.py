@@ -0,0 +1,112 @@
+import collections
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pywps import FORMATS, Format
+
+from ... import instrumentation, manifest, runner
+
+LOGGER = logging.getLogger("PYWPS")
+
+OutputSpec = collections.namedtuple('OutputSpec', ['identifier', 'root', 'path', 'pattern', 'format'])
+OutputSpec.__doc__ = """Where to find the file of a process output in the esmvaltool output.
+
+`root` is `plot` or `work`, `path` the folder below it and `pattern` the glob pattern of the file name without the
+extension `format`. Path and pattern can contain `{placeholders}`, which are filled in by `collect_outputs`.
+"""
+
+ROOTS = {'plot': 'plot_dir', 'work': 'work_dir'}
+
+OUTPUT_FORMATS = {
+    'png': Format('image/png'),
+    'jpg': Format('image/jpeg'),
+    'nc': FORMATS.NETCDF,
+    'txt': FORMATS.TEXT,
+    'xlsx': Format('application/vnd.ms-excel'),
+}
+
+
+class _Status():
+    """Status updates of a response from several threads, the percentage never goes back."""
+    def __init__(self, response):
+        self.response = response
+        self.percentage = 0
+        self._lock = threading.Lock()
+
+    def update_status(self, message, percentage):
+        with self._lock:
+            self.percentage = max(self.percentage, percentage)
+            self.response.update_status(message, self.percentage)
+
+
+def resolve_outputs(result, specs, **context):
+    """Return the file of each output spec in the result of an esmvaltool run, or None when it is missing.
+
+    All specs are resolved in one pass over the manifest of the output.
+    """
+    patterns = dict()
+    for spec in specs:
+        patterns[spec.identifier] = os.path.join(result[ROOTS[spec.root]], spec.path.format(**context),
+                                                 '{}.{}'.format(spec.pattern.format(**context), spec.format))
+    found = manifest.get_manifest(os.path.dirname(result['plot_dir'])).find_all(patterns.values())
+
+    files = dict()
+    for identifier, pattern in patterns.items():
+        matches = found[pattern]
+        if len(matches) > 1:
+            LOGGER.warning("more then one output found %s", matches)
+        files[identifier] = matches[0] if matches else None
+    return files
+
+
+def _no_profile(output_dir):
+    """Write the note returned as profile of a job which has none, like a job restored from the result cache."""
+    path = os.path.join(os.path.dirname(os.path.abspath(output_dir)), 'profile.collapsed.txt')
+    with open(path, 'w') as fp:
+        fp.write('# no profile, esmvaltool did not run for this job or its result was restored from the cache\n')
+    return path
+
+
+def collect_outputs(response, result, specs, output_dir, archive_file, **context):
+    """Set the outputs of a process from the result of an esmvaltool run.
+
+    The files of the outputs described by `specs` are looked up while the archive of `output_dir` is created in a
+    separate thread. `context` fills in the placeholders of the specs.
+    """
+    status = _Status(response)
+    if result['success']:
+        status.update_status("collecting output ...", 80)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        status.update_status("creating archive of diagnostic result ...", 90)
+        archive = executor.submit(runner.compress_output, output_dir, archive_file, response=status, result=result)
+
+        if result['success']:
+            with instrumentation.phase('collect', os.path.dirname(os.path.abspath(output_dir))) as measurement:
+                files = resolve_outputs(result, specs, **context)
+            runner.record_phase(result.get('job'), 'collect', measurement['wall_seconds'])
+            for spec in specs:
+                if files[spec.identifier] is None:
+                    continue
+                output = response.outputs[spec.identifier]
+                if spec.format in OUTPUT_FORMATS:
+                    output.output_format = OUTPUT_FORMATS[spec.format]
+                output.file = files[spec.identifier]
+
+            missing = [identifier for identifier, path in files.items() if path is None]
+            if missing:
+                LOGGER.error("no output found for %s in %s", ', '.join(missing), output_dir)
+                status.update_status("exception occured: no output found for: " + ', '.join(missing), 85)
+        else:
+            LOGGER.error('esmvaltool failed!')
+            status.update_status("exception occured: " + result['exception'], 85)
+
+        if 'profile' in response.outputs:
+            response.outputs['profile'].output_format = FORMATS.TEXT
+            response.outputs['profile'].file = result.get('profile') or _no_profile(output_dir)
+
+        response.outputs['archive'].output_format = Format('application/zip')
+        response.outputs['archive'].file = archive.result()
@@ -7,7 +7,8 @@ from pywps.response.status import WPS_STATUS
 from pywps.inout.literaltypes import AllowedValue
 from pywps.validator.allowed_value import ALLOWEDVALUETYPE
 
-from .utils import default_outputs, model_experiment_ensemble, year_ranges, outputs_from_plot_names
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 from .. import runner, util
 
@@ -79,6 +80,11 @@ class CombinedIndices(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('plot', 'plot', os.path.join('combine_indices', 'main'), '*', 'png'),
+            OutputSpec('data', 'work', os.path.join('combine_indices', 'main'), '*', 'nc'),
+        ]
+
         super(CombinedIndices, self).__init__(
             self._handler,
             identifier="combined_indices",
@@ -135,7 +141,7 @@ class CombinedIndices(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -147,36 +153,8 @@ class CombinedIndices(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-                LOGGER.exception('Getting output failed: ' + str(e))
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 100)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'combined_indices_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'combined_indices_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        response.outputs['plot'].output_format = Format('image/png')
-        response.outputs['plot'].file = runner.get_output(result['plot_dir'],
-                                                          path_filter=os.path.join('combine_indices', 'main'),
-                                                          name_filter="*",
-                                                          output_format="png")
-        response.outputs['data'].output_format = FORMATS.NETCDF
-        response.outputs['data'].file = runner.get_output(result['work_dir'],
-                                                          path_filter=os.path.join('combine_indices', 'main'),
-                                                          name_filter="*",
-                                                          output_format="nc")
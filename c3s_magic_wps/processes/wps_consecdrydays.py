@@ -5,7 +5,8 @@ from pywps import FORMATS, ComplexOutput, Format, LiteralInput, Process
 from pywps.app.Common import Metadata
 
 from .. import runner, util
-from .utils import default_outputs, model_experiment_ensemble, outputs_from_plot_names, year_ranges
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -60,6 +61,15 @@ class ConsecDryDays(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            *[
+                OutputSpec('{}_plot'.format(plot.lower()), 'plot', os.path.join('dry_days', 'consecutive_dry_days'),
+                           '*{}'.format(plot), 'png') for plot, _ in self.plotlist
+            ],
+            OutputSpec('data_drymax', 'work', os.path.join('dry_days', 'consecutive_dry_days'), '*drymax', 'nc'),
+            OutputSpec('data_dryfreq', 'work', os.path.join('dry_days', 'consecutive_dry_days'), '*dryfreq', 'nc'),
+        ]
+
         super(ConsecDryDays, self).__init__(
             self._handler,
             identifier="consecdrydays",
@@ -117,7 +127,7 @@ class ConsecDryDays(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -129,45 +139,8 @@ class ConsecDryDays(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'consecdrydays_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'consecdrydays_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        for plot, _ in self.plotlist:
-            key = '{}_plot'.format(plot.lower())
-            response.outputs[key].output_format = Format('application/png')
-            response.outputs[key].file = runner.get_output(result['plot_dir'],
-                                                           path_filter=os.path.join(
-                                                               'dry_days', 'consecutive_dry_days'),
-                                                           name_filter="*{}".format(plot),
-                                                           output_format="png")
-
-        response.outputs['data_drymax'].output_format = FORMATS.NETCDF
-        response.outputs['data_drymax'].file = runner.get_output(result['work_dir'],
-                                                                 path_filter=os.path.join(
-                                                                     'dry_days', 'consecutive_dry_days'),
-                                                                 name_filter="*drymax",
-                                                                 output_format="nc")
-
-        response.outputs['data_dryfreq'].output_format = FORMATS.NETCDF
-        response.outputs['data_dryfreq'].file = runner.get_output(result['work_dir'],
-                                                                  path_filter=os.path.join(
-                                                                      'dry_days', 'consecutive_dry_days'),
-                                                                  name_filter="*dryfreq",
-                                                                  output_format="nc")
@@ -6,7 +6,7 @@ from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
 from .. import runner, util
-from .utils import default_outputs, model_experiment_ensemble, year_ranges
+from .utils import collect_outputs, default_outputs, model_experiment_ensemble, OutputSpec, year_ranges
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -52,6 +52,14 @@ class CVDP(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            # Yes, the plots are in the work dir
+            *[
+                OutputSpec('{}_trend_ann_plot'.format(var), 'work', os.path.join('diagnostic1', 'cvdp'),
+                           '{}.trends.ann'.format(var), 'png') for var in ['tas', 'psl', 'pr', 'sst']
+            ],
+        ]
+
         super(CVDP, self).__init__(
             self._handler,
             identifier="cvdp",
@@ -99,7 +107,7 @@ class CVDP(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -111,34 +119,8 @@ class CVDP(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'cvdp_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'cvdp_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        varlist = ['tas', 'psl', 'pr', 'sst']
-        for var in varlist:
-            key = "{}_trend_ann_plot".format(var.lower())
-            response.outputs[key].output_format = Format('application/png')
-            response.outputs[key].file = runner.get_output(
-                result['work_dir'],  # Yes, it's in the work dir
-                path_filter=os.path.join('diagnostic1', 'cvdp'),
-                name_filter="{}.trends.ann".format(var.lower()),
-                output_format="png")
@@ -6,7 +6,8 @@ from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
 from .. import runner, util
-from .utils import default_outputs, model_experiment_ensemble, outputs_from_plot_names, year_ranges
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -74,6 +75,12 @@ class DiurnalTemperatureIndex(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('plot', 'plot', os.path.join('diurnal_temperature_indicator', 'main'), '*', 'png'),
+            OutputSpec('data', 'work', os.path.join('diurnal_temperature_indicator', 'main'), 'Seasonal_DTRindicator*',
+                       'nc'),
+        ]
+
         super(DiurnalTemperatureIndex, self).__init__(
             self._handler,
             identifier="diurnal_temperature_index",
@@ -135,7 +142,7 @@ class DiurnalTemperatureIndex(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -147,39 +154,8 @@ class DiurnalTemperatureIndex(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-                LOGGER.exception('Getting output failed: ' + str(e))
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'diurnal_temperature_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'diurnal_temperature_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        response.outputs['plot'].output_format = Format('application/png')
-        response.outputs['plot'].file = runner.get_output(result['plot_dir'],
-                                                          path_filter=os.path.join('diurnal_temperature_indicator',
-                                                                                   'main'),
-                                                          name_filter="*",
-                                                          output_format="png")
-
-        response.outputs['data'].output_format = FORMATS.NETCDF
-        response.outputs['data'].file = runner.get_output(result['work_dir'],
-                                                          path_filter=os.path.join('diurnal_temperature_indicator',
-                                                                                   'main'),
-                                                          name_filter="Seasonal_DTRindicator*",
-                                                          output_format="nc")
@@ -6,7 +6,8 @@ from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
 from .. import runner, util
-from .utils import default_outputs, model_experiment_ensemble, outputs_from_plot_names, year_ranges
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -73,6 +74,15 @@ class DroughtIndicator(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('spi_plot', 'plot', os.path.join('diagnostic', 'spi'), 'histplot', 'png'),
+            OutputSpec('spei_plot', 'plot', os.path.join('diagnostic', 'spei'), 'histplot', 'png'),
+            OutputSpec('spi_model', 'work', os.path.join('diagnostic', 'spi'), 'CMPI5*spi*', 'nc'),
+            OutputSpec('spi_reference', 'work', os.path.join('diagnostic', 'spi'), 'OBS*spi*', 'nc'),
+            OutputSpec('spei_model', 'work', os.path.join('diagnostic', 'spei'), 'CMPI5*spei*', 'nc'),
+            OutputSpec('spei_reference', 'work', os.path.join('diagnostic', 'spei'), 'OBS*spei*', 'nc'),
+        ]
+
         super(DroughtIndicator, self).__init__(
             self._handler,
             identifier="drought_indicator",
@@ -124,7 +134,7 @@ class DroughtIndicator(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -136,60 +146,8 @@ class DroughtIndicator(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-                LOGGER.exception('Getting output failed: ' + str(e))
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'drought_indicator_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'drought_indicator_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        response.outputs['spi_plot'].output_format = Format('application/png')
-        response.outputs['spi_plot'].file = runner.get_output(result['plot_dir'],
-                                                              path_filter=os.path.join('diagnostic', 'spi'),
-                                                              name_filter="histplot",
-                                                              output_format="png")
-        response.outputs['spei_plot'].output_format = Format('application/png')
-        response.outputs['spei_plot'].file = runner.get_output(result['plot_dir'],
-                                                               path_filter=os.path.join('diagnostic', 'spei'),
-                                                               name_filter="histplot",
-                                                               output_format="png")
-
-        response.outputs['spi_model'].output_format = FORMATS.NETCDF
-        response.outputs['spi_model'].file = runner.get_output(result['work_dir'],
-                                                               path_filter=os.path.join('diagnostic', 'spi'),
-                                                               name_filter="CMPI5*spi*",
-                                                               output_format="nc")
-
-        response.outputs['spi_reference'].output_format = FORMATS.NETCDF
-        response.outputs['spi_reference'].file = runner.get_output(result['work_dir'],
-                                                                   path_filter=os.path.join('diagnostic', 'spi'),
-                                                                   name_filter="OBS*spi*",
-                                                                   output_format="nc")
-
-        response.outputs['spei_model'].output_format = FORMATS.NETCDF
-        response.outputs['spei_model'].file = runner.get_output(result['work_dir'],
-                                                                path_filter=os.path.join('diagnostic', 'spei'),
-                                                                name_filter="CMPI5*spei*",
-                                                                output_format="nc")
-
-        response.outputs['spei_reference'].output_format = FORMATS.NETCDF
-        response.outputs['spei_reference'].file = runner.get_output(result['work_dir'],
-                                                                    path_filter=os.path.join('diagnostic', 'spei'),
-                                                                    name_filter="OBS*spei*",
-                                                                    output_format="nc")
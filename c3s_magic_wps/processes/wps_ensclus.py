@@ -7,7 +7,7 @@ from pywps.response.status import WPS_STATUS
 
 from .. import runner, util
 
-from .utils import default_outputs, model_experiment_ensemble, year_ranges
+from .utils import collect_outputs, default_outputs, model_experiment_ensemble, OutputSpec, year_ranges
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -114,6 +114,14 @@ class EnsClus(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('plot', 'plot', os.path.join('EnsClus', 'main'), 'anomalies*', 'png'),
+            OutputSpec('ens_extreme', 'work', os.path.join('EnsClus', 'main'), 'ens_extreme*', 'nc'),
+            OutputSpec('ens_climatologies', 'work', os.path.join('EnsClus', 'main'), 'ens_anomalies*', 'nc'),
+            OutputSpec('ens_anomalies', 'work', os.path.join('EnsClus', 'main'), 'ens_anomalies*', 'nc'),
+            OutputSpec('statistics', 'work', os.path.join('EnsClus', 'main'), 'statistics*', 'txt'),
+        ]
+
         super(EnsClus, self).__init__(
             self._handler,
             identifier="ensclus",
@@ -179,7 +187,7 @@ class EnsClus(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         # log output
         response.outputs['log'].output_format = FORMATS.TEXT
@@ -191,54 +199,8 @@ class EnsClus(Process):
 
         response.outputs['success'].data = result['success']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'ensemble_clustering_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'ensemble_clustering_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        response.outputs['plot'].output_format = Format('application/eps')
-        response.outputs['plot'].file = runner.get_output(result['plot_dir'],
-                                                          path_filter=os.path.join('EnsClus', 'main'),
-                                                          name_filter="anomalies*",
-                                                          output_format="png")
-
-        response.outputs['ens_extreme'].output_format = FORMATS.NETCDF
-        response.outputs['ens_extreme'].file = runner.get_output(result['work_dir'],
-                                                                 path_filter=os.path.join('EnsClus', 'main'),
-                                                                 name_filter="ens_extreme*",
-                                                                 output_format="nc")
-
-        response.outputs['ens_climatologies'].output_format = FORMATS.NETCDF
-        response.outputs['ens_climatologies'].file = runner.get_output(result['work_dir'],
-                                                                       path_filter=os.path.join('EnsClus', 'main'),
-                                                                       name_filter="ens_anomalies*",
-                                                                       output_format="nc")
-
-        response.outputs['ens_anomalies'].output_format = FORMATS.NETCDF
-        response.outputs['ens_anomalies'].file = runner.get_output(result['work_dir'],
-                                                                   path_filter=os.path.join('EnsClus', 'main'),
-                                                                   name_filter="ens_anomalies*",
-                                                                   output_format="nc")
-
-        response.outputs['statistics'].output_format = FORMATS.TEXT
-        response.outputs['statistics'].file = runner.get_output(result['work_dir'],
-                                                                path_filter=os.path.join('EnsClus', 'main'),
-                                                                name_filter="statistics*",
-                                                                output_format="txt")
@@ -7,7 +7,7 @@ from pywps.response.status import WPS_STATUS
 from pywps.inout.literaltypes import AllowedValue
 from pywps.validator.allowed_value import ALLOWEDVALUETYPE
 
-from .utils import default_outputs, model_experiment_ensemble, year_ranges
+from .utils import collect_outputs, default_outputs, model_experiment_ensemble, OutputSpec, year_ranges
 from .utils import outputs_from_plot_names, outputs_from_data_names
 
 from .. import runner, util
@@ -91,6 +91,22 @@ class ExtremeIndex(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            # output of individual indices
+            *[
+                OutputSpec('{}_plot'.format(idx.lower()), 'plot', os.path.join('extreme_index', 'metric'),
+                           '*{}_*'.format(idx), 'png') for idx in ['t10p', 't90p', 'Wx', 'rx5day', 'cdd']
+            ],
+            *[
+                OutputSpec('{}_data'.format(idx.lower()), 'work', os.path.join('extreme_index', 'metric'),
+                           '*{}_risk_insurance_index*'.format(idx), 'nc')
+                for idx in ['t10p', 't90p', 'Wx', 'rx5day', 'cdd']
+            ],
+            # output of combined indices
+            OutputSpec('combined_plot', 'plot', os.path.join('extreme_index', 'metric'), 'CombinedIndices*', 'png'),
+            OutputSpec('combined_data', 'work', os.path.join('extreme_index', 'metric'), '_*', 'nc'),
+        ]
+
         super(ExtremeIndex, self).__init__(
             self._handler,
             identifier="extreme_index",
@@ -156,7 +172,7 @@ class ExtremeIndex(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -168,51 +184,8 @@ class ExtremeIndex(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, constraints, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-                LOGGER.exception('Getting output failed: ' + str(e))
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'extreme_index_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'extreme_index_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, constraints, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        # output of individual indices
-        for idx in ['t10p', 't90p', 'Wx', 'rx5day', 'cdd']:
-            plotkey = '{}_plot'.format(idx.lower())
-            datakey = '{}_data'.format(idx.lower())
-            response.outputs[plotkey].output_format = Format('application/png')
-            response.outputs[plotkey].file = runner.get_output(result['plot_dir'],
-                                                               path_filter=os.path.join('extreme_index', 'metric'),
-                                                               name_filter="*{}_*".format(idx),
-                                                               output_format="png")
-            response.outputs[datakey].output_format = FORMATS.NETCDF
-            response.outputs[datakey].file = runner.get_output(result['work_dir'],
-                                                               path_filter=os.path.join('extreme_index', 'metric'),
-                                                               name_filter="*{}_risk_insurance_index*".format(idx),
-                                                               output_format="nc")
-        # output of combined indices
-        response.outputs['combined_plot'].output_format = Format('application/png')
-        response.outputs['combined_plot'].file = runner.get_output(result['plot_dir'],
-                                                                   path_filter=os.path.join('extreme_index', 'metric'),
-                                                                   name_filter="CombinedIndices*",
-                                                                   output_format="png")
-        response.outputs['combined_data'].output_format = FORMATS.NETCDF
-        response.outputs['combined_data'].file = runner.get_output(result['work_dir'],
-                                                                   path_filter=os.path.join('extreme_index', 'metric'),
-                                                                   name_filter="_*",
-                                                                   output_format="nc")
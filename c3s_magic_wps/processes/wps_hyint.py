@@ -5,7 +5,8 @@ from pywps import FORMATS, ComplexInput, ComplexOutput, Format, LiteralInput, Li
 from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
-from .utils import default_outputs, model_experiment_ensemble, outputs_from_plot_names, year_ranges
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 from .. import runner, util
 
@@ -120,6 +121,17 @@ class HyInt(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('plot1', 'plot', os.path.join('hyint', 'main'), '*_??_map', 'png'),
+            OutputSpec('plot2', 'plot', os.path.join('hyint', 'main'), '*comp_map', 'png'),
+            OutputSpec('plot3', 'plot', os.path.join('hyint', 'main'), 'multiindex*_map', 'png'),
+            OutputSpec('plot12', 'plot', os.path.join('hyint', 'main'), '*multiregion_timeseries*', 'png'),
+            OutputSpec('plot13', 'plot', os.path.join('hyint', 'main'), '*_multimodel*_timeseries*', 'png'),
+            OutputSpec('plot14', 'plot', os.path.join('hyint', 'main'), '*multiregion_trend_summary*', 'png'),
+            OutputSpec('plot15', 'plot', os.path.join('hyint', 'main'), '*_multimodel*_trend_summary*', 'png'),
+            OutputSpec('model', 'work', os.path.join('hyint', 'main'), 'hyint_{model}*_ALL', 'nc'),
+        ]
+
         super(HyInt, self).__init__(
             self._handler,
             identifier="hyint",
@@ -176,7 +188,7 @@ class HyInt(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -188,64 +200,7 @@ class HyInt(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(constraints['models'], result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'hyint_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'hyint_result.zip'), model=constraints['models'][0].data)
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, models, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        response.outputs['plot1'].output_format = Format('image/png')
-        response.outputs['plot1'].file = runner.get_output(result['plot_dir'],
-                                                           path_filter=os.path.join('hyint', 'main'),
-                                                           name_filter="*_??_map",
-                                                           output_format="png")
-        response.outputs['plot2'].output_format = Format('image/png')
-        response.outputs['plot2'].file = runner.get_output(result['plot_dir'],
-                                                           path_filter=os.path.join('hyint', 'main'),
-                                                           name_filter="*comp_map",
-                                                           output_format="png")
-        response.outputs['plot3'].output_format = Format('image/png')
-        response.outputs['plot3'].file = runner.get_output(result['plot_dir'],
-                                                           path_filter=os.path.join('hyint', 'main'),
-                                                           name_filter="multiindex*_map",
-                                                           output_format="png")
-        response.outputs['plot12'].output_format = Format('image/png')
-        response.outputs['plot12'].file = runner.get_output(result['plot_dir'],
-                                                            path_filter=os.path.join('hyint', 'main'),
-                                                            name_filter="*multiregion_timeseries*",
-                                                            output_format="png")
-        response.outputs['plot13'].output_format = Format('image/png')
-        response.outputs['plot13'].file = runner.get_output(result['plot_dir'],
-                                                            path_filter=os.path.join('hyint', 'main'),
-                                                            name_filter="*_multimodel*_timeseries*",
-                                                            output_format="png")
-        response.outputs['plot14'].output_format = Format('image/png')
-        response.outputs['plot14'].file = runner.get_output(result['plot_dir'],
-                                                            path_filter=os.path.join('hyint', 'main'),
-                                                            name_filter="*multiregion_trend_summary*",
-                                                            output_format="png")
-        response.outputs['plot15'].output_format = Format('image/png')
-        response.outputs['plot15'].file = runner.get_output(result['plot_dir'],
-                                                            path_filter=os.path.join('hyint', 'main'),
-                                                            name_filter="*_multimodel*_trend_summary*",
-                                                            output_format="png")
-        response.outputs['model'].output_format = FORMATS.NETCDF
-        response.outputs['model'].file = runner.get_output(result['work_dir'],
-                                                           path_filter=os.path.join('hyint', 'main'),
-                                                           name_filter="hyint_{}*_ALL".format(models[0]),
-                                                           output_format="nc")
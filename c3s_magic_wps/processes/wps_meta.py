@@ -53,7 +53,7 @@ class Meta(Process):
 
         if not process_identifier:
             LOGGER.info("Process identifier not specified, returning entire tree")
-            response.outputs['drs'].data = json.dumps(finder.data)
+            response.outputs['drs'].data = finder.get_tree_json()
 
             return response
 
@@ -70,7 +70,7 @@ class Meta(Process):
         required_variables = process.variables or []
         required_frequency = process.frequency or 'mon'
 
-        response.outputs['drs'].data = json.dumps(
-            finder.get_pruned_tree(required_variables=required_variables, required_frequency=required_frequency))
+        response.outputs['drs'].data = finder.get_pruned_tree_json(required_variables=required_variables,
+                                                                   required_frequency=required_frequency)
 
         return response
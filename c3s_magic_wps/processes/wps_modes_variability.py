@@ -5,7 +5,8 @@ from pywps import FORMATS, ComplexInput, ComplexOutput, Format, LiteralInput, Li
 from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
-from .utils import default_outputs, model_experiment_ensemble, year_ranges, outputs_from_plot_names
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 from .. import runner, util
 
@@ -110,6 +111,16 @@ class ModesVariability(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            *[
+                OutputSpec('{}_plot'.format(plot.lower()), 'plot', os.path.join('weather_regime', 'main'),
+                           '*{}*'.format(plot), 'png') for plot, _ in self.plotlist
+            ],
+            OutputSpec('rmse', 'work', os.path.join('weather_regime', 'main'), '*rmse*', 'nc'),
+            OutputSpec('exp', 'work', os.path.join('weather_regime', 'main'), '*exp*', 'nc'),
+            OutputSpec('obs', 'work', os.path.join('weather_regime', 'main'), '*obs*', 'nc'),
+        ]
+
         super(ModesVariability, self).__init__(
             self._handler,
             identifier="modes_of_variability",
@@ -176,7 +187,7 @@ class ModesVariability(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -188,51 +199,8 @@ class ModesVariability(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-                LOGGER.exception('Getting output failed: ' + str(e))
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'modes_of_variability_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'modes_of_variability_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        for plot, _ in self.plotlist:
-            key = '{}_plot'.format(plot.lower())
-            response.outputs[key].output_format = Format('application/png')
-            response.outputs[key].file = runner.get_output(result['plot_dir'],
-                                                           path_filter=os.path.join('weather_regime', 'main'),
-                                                           name_filter="*{}*".format(plot),
-                                                           output_format="png")
-
-        response.outputs['rmse'].output_format = FORMATS.NETCDF
-        response.outputs['rmse'].file = runner.get_output(result['work_dir'],
-                                                          path_filter=os.path.join('weather_regime', 'main'),
-                                                          name_filter="*rmse*",
-                                                          output_format="nc")
-
-        response.outputs['exp'].output_format = FORMATS.NETCDF
-        response.outputs['exp'].file = runner.get_output(result['work_dir'],
-                                                         path_filter=os.path.join('weather_regime', 'main'),
-                                                         name_filter="*exp*",
-                                                         output_format="nc")
-
-        response.outputs['obs'].output_format = FORMATS.NETCDF
-        response.outputs['obs'].file = runner.get_output(result['work_dir'],
-                                                         path_filter=os.path.join('weather_regime', 'main'),
-                                                         name_filter="*obs*",
-                                                         output_format="nc")
@@ -7,7 +7,8 @@ from pywps.response.status import WPS_STATUS
 from pywps.inout.literaltypes import AllowedValue
 from pywps.validator.allowed_value import ALLOWEDVALUETYPE
 
-from .utils import default_outputs, model_experiment_ensemble, year_ranges, outputs_from_plot_names
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 from .. import runner, util
 
@@ -86,6 +87,14 @@ class MultimodelProducts(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            *[
+                OutputSpec('{}_plot'.format(plot.lower()), 'plot', os.path.join('anomaly_agreement', 'main'),
+                           '{}*'.format(plot), 'png') for plot, _ in self.plotlist
+            ],
+            OutputSpec('data', 'work', os.path.join('anomaly_agreement', 'main'), 'tas*', 'nc'),
+        ]
+
         super(MultimodelProducts, self).__init__(
             self._handler,
             identifier="multimodel_products",
@@ -156,7 +165,7 @@ class MultimodelProducts(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -168,39 +177,8 @@ class MultimodelProducts(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-                LOGGER.exception('Getting output failed: ' + str(e))
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 100)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'multimodel_products_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'multimodel_products_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        for plot, _ in self.plotlist:
-            key = '{}_plot'.format(plot.lower())
-            response.outputs[key].output_format = Format('application/png')
-            response.outputs[key].file = runner.get_output(result['plot_dir'],
-                                                           path_filter=os.path.join('anomaly_agreement', 'main'),
-                                                           name_filter="{}*".format(plot),
-                                                           output_format="png")
-
-        response.outputs['data'].output_format = FORMATS.NETCDF
-        response.outputs['data'].file = runner.get_output(result['work_dir'],
-                                                          path_filter=os.path.join('anomaly_agreement', 'main'),
-                                                          name_filter="tas*",
-                                                          output_format="nc")
@@ -7,8 +7,8 @@ from pywps.inout.literaltypes import make_allowedvalues
 from pywps.response.status import WPS_STATUS
 
 from .. import runner, util
-from .utils import (default_outputs, model_experiment_ensemble, outputs_from_data_names, outputs_from_plot_names,
-                    year_ranges)
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_data_names,
+                    outputs_from_plot_names, OutputSpec, year_ranges)
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -33,6 +33,10 @@ class Perfmetrics(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('rmsd', 'plot', os.path.join('collect', 'RMSD'), '*', 'png'),
+        ]
+
         super(Perfmetrics, self).__init__(
             self._handler,
             identifier="perfmetrics",
@@ -70,7 +74,7 @@ class Perfmetrics(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file, skip_nonexistent=True)
+        result = runner.run(recipe_file, config_file, skip_nonexistent=True, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -82,31 +86,8 @@ class Perfmetrics(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-                LOGGER.exception('Getting output failed: ' + str(e))
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'perfmetrics_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'perfmetrics_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        response.update_status("collecting output ...", 80)
-
-        response.outputs['rmsd'].output_format = Format('application/png')
-        response.outputs['rmsd'].file = runner.get_output(result['plot_dir'],
-                                                          path_filter=os.path.join('collect', 'RMSD'),
-                                                          name_filter="*",
-                                                          output_format="png")
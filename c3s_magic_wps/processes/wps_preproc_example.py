@@ -7,8 +7,8 @@ from pywps.inout.literaltypes import make_allowedvalues
 from pywps.response.status import WPS_STATUS
 
 from .. import runner, util
-from .utils import (default_outputs, model_experiment_ensemble, outputs_from_data_names, outputs_from_plot_names,
-                    year_ranges)
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_data_names,
+                    outputs_from_plot_names, OutputSpec, year_ranges)
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -65,6 +65,24 @@ class PreprocessExample(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            *[
+                OutputSpec('multi_model_{}_ta_{}'.format(stat, output), root, os.path.join('diagnostic1', 'script1'),
+                           'MultiModel{}*'.format(stat.capitalize()), ext) for stat in ['mean', 'median']
+                for output, root, ext in [('plot', 'plot', 'png'), ('data', 'work', 'nc')]
+            ],
+            *[
+                OutputSpec('model{}_mean_{}_{}'.format(i, var, output), root, os.path.join('diagnostic1', 'script1'),
+                           '*{{model{}}}*{}*'.format(i, var), ext) for var in ['ta', 'pr'] for i in range(1, 3)
+                for output, root, ext in [('plot', 'plot', 'png'), ('data', 'work', 'nc')]
+            ],
+            *[
+                OutputSpec('reference_model_mean_{}_{}'.format(var, output), root,
+                           os.path.join('diagnostic1', 'script1'), 'OBS*{}*'.format(var), ext) for var in ['ta', 'pr']
+                for output, root, ext in [('plot', 'plot', 'png'), ('data', 'work', 'nc')]
+            ],
+        ]
+
         super(PreprocessExample, self).__init__(
             self._handler,
             identifier="preproc",
@@ -123,7 +141,7 @@ class PreprocessExample(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -135,82 +153,9 @@ class PreprocessExample(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, constraints, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-                LOGGER.exception('Getting output failed: ' + str(e))
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'preproc_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'preproc_result.zip'),
+                        model1=constraints['models'][0].data, model2=constraints['models'][1].data)
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, constraints, response):
-        response.update_status("collecting output ...", 80)
-
-        for var in ['mean', 'median']:
-            plotkey = 'multi_model_{}_ta_plot'.format(var)
-            datakey = 'multi_model_{}_ta_data'.format(var)
-
-            LOGGER.info('Setting response for: {}'.format(plotkey))
-            response.outputs[plotkey].output_format = Format('application/png')
-            response.outputs[plotkey].file = runner.get_output(result['plot_dir'],
-                                                               path_filter=os.path.join('diagnostic1', 'script1'),
-                                                               name_filter="MultiModel{}*".format(var.capitalize()),
-                                                               output_format="png")
-
-            LOGGER.info('Setting response for: {}'.format(datakey))
-            response.outputs[datakey].output_format = FORMATS.NETCDF
-            response.outputs[datakey].file = runner.get_output(result['work_dir'],
-                                                               path_filter=os.path.join('diagnostic1', 'script1'),
-                                                               name_filter="MultiModel{}*".format(var.capitalize()),
-                                                               output_format="nc")
-
-        for var in ['ta', 'pr']:
-            for i in range(1, 3):
-                model = 'model{}'.format(i)
-                plotkey = '{}_mean_{}_plot'.format(model, var)
-                datakey = '{}_mean_{}_data'.format(model, var)
-
-                LOGGER.info('Setting response for: {}'.format(plotkey))
-                LOGGER.info('Setting response for: {}'.format(datakey))
-                response.outputs[plotkey].output_format = Format('application/png')
-                response.outputs[plotkey].file = runner.get_output(result['plot_dir'],
-                                                                   path_filter=os.path.join('diagnostic1', 'script1'),
-                                                                   name_filter="*{}*{}*".format(
-                                                                       constraints['models'][i - 1].data, var),
-                                                                   output_format="png")
-
-                response.outputs[datakey].output_format = FORMATS.NETCDF
-                response.outputs[datakey].file = runner.get_output(result['work_dir'],
-                                                                   path_filter=os.path.join('diagnostic1', 'script1'),
-                                                                   name_filter="*{}*{}*".format(
-                                                                       constraints['models'][i - 1].data, var),
-                                                                   output_format="nc")
-
-            plotkey = 'reference_model_mean_{}_plot'.format(var)
-            datakey = 'reference_model_mean_{}_data'.format(var)
-
-            LOGGER.info('Setting response for: {}'.format(plotkey))
-            LOGGER.info('Setting response for: {}'.format(datakey))
-            response.outputs[plotkey].output_format = Format('application/png')
-            response.outputs[plotkey].file = runner.get_output(result['plot_dir'],
-                                                               path_filter=os.path.join('diagnostic1', 'script1'),
-                                                               name_filter="OBS*{}*".format(var),
-                                                               output_format="png")
-
-            response.outputs[datakey].output_format = FORMATS.NETCDF
-            response.outputs[datakey].file = runner.get_output(result['work_dir'],
-                                                               path_filter=os.path.join('diagnostic1', 'script1'),
-                                                               name_filter="OBS*{}*".format(var),
-                                                               output_format="nc")
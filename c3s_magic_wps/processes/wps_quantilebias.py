@@ -6,7 +6,8 @@ from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
 from .. import runner, util
-from .utils import default_outputs, model_experiment_ensemble, outputs_from_plot_names, year_ranges
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -53,6 +54,10 @@ class QuantileBias(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('model', 'work', os.path.join('quantilebias', 'main'), '{model}*', 'nc'),
+        ]
+
         super(QuantileBias, self).__init__(
             self._handler,
             identifier="quantile_bias",
@@ -106,7 +111,7 @@ class QuantileBias(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -118,31 +123,8 @@ class QuantileBias(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(constraints['model'], result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'quantilebias_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'quantilebias_result.zip'), model=constraints['model'])
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, model, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-
-        response.outputs['model'].output_format = FORMATS.NETCDF
-        response.outputs['model'].file = runner.get_output(result['work_dir'],
-                                                           path_filter=os.path.join('quantilebias', 'main'),
-                                                           name_filter="{}*".format(model),
-                                                           output_format="nc")
@@ -5,7 +5,8 @@ from pywps import FORMATS, ComplexInput, ComplexOutput, Format, LiteralInput, Li
 from pywps.app.Common import Metadata
 
 from .. import runner, util
-from .utils import default_outputs, model_experiment_ensemble, outputs_from_plot_names, year_ranges
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -57,6 +58,11 @@ class ShapeSelect(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('data', 'work', os.path.join('diagnostic1', 'script1'), 'CMIP5*', 'nc'),
+            OutputSpec('xlsx_data', 'work', os.path.join('diagnostic1', 'script1'), 'CMIP5*', 'xlsx'),
+        ]
+
         super(ShapeSelect, self).__init__(
             self._handler,
             identifier="shapefile_selection",
@@ -114,7 +120,7 @@ class ShapeSelect(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -126,36 +132,8 @@ class ShapeSelect(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'shapeselect_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'shapeselect_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        response.outputs['data'].output_format = Format('application/png')
-        response.outputs['data'].file = runner.get_output(result['work_dir'],
-                                                          path_filter=os.path.join('diagnostic1', 'script1'),
-                                                          name_filter="CMIP5*",
-                                                          output_format="nc")
-
-        response.outputs['xlsx_data'].output_format = Format('application/vnd.ms-excel')
-        response.outputs['xlsx_data'].file = runner.get_output(result['work_dir'],
-                                                               path_filter=os.path.join('diagnostic1', 'script1'),
-                                                               name_filter="CMIP5*",
-                                                               output_format="xlsx")
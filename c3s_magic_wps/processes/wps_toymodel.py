@@ -5,7 +5,8 @@ from pywps import FORMATS, ComplexInput, ComplexOutput, Format, LiteralInput, Li
 from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
-from .utils import default_outputs, year_ranges, model_experiment_ensemble, outputs_from_plot_names
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 from .. import runner, util
 
@@ -98,6 +99,11 @@ class Toymodel(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            OutputSpec('plot', 'plot', os.path.join('toymodel', 'main'), 'synthetic*', 'jpg'),
+            OutputSpec('model', 'work', os.path.join('toymodel', 'main'), 'synthetic*', 'nc'),
+        ]
+
         super(Toymodel, self).__init__(
             self._handler,
             identifier="toymodel",
@@ -158,7 +164,8 @@ class Toymodel(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        # the synthetic members are random, so do not reuse earlier results
+        result = runner.run(recipe_file, config_file, use_cache=False, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -170,37 +177,8 @@ class Toymodel(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'toymodel_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'toymodel_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-
-        response.outputs['plot'].output_format = Format('image/jpeg')
-        response.outputs['plot'].file = runner.get_output(result['plot_dir'],
-                                                          path_filter=os.path.join('toymodel', 'main'),
-                                                          name_filter="synthetic*",
-                                                          output_format="jpg")
-
-        response.outputs['model'].output_format = FORMATS.NETCDF
-        response.outputs['model'].file = runner.get_output(result['work_dir'],
-                                                           path_filter=os.path.join('toymodel', 'main'),
-                                                           name_filter="synthetic*",
-                                                           output_format="nc")
@@ -6,7 +6,8 @@ from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
 from .. import runner, util
-from .utils import default_outputs, model_experiment_ensemble, outputs_from_plot_names, year_ranges
+from .utils import (collect_outputs, default_outputs, model_experiment_ensemble, outputs_from_plot_names, OutputSpec,
+                    year_ranges)
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -58,6 +59,17 @@ class ZMNAM(Process):
             *default_outputs(),
         ]
 
+        self.output_specs = [
+            *[
+                OutputSpec('{}_plot'.format(plot.lower()), 'plot', os.path.join('zmnam', 'main'), '*_{}'.format(plot),
+                           'png') for plot, _ in self.plotlist
+            ],
+            OutputSpec('regr_map', 'work', os.path.join('zmnam', 'main'), '*regr_map*', 'nc'),
+            OutputSpec('eofs', 'work', os.path.join('zmnam', 'main'), '*eofs*', 'nc'),
+            OutputSpec('pc_mo', 'work', os.path.join('zmnam', 'main'), '*pc_mo*', 'nc'),
+            OutputSpec('pc_da', 'work', os.path.join('zmnam', 'main'), '*pc_da*', 'nc'),
+        ]
+
         super(ZMNAM, self).__init__(
             self._handler,
             identifier="zmnam",
@@ -105,7 +117,7 @@ class ZMNAM(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -117,56 +129,8 @@ class ZMNAM(Process):
         response.outputs['debug_log'].output_format = FORMATS.TEXT
         response.outputs['debug_log'].file = result['debug_logfile']
 
-        if result['success']:
-            try:
-                self.get_outputs(result, response)
-            except Exception as e:
-                response.update_status("exception occured: " + str(e), 85)
-        else:
-            LOGGER.exception('esmvaltool failed!')
-            response.update_status("exception occured: " + result['exception'], 85)
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'),
-            os.path.join(self.workdir, 'zmnam_result.zip'))
+        collect_outputs(response, result, self.output_specs, os.path.join(self.workdir, 'output'),
+                        os.path.join(self.workdir, 'zmnam_result.zip'))
 
         response.update_status("done.", 100)
         return response
-
-    def get_outputs(self, result, response):
-        # result plot
-        response.update_status("collecting output ...", 80)
-        for plot, _ in self.plotlist:
-            key = '{}_plot'.format(plot.lower())
-            response.outputs[key].output_format = Format('application/png')
-            response.outputs[key].file = runner.get_output(result['plot_dir'],
-                                                           path_filter=os.path.join('zmnam', 'main'),
-                                                           name_filter="*_{}".format(plot),
-                                                           output_format="png")
-
-        response.outputs['regr_map'].output_format = FORMATS.NETCDF
-        response.outputs['regr_map'].file = runner.get_output(result['work_dir'],
-                                                              path_filter=os.path.join('zmnam', 'main'),
-                                                              name_filter="*regr_map*",
-                                                              output_format="nc")
-
-        response.outputs['eofs'].output_format = FORMATS.NETCDF
-        response.outputs['eofs'].file = runner.get_output(result['work_dir'],
-                                                          path_filter=os.path.join('zmnam', 'main'),
-                                                          name_filter="*eofs*",
-                                                          output_format="nc")
-
-        response.outputs['pc_mo'].output_format = FORMATS.NETCDF
-        response.outputs['pc_mo'].file = runner.get_output(result['work_dir'],
-                                                           path_filter=os.path.join('zmnam', 'main'),
-                                                           name_filter="*pc_mo*",
-                                                           output_format="nc")
-
-        response.outputs['pc_da'].output_format = FORMATS.NETCDF
-        response.outputs['pc_da'].file = runner.get_output(result['work_dir'],
-                                                           path_filter=os.path.join('zmnam', 'main'),
-                                                           name_filter="*pc_da*",
-                                                           output_format="nc")
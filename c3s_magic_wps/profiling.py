@@ -0,0 +1,98 @@
+import collections
+import contextlib
+import cProfile
+import os
+import sys
+import threading
+
+from pywps import configuration
+
+from .util import is_true
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# files written next to the esmvaltool logs of a profiled run
+PSTATS_FILE = 'profile.pstats'
+COLLAPSED_FILE = 'profile.collapsed.txt'
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    name = '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+    # semicolons separate the frames of a collapsed stack
+    return name.replace(';', ':')
+
+
+class StackSampler():
+    """Thread sampling the stack of another thread every `interval` seconds.
+
+    The samples are counted per stack, and written in the collapsed format read by flamegraph.pl and speedscope: a
+    line per stack with the frames from the outermost to the innermost separated by semicolons, followed by the count.
+    """
+    def __init__(self, thread_id, interval=0.01):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        if names:
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as fp:
+            for stack, count in sorted(self.stacks.items()):
+                fp.write('{} {}\n'.format(stack, count))
+
+
+def is_enabled():
+    return is_true(configuration.get_config_value('profiling', 'enabled'))
+
+
+def get_interval():
+    return int(configuration.get_config_value('profiling', 'sample_interval_ms') or 10) / 1000
+
+
+@contextlib.contextmanager
+def profiled(directory, interval=0.01):
+    """Profile the code run in this context with cProfile and a StackSampler.
+
+    The pstats dump and the collapsed stacks are written to `directory`, the path of the collapsed stacks is returned.
+    Only the calling thread is profiled, not the subprocesses esmvaltool starts for parallel tasks and diagnostic
+    scripts.
+    """
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), interval)
+    collapsed_file = os.path.join(directory, COLLAPSED_FILE)
+    sampler.start()
+    profiler.enable()
+    try:
+        yield collapsed_file
+    finally:
+        profiler.disable()
+        sampler.stop()
+        try:
+            profiler.dump_stats(os.path.join(directory, PSTATS_FILE))
+            sampler.write(collapsed_file)
+        except OSError:
+            LOGGER.exception("cannot write the profile to %s", directory)
+        LOGGER.info("wrote profile of %s samples to %s", sum(sampler.stacks.values()), directory)
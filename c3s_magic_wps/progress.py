@@ -0,0 +1,158 @@
+import glob
+import os
+import re
+import threading
+import time
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# line of the esmvaltool log written when a task is done
+TASK_COMPLETED = re.compile(r'Successfully completed task (\S+)')
+
+
+def _tasks(recipe):
+    """Return the names of the preprocessing tasks and of the diagnostic script tasks of a recipe."""
+    preprocessing, scripts = set(), set()
+    for name, diagnostic in (recipe.get('diagnostics') or {}).items():
+        diagnostic = diagnostic or {}
+        preprocessing.update('{}/{}'.format(name, variable) for variable in diagnostic.get('variables') or {})
+        scripts.update('{}/{}'.format(name, script) for script in diagnostic.get('scripts') or {})
+    return preprocessing, scripts
+
+
+def format_duration(seconds):
+    minutes = seconds / 60
+    if minutes < 1.5:
+        return 'a minute'
+    if minutes < 90:
+        return '{:.0f} minutes'.format(minutes)
+    return '{:.1f} hours'.format(minutes / 60)
+
+
+class RunProgress():
+    """Status updates of a wps response while esmvaltool runs a recipe.
+
+    The percentage is interpolated between `start` and `end` from the `expected` seconds of the `preprocess` and
+    `diagnostic` phases, and moved on by the tasks esmvaltool reports as completed in its log. When only the expected
+    seconds of the whole `run` are known, they are split by the number of tasks. The message tells the time left,
+    including the expected `collect` and `archive` phases after the run.
+    """
+    def __init__(self, response, output_dir, recipe, expected, start=20, end=80, interval=10):
+        self.response = response
+        self.output_dir = output_dir
+        self.preprocessing, self.scripts = _tasks(recipe)
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.completed = set()
+        self.started = None
+        # seconds after the start when all preprocessing tasks were completed
+        self.preprocessed = None
+        self.finished = None
+        self.percentage = start
+        self.message = None
+
+        tasks = len(self.preprocessing) + len(self.scripts)
+        self.share = len(self.preprocessing) / tasks if tasks else 0.5
+        self.expected = dict(expected)
+        if self.expected.get('preprocess') is None or self.expected.get('diagnostic') is None:
+            run = self.expected.get('run')
+            self.expected['preprocess'] = run * self.share if run is not None else None
+            self.expected['diagnostic'] = run * (1 - self.share) if run is not None else None
+        elif self.expected['preprocess'] + self.expected['diagnostic'] > 0:
+            self.share = self.expected['preprocess'] / (self.expected['preprocess'] + self.expected['diagnostic'])
+
+        self._log = None
+        self._offset = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _read_log(self):
+        if self._log is None:
+            logs = glob.glob(os.path.join(self.output_dir, '*', 'run', 'main_log.txt'))
+            if not logs:
+                return
+            self._log = max(logs, key=os.path.getmtime)
+        with open(self._log, 'rb') as fp:
+            fp.seek(self._offset)
+            data = fp.read()
+        data = data[:data.rfind(b'\n') + 1]
+        self._offset += len(data)
+        self.completed.update(TASK_COMPLETED.findall(data.decode('utf-8', 'replace')))
+
+    @staticmethod
+    def _fraction(done, elapsed, expected):
+        """Return the done fraction of a phase and its seconds left, None when it takes longer than expected."""
+        if not expected:
+            return done, None
+        fraction = max(done, min(elapsed / expected, 0.95))
+        if elapsed > expected:
+            return fraction, None
+        return fraction, expected * (1 - fraction)
+
+    def update(self, now=None):
+        """Read the completed tasks from the log and update the status of the response."""
+        now = time.time() if now is None else now
+        elapsed = now - self.started
+        self._read_log()
+        if self.preprocessed is None and self.preprocessing <= self.completed:
+            self.preprocessed = elapsed
+
+        middle = self.start + (self.end - self.start) * self.share
+        if self.preprocessed is None:
+            done = len(self.preprocessing & self.completed)
+            fraction, left = self._fraction(done / len(self.preprocessing), elapsed, self.expected['preprocess'])
+            percentage = self.start + (middle - self.start) * fraction
+            step = "preprocessing, {} of {} tasks done".format(done, len(self.preprocessing))
+            if left is not None:
+                left += self.expected['diagnostic']
+        else:
+            done = len(self.scripts & self.completed)
+            fraction, left = self._fraction(done / max(len(self.scripts), 1), elapsed - self.preprocessed,
+                                            self.expected['diagnostic'])
+            percentage = middle + (self.end - middle) * fraction
+            step = "running diagnostic scripts, {} of {} done".format(done, len(self.scripts))
+
+        if left is not None:
+            left += sum(self.expected.get(phase) or 0 for phase in ('collect', 'archive'))
+            step += ", about {} left".format(format_duration(left))
+        elif self.expected['preprocess'] is not None:
+            step += ", taking longer than usual"
+
+        message = "running diagnostic: {} ...".format(step)
+        percentage = max(self.percentage, int(percentage))
+        if (message, percentage) != (self.message, self.percentage):
+            self.message, self.percentage = message, percentage
+            self.response.update_status(message, percentage)
+
+    def _poll(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.update()
+            except Exception:
+                LOGGER.exception("cannot update the progress of the esmvaltool run")
+
+    def phases(self):
+        """Return the seconds of the preprocess and diagnostic phases, when the end of the preprocessing was seen."""
+        if self.preprocessed is None or self._thread is not None:
+            return {}
+        return {'preprocess': self.preprocessed, 'diagnostic': self.finished - self.preprocessed}
+
+    def __enter__(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self.finished = time.time() - self.started
+        try:
+            self._read_log()
+        except OSError:
+            pass
+        if self.preprocessed is None and self.preprocessing <= self.completed:
+            self.preprocessed = self.finished
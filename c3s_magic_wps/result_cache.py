@@ -0,0 +1,233 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# keys of the result dict returned by runner.run which are paths in the output dir
+RESULT_PATHS = ['logfile', 'debug_logfile', 'plot_dir', 'work_dir', 'run_dir']
+
+# the number of parallel tasks depends on the load of the server, but does not change the result
+_MAX_PARALLEL_TASKS = re.compile(r'^max_parallel_tasks:.*$', re.MULTILINE)
+
+
+def _link_or_copy(src, dst):
+    """Hard link `src` to `dst`, or copy it when they are on different file systems."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _copy_tree(src, dst):
+    shutil.copytree(src, dst, copy_function=_link_or_copy)
+
+
+def _tree_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def _esmvaltool_version():
+    try:
+        import esmvaltool
+        return getattr(esmvaltool, '__version__', 'unknown')
+    except ImportError:
+        return 'unknown'
+
+
+def _recipe_inputs(recipe):
+    """Yield the dataset, exp, ensemble, mip and short_name of every CMIP5 dataset in the recipe."""
+    datasets = recipe.get('datasets') or []
+    for diagnostic in (recipe.get('diagnostics') or {}).values():
+        diagnostic = diagnostic or {}
+        for short_name, variable in (diagnostic.get('variables') or {}).items():
+            variable = variable or {}
+            for dataset in datasets + (diagnostic.get('additional_datasets') or []) + (variable.get(
+                    'additional_datasets') or []):
+                facets = dict(variable)
+                facets.update(dataset)
+                if facets.get('project', 'CMIP5') != 'CMIP5':
+                    continue
+                facets.setdefault('short_name', short_name)
+                if all(facets.get(key) for key in ('dataset', 'exp', 'ensemble', 'mip')):
+                    yield facets
+
+
+def input_fingerprint(recipe, archive_root):
+    """Return the paths, sizes and mtimes of all archive files used by the CMIP5 datasets in the recipe."""
+    fingerprint = []
+    for facets in _recipe_inputs(recipe):
+        exps = facets['exp'] if isinstance(facets['exp'], list) else [facets['exp']]
+        for exp in exps:
+            # CP4CDS drs: institute/dataset/exp/frequency/modeling_realm/mip/ensemble/short_name
+            pattern = os.path.join(glob.escape(archive_root), '*', str(facets['dataset']), str(exp), '*', '*',
+                                   str(facets['mip']), str(facets['ensemble']), str(facets['short_name']))
+            for path in sorted(glob.glob(pattern)):
+                for root, _, files in os.walk(path):
+                    for name in sorted(files):
+                        stat = os.stat(os.path.join(root, name))
+                        fingerprint.append((os.path.join(root, name), stat.st_size, stat.st_mtime_ns))
+    return fingerprint
+
+
+class ResultCache():
+    """Content addressed cache of ESMValTool results.
+
+    An entry is keyed by a hash of the rendered recipe and config, the ESMValTool version and the archive files
+    used by the recipe. It holds the output dir of the run (plots, work and run dirs) and, once created, the zip
+    archive of it. Entries are evicted least recently used first when the cache grows beyond `max_size` bytes.
+    """
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, recipe_file, config_file, skip_nonexistent=False):
+        workdir = os.path.dirname(os.path.abspath(recipe_file))
+        with open(recipe_file) as fp:
+            recipe = fp.read()
+        with open(config_file) as fp:
+            config = fp.read()
+
+        config_yaml = yaml.safe_load(config) or {}
+        archive_root = (config_yaml.get('rootpath') or {}).get('CMIP5')
+        fingerprint = []
+        if archive_root:
+            fingerprint = input_fingerprint(yaml.safe_load(recipe) or {}, str(archive_root))
+
+        content = dict(
+            # the workdir differs for every job, but does not change the result
+            recipe=recipe.replace(workdir, '{workdir}'),
+            config=_MAX_PARALLEL_TASKS.sub('', config.replace(workdir, '{workdir}')),
+            esmvaltool=_esmvaltool_version(),
+            skip_nonexistent=skip_nonexistent,
+            inputs=fingerprint,
+        )
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def restore(self, key, output_dir):
+        """Restore the output dir of a cached run and return its result, or None when `key` is not cached."""
+        entry = self._entry(key)
+        meta_file = os.path.join(entry, 'result.json')
+        try:
+            with open(meta_file) as fp:
+                meta = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+        # copied next to the output dir and moved into place, so esmvaltool never runs into a partial copy
+        parent = os.path.dirname(os.path.abspath(output_dir))
+        tmp_dir = None
+        try:
+            os.makedirs(parent, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.restore-')
+            _copy_tree(os.path.join(entry, 'output'), os.path.join(tmp_dir, 'output'))
+            os.replace(os.path.join(tmp_dir, 'output'), output_dir)
+        except OSError:
+            LOGGER.exception("cannot restore esmvaltool result %s from cache", key)
+            return None
+        finally:
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        # mark the entry as recently used
+        os.utime(meta_file)
+
+        result = dict(meta['result'])
+        for name in RESULT_PATHS:
+            result[name] = os.path.join(output_dir, result[name])
+        LOGGER.info("restored esmvaltool result %s from cache", key)
+        return result
+
+    def store(self, key, output_dir, result):
+        """Add the output dir and result of a successful run to the cache."""
+        result = dict(result)
+        # the profile and the job are of the run which was cached, not of the runs restoring it
+        result.pop('profile', None)
+        result.pop('job', None)
+        for name in RESULT_PATHS:
+            result[name] = os.path.relpath(result[name], output_dir)
+
+        tmp_entry = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            _copy_tree(output_dir, os.path.join(tmp_entry, 'output'))
+            meta = dict(result=result, size=_tree_size(tmp_entry), created=time.time())
+            with open(os.path.join(tmp_entry, 'result.json'), 'w') as fp:
+                json.dump(meta, fp)
+            os.rename(tmp_entry, self._entry(key))
+        except OSError:
+            # the same recipe has been stored by another job in the meantime
+            LOGGER.debug("esmvaltool result %s not stored", key, exc_info=True)
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        LOGGER.info("stored esmvaltool result %s in cache", key)
+        self.evict()
+
+    def restore_archive(self, key, archive_file):
+        """Restore the zip archive of a cached run, returns False when it has not been stored."""
+        cached_archive = os.path.join(self._entry(key), 'archive.zip')
+        if not os.path.isfile(cached_archive):
+            return False
+        _link_or_copy(cached_archive, archive_file)
+        return True
+
+    def store_archive(self, key, archive_file):
+        entry = self._entry(key)
+        if os.path.isdir(entry) and not os.path.isfile(os.path.join(entry, 'archive.zip')):
+            tmp_file = os.path.join(entry, '.archive-{}.zip'.format(os.getpid()))
+            try:
+                _link_or_copy(archive_file, tmp_file)
+                os.rename(tmp_file, os.path.join(entry, 'archive.zip'))
+            except OSError:
+                # the entry has been evicted in the meantime
+                LOGGER.debug("archive of esmvaltool result %s not stored", key, exc_info=True)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in `max_size`."""
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            meta_file = os.path.join(self._entry(key), 'result.json')
+            try:
+                with open(meta_file) as fp:
+                    size = json.load(fp)['size']
+                archive = os.path.join(self._entry(key), 'archive.zip')
+                if os.path.isfile(archive):
+                    size += os.path.getsize(archive)
+                entries.append((os.path.getmtime(meta_file), size, key))
+            except (IOError, OSError, ValueError, KeyError):
+                continue
+            total += size
+
+        for _, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            LOGGER.info("evicting esmvaltool result %s from cache", key)
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+
+
+def get_result_cache():
+    """Return the ResultCache configured in the `cache` section, or None when result caching is disabled."""
+    cache_dir = configuration.get_config_value('cache', 'result_dir')
+    if not cache_dir:
+        return None
+    max_size_mb = int(configuration.get_config_value('cache', 'result_max_size_mb') or 10240)
+    return ResultCache(cache_dir, max_size_mb * 1024 * 1024)
@@ -1,28 +1,131 @@
+import contextlib
 import os
-import glob
 import sys
-import zipfile
+import time
 
-from jinja2 import Environment, PackageLoader, select_autoescape
+import yaml
 
 from pywps import configuration
 
+from . import (archive, instrumentation, manifest, metrics, preproc_cache, profiling, progress, result_cache,
+               runtimes, scheduler, worker_pool)
+
 import logging
 LOGGER = logging.getLogger("PYWPS")
 
-template_env = Environment(loader=PackageLoader('c3s_magic_wps', '/templates/esmvaltool'),
-                           autoescape=select_autoescape([
-                               'yml',
-                           ]))
-
 VERSION = "1.0.0"
 
+_template_env = None
+
+
+def get_template_env():
+    """Return the jinja environment of the recipe templates, created when the first recipe is generated."""
+    global _template_env
+    if _template_env is None:
+        from jinja2 import Environment, PackageLoader, select_autoescape
+        _template_env = Environment(loader=PackageLoader('c3s_magic_wps', '/templates/esmvaltool'),
+                                    autoescape=select_autoescape([
+                                        'yml',
+                                    ]))
+    return _template_env
+
+
+def _get_output_dir(config_file):
+    return os.path.join(os.path.dirname(os.path.abspath(config_file)), 'output')
+
+
+def record_phase(job, phase, seconds):
+    """Record the seconds a phase of a job took, to estimate the progress of later jobs.
+
+    `job` is the process and size of the run in the result of `run`, there is none for a result restored from the
+    cache.
+    """
+    if job is None:
+        return
+    try:
+        runtimes.get_runtime_store().record(job[0], job[1], seconds, phase=phase)
+    except Exception:
+        LOGGER.exception("cannot record the runtime of the %s phase of %s", phase, job[0])
+
+
+def run(recipe_file, config_file, skip_nonexistent=False, use_cache=True, process=None, response=None):
+    """Run esmvaltool, or restore the result of an identical earlier run from the result cache.
+
+    Processes whose results are not reproducible pass `use_cache=False`. The wps `process` running the recipe is used
+    to schedule the run, the progress of the run is reported as status of the `response`. The key of the run in the
+    result cache is returned as `cache_key` in the result, to cache its archive.
+    """
+    cache = result_cache.get_result_cache() if use_cache else None
+    key = None
+    if not cache:
+        result = _execute(recipe_file, config_file, skip_nonexistent, process, response)
+    else:
+        output_dir = _get_output_dir(config_file)
+        key = cache.key(recipe_file, config_file, skip_nonexistent)
+        result = cache.restore(key, output_dir)
+        metrics.count('cache_requests', cache='result', result='miss' if result is None else 'hit')
+        if result is None:
+            result = _execute(recipe_file, config_file, skip_nonexistent, process, response)
+            if result['success']:
+                cache.store(key, output_dir, result)
+    result['cache_key'] = key
+
+    # index the output once, for the lookups of the outputs of the process
+    recipe_output_dir = os.path.dirname(result['plot_dir'])
+    if os.path.isdir(recipe_output_dir):
+        manifest.add_manifest(recipe_output_dir)
+    return result
+
 
-def run(recipe_file, config_file, skip_nonexistent=False):
+def _execute(recipe_file, config_file, skip_nonexistent=False, process=None, response=None):
+    """Run esmvaltool in the worker pool, or in this process when no pool is configured.
+
+    The run waits for its turn in the job queue. The runtimes of its phases are recorded to schedule later runs and
+    to estimate their progress, the process and size of the job are returned as `job` in the result to record the
+    phases after the run.
+    """
+    output_dir = _get_output_dir(config_file)
+    with scheduler.admit(recipe_file, process) as job, scheduler.reserve_cpus(config_file):
+        job_key = (job.process, job.size)
+        for measurement in instrumentation.read_sidecar(os.path.dirname(output_dir)):
+            if measurement.get('phase') == 'recipe':
+                record_phase(job_key, 'recipe', measurement['wall_seconds'])
+
+        tracker = None
+        if response is not None:
+            with open(recipe_file) as fp:
+                recipe = yaml.safe_load(fp) or {}
+            expected = runtimes.get_runtime_store().estimate_phases(job.process, job.size)
+            expected['run'] = job.estimate
+            tracker = progress.RunProgress(response, output_dir, recipe, expected)
+
+        started = time.time()
+        with tracker or _nothing():
+            pool = worker_pool.get_worker_pool()
+            if pool is None:
+                result = _run(recipe_file, config_file, skip_nonexistent)
+            else:
+                result = pool.run(recipe_file, config_file, skip_nonexistent)
+        if result['success']:
+            job.record(time.time() - started)
+            for phase, seconds in (tracker.phases() if tracker else {}).items():
+                record_phase(job_key, phase, seconds)
+        result['job'] = job_key
+        return result
+
+
+@contextlib.contextmanager
+def _nothing():
+    yield
+
+
+def _run(recipe_file, config_file, skip_nonexistent=False):
     """Run esmvaltool"""
     from esmvaltool._main import configure_logging, read_config_user_file, process_recipe
     recipe_name = os.path.splitext(os.path.basename(recipe_file))[0]
-    cfg = read_config_user_file(config_file, recipe_name)
+    workdir = os.path.dirname(os.path.abspath(config_file))
+    with instrumentation.phase('read_config', workdir):
+        cfg = read_config_user_file(config_file, recipe_name)
 
     # Create run dir
     if os.path.exists(cfg['run_dir']):
@@ -43,9 +146,13 @@ def run(recipe_file, config_file, skip_nonexistent=False):
     cfg['skip-nonexistent'] = skip_nonexistent
 
     exception = None
+    profile_file = None
+    profile = profiling.profiled(cfg['run_dir'], profiling.get_interval()) if profiling.is_enabled() else _nothing()
     try:
         LOGGER.info("run esmvaltool ...")
-        process_recipe(recipe_file=recipe_file, config_user=cfg)
+        with profile as profile_file, instrumentation.phase('process_recipe', workdir, recipe=recipe_name), \
+                preproc_cache.enabled(preproc_cache.get_preproc_cache(), os.path.dirname(cfg['run_dir'])):
+            process_recipe(recipe_file=recipe_file, config_user=cfg)
         LOGGER.info("esmvaltool ... done.")
         success = True
     except Exception as err:
@@ -66,7 +173,8 @@ def run(recipe_file, config_file, skip_nonexistent=False):
         'debug_logfile': debug_logfile,
         'plot_dir': cfg['plot_dir'],
         'work_dir': cfg['work_dir'],
-        'run_dir': cfg['run_dir']
+        'run_dir': cfg['run_dir'],
+        'profile': profile_file,
     }
 
 
@@ -81,32 +189,34 @@ def generate_recipe(diag,
     workdir = workdir or os.curdir
     workdir = os.path.abspath(workdir)
     output_dir = os.path.join(workdir, 'output')
-    # write config.yml
-    config_templ = template_env.get_template('config.yml')
-    rendered_config = config_templ.render(
-        archive_root=configuration.get_config_value("data", "archive_root"),
-        obs_root=configuration.get_config_value("data", "obs_root"),
-        output_dir=output_dir,
-        output_format=output_format,
-    )
-    config_file = os.path.abspath(os.path.join(workdir, "config.yml"))
-    with open(config_file, 'w') as fp:
-        fp.write(rendered_config)
-
-    # write recipe.xml
-    recipe = 'recipe_{0}.yml.j2'.format(diag)
-    recipe_templ = template_env.get_template(recipe)
-    rendered_recipe = recipe_templ.render(
-        diag=diag,
-        workdir=workdir,
-        constraints=constraints,
-        start_year=start_year,
-        end_year=end_year,
-        options=options,
-    )
-    recipe_file = os.path.abspath(os.path.join(workdir, "recipe.yml"))
-    with open(recipe_file, 'w') as fp:
-        fp.write(rendered_recipe)
+    with instrumentation.phase('recipe', workdir, diag=diag):
+        # write recipe.xml
+        recipe = 'recipe_{0}.yml.j2'.format(diag)
+        recipe_templ = get_template_env().get_template(recipe)
+        rendered_recipe = recipe_templ.render(
+            diag=diag,
+            workdir=workdir,
+            constraints=constraints,
+            start_year=start_year,
+            end_year=end_year,
+            options=options,
+        )
+        recipe_file = os.path.abspath(os.path.join(workdir, "recipe.yml"))
+        with open(recipe_file, 'w') as fp:
+            fp.write(rendered_recipe)
+
+        # write config.yml
+        config_templ = get_template_env().get_template('config.yml')
+        rendered_config = config_templ.render(
+            archive_root=configuration.get_config_value("data", "archive_root"),
+            obs_root=configuration.get_config_value("data", "obs_root"),
+            output_dir=output_dir,
+            output_format=output_format,
+            max_parallel_tasks=scheduler.max_parallel_tasks(yaml.safe_load(rendered_recipe) or {}),
+        )
+        config_file = os.path.abspath(os.path.join(workdir, "config.yml"))
+        with open(config_file, 'w') as fp:
+            fp.write(rendered_config)
     return recipe_file, config_file
 
 
@@ -115,7 +225,7 @@ def get_output(output_dir, path_filter, name_filter=None, output_format='pdf'):
     # output/recipe_20180130_111116/plots/diagnostic1/script1/MultiModelMean_T3M_ta_2001-2002_mean.pdf
     output_filter = os.path.join(output_dir, path_filter, '{0}.{1}'.format(name_filter, output_format))
     LOGGER.debug("output_filter %s", output_filter)
-    matches = glob.glob(output_filter)
+    matches = manifest.get_manifest(output_dir).find(output_filter)
     if len(matches) == 0:
         LOGGER.info("output_dir=%s", output_dir)
         raise Exception("no output found in output dir for filter: {}".format(output_filter))
@@ -125,13 +235,37 @@ def get_output(output_dir, path_filter, name_filter=None, output_format='pdf'):
     return matches[0]
 
 
-def compress_output(output_dir, archive_file, exclude_preproc=True):
-    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as ziph:
-        for root, dirs, files in os.walk(output_dir):
-            if not exclude_preproc or 'preproc' not in root:
-                for file in files:
-                    path = os.path.join(root, file)
-                    arcname = os.path.relpath(path, output_dir)
-                    ziph.write(path, arcname)
+def compress_output(output_dir, archive_file, exclude_preproc=True, response=None, result=None):
+    """Create a zip archive of the output dir.
+
+    When the WPS `response` is given, the progress is reported as status between 90 and 99 percent. With the `lazy`
+    option of the `archive` section, only a placeholder is written and the archive is created when it is downloaded.
+    The archive is cached with the `result` of the run, and the time taken is recorded for its job.
+    """
+    cache = result_cache.get_result_cache()
+    key = (result or {}).get('cache_key')
+    if cache and key and cache.restore_archive(key, archive_file):
+        return archive_file
+
+    if configuration.get_config_value('archive', 'lazy'):
+        lazy_dir, _, _ = archive.get_lazy_settings()
+        return archive.defer_archive(output_dir, archive_file, lazy_dir, exclude_preproc=exclude_preproc)
+
+    reported = dict(percentage=90)
+
+    def report_progress(done, total):
+        percentage = 90 + 9 * done // max(total, 1)
+        if percentage > reported['percentage']:
+            reported['percentage'] = percentage
+            response.update_status("creating archive of diagnostic result ...", percentage)
+
+    with instrumentation.phase('archive', os.path.dirname(os.path.abspath(output_dir))) as measurement:
+        archive.build_archive(output_dir, archive_file, exclude_preproc=exclude_preproc,
+                              workers=archive.get_workers(),
+                              progress=report_progress if response is not None else None)
+    record_phase((result or {}).get('job'), 'archive', measurement['wall_seconds'])
+
+    if cache and key:
+        cache.store_archive(key, archive_file)
 
     return archive_file
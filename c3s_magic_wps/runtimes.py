@@ -0,0 +1,99 @@
+import contextlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# number of recent runs of a process used for its estimate
+HISTORY = 20
+
+# phases of a job, `run` is the whole esmvaltool run of the `preprocess` and `diagnostic` phases
+PHASES = ('recipe', 'run', 'preprocess', 'diagnostic', 'collect', 'archive')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    process TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    size REAL NOT NULL,
+    seconds REAL NOT NULL,
+    finished REAL NOT NULL
+);
+"""
+
+_INDEX = "CREATE INDEX IF NOT EXISTS runs_phase ON runs (process, phase, finished)"
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+class RuntimeStore():
+    """Runtimes of the phases of finished jobs, kept in a SQLite database shared by all processes of the service.
+
+    A phase is recorded with its process and the size of the job, the amount of model data it processes. The runtime
+    of a phase of a new job is estimated from the runtime per size of the recent jobs of the same process.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(runs)')]
+            if 'phase' not in columns:
+                # databases written before the phases were recorded hold whole runs only
+                connection.execute("ALTER TABLE runs ADD COLUMN phase TEXT NOT NULL DEFAULT 'run'")
+            connection.execute(_INDEX)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def record(self, process, size, seconds, phase='run'):
+        with self._connect() as connection:
+            connection.execute('INSERT INTO runs (process, phase, size, seconds, finished) VALUES (?, ?, ?, ?, ?)',
+                               (process, phase, max(size, 1), seconds, time.time()))
+
+    def estimate(self, process, size, default=None, phase='run'):
+        """Return the expected seconds of a phase of a job of `process` with `size`, or `default` without history."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT size, seconds FROM runs WHERE process = ? AND phase = ? ORDER BY finished DESC LIMIT ?',
+                (process, phase, HISTORY)).fetchall()
+        if not rows:
+            return default
+        return _median(seconds / run_size for run_size, seconds in rows) * max(size, 1)
+
+    def runs(self):
+        """Return the process, phase and seconds of all recorded phases."""
+        with self._connect() as connection:
+            return connection.execute('SELECT process, phase, seconds FROM runs').fetchall()
+
+    def estimate_phases(self, process, size):
+        """Return the expected seconds of all phases of a job, None for the phases without history."""
+        return {phase: self.estimate(process, size, phase=phase) for phase in PHASES}
+
+
+_stores = dict()
+
+
+def get_runtime_store():
+    """Return the RuntimeStore configured in the `scheduler` section."""
+    path = configuration.get_config_value('scheduler', 'runtime_db') or os.path.join(
+        configuration.get_config_value('server', 'workdir') or tempfile.gettempdir(), 'c3s_magic_wps-runtimes.sqlite')
+    if path not in _stores:
+        _stores[path] = RuntimeStore(path)
+    return _stores[path]
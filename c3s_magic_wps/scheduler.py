@@ -0,0 +1,329 @@
+import contextlib
+import fcntl
+import os
+import re
+import sqlite3
+import tempfile
+import time
+
+import yaml
+
+from pywps import configuration
+
+from . import runtimes, util
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+_MAX_PARALLEL_TASKS = re.compile(r'^max_parallel_tasks:.*$', re.MULTILINE)
+
+# lanes of the job queue, for the jobs expected to run shorter and longer than `long_job_seconds`
+LANES = ('short', 'long')
+
+_QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+    pid INTEGER NOT NULL,
+    lane TEXT NOT NULL,
+    process TEXT NOT NULL,
+    expected REAL NOT NULL,
+    enqueued REAL NOT NULL
+);
+"""
+
+
+def count_tasks(recipe):
+    """Return the number of esmvaltool tasks of a recipe, a preprocessing task per dataset and variable plus a
+    task per diagnostic script."""
+    datasets = recipe.get('datasets') or []
+    tasks = 0
+    for diagnostic in (recipe.get('diagnostics') or {}).values():
+        diagnostic = diagnostic or {}
+        for variable in (diagnostic.get('variables') or {}).values():
+            variable = variable or {}
+            tasks += len(datasets) + len(diagnostic.get('additional_datasets') or []) + len(
+                variable.get('additional_datasets') or [])
+        tasks += len(diagnostic.get('scripts') or {})
+    return tasks
+
+
+def job_size(recipe):
+    """Return the size of a job, the number of years of model data read by all preprocessing tasks of a recipe."""
+    datasets = recipe.get('datasets') or []
+    size = 0
+    for diagnostic in (recipe.get('diagnostics') or {}).values():
+        diagnostic = diagnostic or {}
+        for variable in (diagnostic.get('variables') or {}).values():
+            variable = variable or {}
+            for dataset in datasets + (diagnostic.get('additional_datasets') or []) + (
+                    variable.get('additional_datasets') or []):
+                start_year = dataset.get('start_year', variable.get('start_year'))
+                end_year = dataset.get('end_year', variable.get('end_year'))
+                try:
+                    size += max(1, int(end_year) - int(start_year) + 1)
+                except (TypeError, ValueError):
+                    size += 1
+    return max(size, 1)
+
+
+class CpuReservation():
+    """CPU slots held by a job, released when the reservation is closed or the process exits."""
+    def __init__(self, slots):
+        self._slots = slots
+
+    @property
+    def count(self):
+        return len(self._slots)
+
+    def release(self):
+        for fd in self._slots:
+            os.close(fd)
+        self._slots = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class CpuBudget():
+    """CPU budget shared by all jobs running on this node.
+
+    The budget consists of `size` lock files in `lock_dir`, a job holds an exclusive lock on each slot it
+    runs a task on. The locks are shared between all processes of the service, and released by the kernel
+    when a job process dies.
+    """
+    def __init__(self, lock_dir, size):
+        self.lock_dir = lock_dir
+        self.size = size
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def _try_lock(self, slot):
+        fd = os.open(os.path.join(self.lock_dir, 'slot-{}'.format(slot)), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def acquire(self, wanted, poll_interval=1.0):
+        """Reserve up to `wanted` slots of the budget.
+
+        Takes all free slots up to `wanted` and waits only while no slot is free at all, so a job never waits
+        for slots it could run without.
+        """
+        wanted = max(1, min(wanted, self.size))
+        while True:
+            slots = []
+            # start at a different slot in every process to avoid contention on the first slots
+            offset = os.getpid() % self.size
+            for i in range(self.size):
+                if len(slots) == wanted:
+                    break
+                fd = self._try_lock((offset + i) % self.size)
+                if fd is not None:
+                    slots.append(fd)
+            if slots:
+                return CpuReservation(slots)
+            time.sleep(poll_interval)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobTicket():
+    """A job admitted by the JobQueue, holding a slot of its lane until it is released."""
+    def __init__(self, process, size, estimate, lane, slot=None):
+        self.process = process
+        self.size = size
+        self.estimate = estimate
+        self.lane = lane
+        self._slot = slot
+
+    def record(self, seconds):
+        """Record the runtime of the job, to estimate the runtime of later jobs of the same process."""
+        runtimes.get_runtime_store().record(self.process, self.size, seconds)
+
+    def release(self):
+        if self._slot is not None:
+            os.close(self._slot)
+            self._slot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class JobQueue():
+    """Queue of the esmvaltool jobs of all processes of the service, with a lane for short and a lane for long jobs.
+
+    Jobs expected to run for `long_job_seconds` or longer, or without an estimate, use the long lane, so a long job
+    never blocks the short ones. A lane has `slots`, lock files in `queue_dir` held by the running jobs like the slots
+    of the CpuBudget, 0 slots do not limit the lane. Waiting jobs are kept in a SQLite table, the job of a lane with
+    the shortest expected runtime is admitted first, jobs with the same expected runtime in the order they arrived.
+    """
+    def __init__(self, queue_dir, slots, long_job_seconds):
+        self.queue_dir = queue_dir
+        self.slots = slots
+        self.long_job_seconds = long_job_seconds
+        os.makedirs(queue_dir, exist_ok=True)
+        self.path = os.path.join(queue_dir, 'queue.sqlite')
+        with self._connect() as connection:
+            connection.executescript(_QUEUE_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def lane(self, estimate):
+        return 'short' if estimate is not None and estimate < self.long_job_seconds else 'long'
+
+    def _try_lock(self, lane):
+        for slot in range(self.slots[lane]):
+            fd = os.open(os.path.join(self.queue_dir, '{}-{}'.format(lane, slot)), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+    def _next(self, connection, lane):
+        """Return the ticket of the next job of a lane, dropping the tickets of jobs whose process died."""
+        rows = connection.execute('SELECT ticket, pid FROM queue WHERE lane = ? ORDER BY expected, ticket',
+                                  (lane, )).fetchall()
+        for ticket, pid in rows:
+            if _alive(pid):
+                return ticket
+            connection.execute('DELETE FROM queue WHERE ticket = ?', (ticket, ))
+        return None
+
+    def waiting(self, lane=None):
+        """Return the processes of the waiting jobs in the order they are admitted."""
+        with self._connect() as connection:
+            rows = connection.execute('SELECT process, lane FROM queue ORDER BY expected, ticket').fetchall()
+        return [process for process, job_lane in rows if lane in (None, job_lane)]
+
+    def admit(self, process, size, estimate, poll_interval=1.0):
+        """Wait until a job is admitted and return its JobTicket."""
+        lane = self.lane(estimate)
+        if not self.slots[lane]:
+            return JobTicket(process, size, estimate, lane)
+
+        expected = estimate if estimate is not None else self.long_job_seconds
+        with self._connect() as connection:
+            ticket = connection.execute(
+                'INSERT INTO queue (pid, lane, process, expected, enqueued) VALUES (?, ?, ?, ?, ?)',
+                (os.getpid(), lane, process, expected, time.time())).lastrowid
+        try:
+            while True:
+                with self._connect() as connection:
+                    if self._next(connection, lane) == ticket:
+                        slot = self._try_lock(lane)
+                        if slot is not None:
+                            connection.execute('DELETE FROM queue WHERE ticket = ?', (ticket, ))
+                            return JobTicket(process, size, estimate, lane, slot)
+                time.sleep(poll_interval)
+        except BaseException:
+            with self._connect() as connection:
+                connection.execute('DELETE FROM queue WHERE ticket = ?', (ticket, ))
+            raise
+
+
+def default_slots():
+    """Return the slots of the lanes when they are not configured, half of the `parallelprocesses` of the server each.
+
+    The long lane gets the smaller half, so jobs expected to run long never take all the jobs PyWPS runs at the same
+    time. Without a limit of PyWPS, the cpus of the node are shared.
+    """
+    parallel = int(configuration.get_config_value('server', 'parallelprocesses') or 2)
+    if parallel < 1:
+        parallel = os.cpu_count() or 2
+    long_slots = max(1, parallel // 2)
+    return {'short': max(1, parallel - long_slots), 'long': long_slots}
+
+
+def get_job_queue():
+    """Return the JobQueue configured in the `scheduler` section."""
+    queue_dir = configuration.get_config_value('scheduler', 'queue_dir') or os.path.join(
+        configuration.get_config_value('server', 'workdir') or tempfile.gettempdir(), 'c3s_magic_wps-queue')
+    slots = default_slots()
+    for lane in LANES:
+        value = configuration.get_config_value('scheduler', '{}_slots'.format(lane))
+        if value not in (None, ''):
+            slots[lane] = int(value)
+    long_job_seconds = float(configuration.get_config_value('scheduler', 'long_job_seconds') or 600)
+    return JobQueue(queue_dir, slots, long_job_seconds)
+
+
+def admit(recipe_file, process=None):
+    """Wait until the job running `recipe_file` for the wps `process` is admitted by the job queue.
+
+    The runtime of the job is estimated from the recorded runtimes of the process, or from its `Estimated Calculation
+    Time` metadata while there are none. Returns the JobTicket of the job.
+    """
+    with open(recipe_file) as fp:
+        recipe = yaml.safe_load(fp) or {}
+    name = getattr(process, 'identifier', None) or os.path.splitext(os.path.basename(recipe_file))[0]
+    size = job_size(recipe)
+    estimate = runtimes.get_runtime_store().estimate(name, size, default=util.estimated_seconds(process))
+    queue = get_job_queue()
+    LOGGER.info("queueing %s job of size %s, estimated runtime %s seconds", name, size, estimate)
+    started = time.time()
+    ticket = queue.admit(name, size, estimate)
+    LOGGER.info("%s job admitted to the %s lane after %.0f seconds", name, ticket.lane, time.time() - started)
+    return ticket
+
+
+def get_cpu_budget():
+    """Return the CpuBudget configured in the `esmvaltool` section."""
+    size = int(configuration.get_config_value('esmvaltool', 'cpu_budget') or 0) or os.cpu_count() or 1
+    lock_dir = configuration.get_config_value('esmvaltool', 'cpu_budget_dir') or os.path.join(
+        configuration.get_config_value('server', 'workdir') or tempfile.gettempdir(), 'c3s_magic_wps-cpus')
+    return CpuBudget(lock_dir, size)
+
+
+def max_parallel_tasks(recipe):
+    """Return the number of parallel tasks of a job running `recipe`, limited by the cpu budget and the
+    `max_parallel_tasks` setting of the `esmvaltool` section."""
+    tasks = max(1, count_tasks(recipe))
+    limit = int(configuration.get_config_value('esmvaltool', 'max_parallel_tasks') or 0)
+    if limit:
+        tasks = min(tasks, limit)
+    return min(tasks, get_cpu_budget().size)
+
+
+def reserve_cpus(config_file):
+    """Reserve cpus from the budget for the tasks of the job configured in `config_file`.
+
+    When fewer cpus are free than `max_parallel_tasks` in the config file, the setting is lowered to the
+    number of cpus reserved.
+    """
+    with open(config_file) as fp:
+        config = fp.read()
+    match = _MAX_PARALLEL_TASKS.search(config)
+    wanted = int(match.group(0).split(':', 1)[1] or 1) if match else 1
+
+    reservation = get_cpu_budget().acquire(wanted)
+    if match and reservation.count < wanted:
+        LOGGER.info("running with %s instead of %s parallel tasks", reservation.count, wanted)
+        with open(config_file, 'w') as fp:
+            fp.write(_MAX_PARALLEL_TASKS.sub('max_parallel_tasks: {}'.format(reservation.count), config))
+    return reservation
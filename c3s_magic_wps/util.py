@@ -1,4 +1,5 @@
 import os
+import re
 
 
 # wps roles
@@ -22,3 +23,22 @@ def static_url():
 
 def diagdata_url():
     return static_url() + '/diagnosticsdata'
+
+
+def is_true(value):
+    """Return whether a config value, which pywps only converts to a bool for `true` and `false`, switches on."""
+    return value is True or str(value).strip().lower() in ('true', '1', 'yes', 'on')
+
+
+_DURATION = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*(second|minute|hour)s?\s*$', re.IGNORECASE)
+_DURATION_UNITS = {'second': 1, 'minute': 60, 'hour': 3600}
+
+
+def estimated_seconds(process):
+    """Return the `Estimated Calculation Time` metadata of a process in seconds, or None if it has none."""
+    for metadata in getattr(process, 'metadata', None) or []:
+        if metadata.title == 'Estimated Calculation Time':
+            match = _DURATION.match(metadata.href or '')
+            if match:
+                return float(match.group(1)) * _DURATION_UNITS[match.group(2).lower()]
+    return None
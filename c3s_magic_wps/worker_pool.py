@@ -0,0 +1,258 @@
+import atexit
+import glob
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import threading
+
+from multiprocessing.managers import BaseManager
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def failed_result(config_file, exception):
+    """Return the result of a run which failed before esmvaltool reported its result.
+
+    The paths point to the run dir created by esmvaltool, if it got that far, and into the output dir otherwise.
+    """
+    output_dir = os.path.join(os.path.dirname(os.path.abspath(config_file)), 'output')
+    run_dirs = sorted(glob.glob(os.path.join(output_dir, '*', 'run')))
+    recipe_dir = os.path.dirname(run_dirs[-1]) if run_dirs else output_dir
+    run_dir = os.path.join(recipe_dir, 'run')
+    return {
+        'success': False,
+        'exception': exception,
+        'logfile': os.path.join(run_dir, 'main_log.txt'),
+        'debug_logfile': os.path.join(run_dir, 'main_log_debug.txt'),
+        'plot_dir': os.path.join(recipe_dir, 'plots'),
+        'work_dir': os.path.join(recipe_dir, 'work'),
+        'run_dir': run_dir
+    }
+
+
+def _run_esmvaltool(recipe_file, config_file, skip_nonexistent):
+    from .runner import _run
+    return _run(recipe_file, config_file, skip_nonexistent)
+
+
+def _worker_main(conn, target, memory_limit):
+    """Main loop of a worker process, runs the jobs received on `conn` until it is closed."""
+    # lead a process group, so the esmvaltool tasks and diagnostic scripts are killed with the worker
+    os.setsid()
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    # import esmvaltool before the first job arrives
+    try:
+        import esmvaltool._main  # noqa
+    except ImportError:
+        LOGGER.warning("esmvaltool is not available in worker %s", os.getpid())
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        recipe_file, config_file, skip_nonexistent = job
+        try:
+            result = target(recipe_file, config_file, skip_nonexistent)
+        except Exception as err:
+            LOGGER.exception('esmvaltool failed!')
+            result = failed_result(config_file, str(err))
+        conn.send(result)
+
+
+class _Worker():
+    def __init__(self, target, memory_limit):
+        self.conn, child_conn = multiprocessing.Pipe()
+        # not a daemon, esmvaltool starts its own processes for parallel tasks
+        self.process = multiprocessing.Process(target=_worker_main, args=(child_conn, target, memory_limit))
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(5)
+        self.kill()
+
+    def _signal_group(self, signum):
+        try:
+            os.killpg(self.process.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            # the worker has not started its group yet, or the group is gone
+            pass
+
+    def kill(self):
+        """Kill the worker and the processes it started."""
+        self._signal_group(signal.SIGTERM)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+        self._signal_group(signal.SIGKILL)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool():
+    """Supervised pool of pre-started processes running esmvaltool.
+
+    Every job runs in one of `size` worker processes, so a crash or memory leak of esmvaltool does not affect the
+    WPS service. Workers are limited to `memory_limit` bytes of address space, jobs to `time_limit` seconds, and a
+    worker is replaced by a fresh one after `max_jobs` jobs.
+    """
+    def __init__(self, size, max_jobs=10, memory_limit=None, time_limit=None, target=_run_esmvaltool):
+        self.max_jobs = max_jobs
+        self.memory_limit = memory_limit
+        self.time_limit = time_limit
+        self.target = target
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = set()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._start_worker())
+
+    def _start_worker(self):
+        worker = _Worker(self.target, self.memory_limit)
+        with self._lock:
+            self._workers.add(worker)
+        LOGGER.debug("started esmvaltool worker %s", worker.process.pid)
+        return worker
+
+    def _replace_worker(self, worker, kill=False):
+        with self._lock:
+            self._workers.discard(worker)
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+        if not self._closed:
+            self._idle.put(self._start_worker())
+
+    def size(self):
+        with self._lock:
+            return len(self._workers)
+
+    def idle(self):
+        return self._idle.qsize()
+
+    def run(self, recipe_file, config_file, skip_nonexistent=False):
+        """Run the recipe in a worker and return the result dict of `runner.run`."""
+        worker = self._idle.get()
+        worker.jobs += 1
+        try:
+            worker.conn.send((recipe_file, config_file, skip_nonexistent))
+            if not worker.conn.poll(self.time_limit):
+                LOGGER.error("esmvaltool worker %s exceeded the time limit", worker.process.pid)
+                self._replace_worker(worker, kill=True)
+                return failed_result(config_file,
+                                     'esmvaltool exceeded the time limit of {} seconds'.format(self.time_limit))
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            LOGGER.error("esmvaltool worker %s crashed with exit code %s", worker.process.pid,
+                         worker.process.exitcode)
+            self._replace_worker(worker, kill=True)
+            return failed_result(config_file, 'esmvaltool worker crashed')
+
+        if worker.jobs >= self.max_jobs:
+            LOGGER.debug("recycling esmvaltool worker %s after %s jobs", worker.process.pid, worker.jobs)
+            self._replace_worker(worker)
+        else:
+            self._idle.put(worker)
+        return result
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+class _PoolManager(BaseManager):
+    pass
+
+
+_PoolManager.register('WorkerPool', WorkerPool)
+
+_manager = None
+_pool = None
+# pid of the process which started the pool and the settings it was started with
+_owner = None
+_settings = None
+
+
+def _shutdown():
+    if _pool is not None and os.getpid() == _owner:
+        _pool.close()
+        _manager.shutdown()
+
+
+def start_worker_pool(size, max_jobs=10, memory_limit=None, time_limit=None):
+    """Start a WorkerPool in a manager process and return a proxy to it.
+
+    The proxy can be used from processes forked later on, like the processes PyWPS starts for asynchronous jobs. The
+    pool is shut down when the process which started it exits.
+    """
+    global _manager, _pool, _owner, _settings
+    _manager = _PoolManager()
+    _manager.start()
+    _pool = _manager.WorkerPool(size, max_jobs, memory_limit, time_limit)
+    _owner = os.getpid()
+    _settings = (size, max_jobs, memory_limit, time_limit)
+    atexit.unregister(_shutdown)
+    atexit.register(_shutdown)
+    LOGGER.info("started %s esmvaltool workers", size)
+    return _pool
+
+
+def stop_worker_pool():
+    """Shut down the worker pool started by this process, the jobs running in it are stopped."""
+    global _manager, _pool, _owner, _settings
+    _shutdown()
+    _manager = _pool = _owner = _settings = None
+
+
+def current_worker_pool():
+    """Return the worker pool started in this process or its parent, without starting one."""
+    return _pool
+
+
+def _configured_settings():
+    size = int(configuration.get_config_value('esmvaltool', 'workers') or 0)
+    memory_limit = int(configuration.get_config_value('esmvaltool', 'worker_memory_limit_mb') or 0)
+    return (size,
+            int(configuration.get_config_value('esmvaltool', 'worker_max_jobs') or 10),
+            memory_limit * 1024 * 1024 or None,
+            int(configuration.get_config_value('esmvaltool', 'job_time_limit') or 0) or None)
+
+
+def get_worker_pool():
+    """Return the worker pool configured in the `esmvaltool` section, or None to run esmvaltool in process.
+
+    The pool started by this process is replaced when the configuration changed, like after a reload of the service.
+    Processes forked from it keep using the pool of their parent.
+    """
+    settings = _configured_settings()
+    if _pool is None or (settings != _settings and _owner == os.getpid()):
+        if _pool is not None:
+            LOGGER.info("restarting the esmvaltool workers with the new configuration")
+            stop_worker_pool()
+        if settings[0]:
+            start_worker_pool(*settings)
+    return _pool
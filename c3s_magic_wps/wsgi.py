@@ -1,18 +1,104 @@
 import os
-from pywps.app.Service import Service
+import threading
 
-from .processes import processes
+import logging
+LOGGER = logging.getLogger("PYWPS")
 
 
-def create_app(cfgfiles=None):
+def get_config_files(cfgfiles=None):
+    """Return the default configuration followed by `cfgfiles` and the file in $PYWPS_CFG."""
     config_files = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
     if cfgfiles:
         config_files.extend(cfgfiles)
     if 'PYWPS_CFG' in os.environ:
         config_files.append(os.environ['PYWPS_CFG'])
+    return config_files
+
+
+def create_app(cfgfiles=None):
+    from pywps import configuration
+    from pywps.app.Service import Service
+
+    from .describe_cache import DescribeCache, data_version
+    from .metrics import MetricsEndpoint
+    from .processes import create_processes
+    from .worker_pool import get_worker_pool
+
+    config_files = get_config_files(cfgfiles)
     print(config_files)
-    service = Service(processes=processes, cfgfiles=config_files)
-    return service
+    # the outputs of the processes depend on the configuration, like the profile when profiling is enabled
+    configuration.load_configuration(config_files)
+    service = VersionedService(lambda: Service(processes=create_processes()), data_version)
+    # start the esmvaltool workers before jobs are forked off, so all jobs share them, a reload applies the new settings
+    get_worker_pool()
+    # the process descriptions are rendered once per version of the data index
+    return MetricsEndpoint(DescribeCache(service))
+
+
+class VersionedService():
+    """WSGI application of the wps service created by `factory`, created again when `version()` changes.
+
+    The allowed values of the model, experiment and ensemble inputs are looked up when the processes are created, so
+    the service is created for every version of the DataFinder index, when the first request arrives.
+    """
+    def __init__(self, factory, version):
+        self.factory = factory
+        self.version = version
+        self._service = None
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        try:
+            return self.version()
+        except Exception as e:
+            # the inputs list no model data then
+            LOGGER.debug("cannot determine the version of the model data: %s", e)
+            return None
+
+    def load(self):
+        version = self._current_version()
+        service = self._service
+        if service is None or service[0] != version:
+            with self._lock:
+                service = self._service
+                if service is None or service[0] != version:
+                    service = self._service = (version, self.factory())
+        return service[1]
+
+    def __call__(self, environ, start_response):
+        return self.load()(environ, start_response)
+
+
+def _create_application():
+    from .downloads import LazyArchiveMiddleware
+    return LazyArchiveMiddleware(create_app())
+
+
+class LazyApplication():
+    """WSGI application created by `factory` when the first request arrives.
+
+    Importing the package, like the command line does, neither loads the processes nor starts the esmvaltool workers.
+    Pre-forking servers call `load` before forking, so their workers share the application.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self._application = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._application is None:
+            with self._lock:
+                if self._application is None:
+                    self._application = self.factory()
+        return self._application
+
+    def __call__(self, environ, start_response):
+        return self.load()(environ, start_response)
+
+
+application = LazyApplication(_create_application)
 
 
-application = create_app()
+def load_application():
+    """Return the application created, for servers loading the application with a factory before forking."""
+    return application.load()
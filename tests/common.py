@@ -1,4 +1,6 @@
-from pywps import get_ElementMakerForVersion
+import os
+
+from pywps import configuration, get_ElementMakerForVersion
 from pywps.app.basic import get_xpath_ns
 from pywps.tests import WpsClient, WpsTestResponse
 
@@ -16,6 +18,11 @@ class WpsTestClient(WpsClient):
         return super(WpsTestClient, self).get(query)
 
 
+def load_default_config():
+    """Load the default configuration of the service, like creating the application does."""
+    configuration.load_configuration([os.path.join(os.path.dirname(__file__), '..', 'c3s_magic_wps', 'default.cfg')])
+
+
 def client_for(service):
     return WpsTestClient(service, WpsTestResponse)
 
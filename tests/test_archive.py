@@ -0,0 +1,59 @@
+import os
+import zipfile
+
+from c3s_magic_wps import archive
+from c3s_magic_wps.archive import build_archive
+
+
+def _write_output(output_dir):
+    output_dir.join('recipe', 'run', 'main_log.txt').write('log line\n' * 1000, ensure=True)
+    output_dir.join('recipe', 'plots', 'diag', 'script', 'plot.png').write_binary(os.urandom(2048), ensure=True)
+    output_dir.join('recipe', 'work', 'diag', 'script', 'result.nc').write_binary(
+        archive.HDF5_SIGNATURE + b'\0' * 4096, ensure=True)
+    output_dir.join('recipe', 'work', 'diag', 'script', 'classic.nc').write_binary(b'CDF\x01' + b'\0' * 4096)
+    output_dir.join('recipe', 'preproc', 'diag', 'zg', 'zg.nc').write('preproc', ensure=True)
+
+
+def test_build_archive(tmpdir):
+    output_dir = tmpdir.join('output')
+    _write_output(output_dir)
+    archive_file = str(tmpdir.join('result.zip'))
+    progress = []
+    build_archive(str(output_dir), archive_file, workers=2, progress=lambda done, total: progress.append(done))
+
+    with zipfile.ZipFile(archive_file) as zf:
+        assert zf.testzip() is None
+        infos = {info.filename: info for info in zf.infolist()}
+        assert sorted(infos) == [
+            'recipe/plots/diag/script/plot.png',
+            'recipe/run/main_log.txt',
+            'recipe/work/diag/script/classic.nc',
+            'recipe/work/diag/script/result.nc',
+        ]
+        assert infos['recipe/plots/diag/script/plot.png'].compress_type == zipfile.ZIP_STORED
+        assert infos['recipe/work/diag/script/result.nc'].compress_type == zipfile.ZIP_STORED
+        assert infos['recipe/work/diag/script/classic.nc'].compress_type == zipfile.ZIP_DEFLATED
+        assert infos['recipe/run/main_log.txt'].compress_type == zipfile.ZIP_DEFLATED
+        assert zf.read('recipe/run/main_log.txt') == b'log line\n' * 1000
+        assert zf.read('recipe/plots/diag/script/plot.png') == output_dir.join(
+            'recipe', 'plots', 'diag', 'script', 'plot.png').read_binary()
+
+    assert progress[-1] == sum(info.file_size for info in infos.values())
+
+    build_archive(str(output_dir), archive_file, exclude_preproc=False)
+    with zipfile.ZipFile(archive_file) as zf:
+        assert zf.read('recipe/preproc/diag/zg/zg.nc') == b'preproc'
+
+
+def test_build_archive_zip64(tmpdir, monkeypatch):
+    # lower the limits, so zip64 records are written for small files
+    monkeypatch.setattr(archive, 'ZIP64_LIMIT', 100)
+    monkeypatch.setattr(archive, 'ZIP_FILECOUNT_LIMIT', 2)
+    output_dir = tmpdir.join('output')
+    _write_output(output_dir)
+    archive_file = str(tmpdir.join('result.zip'))
+    build_archive(str(output_dir), archive_file)
+
+    with zipfile.ZipFile(archive_file) as zf:
+        assert zf.testzip() is None
+        assert len(zf.infolist()) == 4
@@ -0,0 +1,85 @@
+import os
+
+from c3s_magic_wps.processes.utils.archive_scanner import ArchiveScanner
+
+
+def test_archive_scanner(tmpdir):
+    tmpdir.join('MOHC', 'HadGEM2-ES', 'historical', 'mon').ensure(dir=True)
+    tmpdir.join('MOHC', 'HadGEM2-ES', 'historical', 'data.nc').ensure()
+    tmpdir.join('CSIRO-BOM').ensure(dir=True)
+
+    scanner = ArchiveScanner(str(tmpdir), fanout_depth=1)
+    scanner.scan()
+    tree = scanner.tree('root')
+
+    assert tree['name'] == 'root'
+    assert sorted(child['name'] for child in tree['contents']) == ['CSIRO-BOM', 'MOHC']
+    mohc = next(child for child in tree['contents'] if child['name'] == 'MOHC')
+    assert mohc == {
+        'name': 'MOHC',
+        'contents': [{
+            'name': 'HadGEM2-ES',
+            'contents': [{
+                'name': 'historical',
+                'contents': [{
+                    'name': 'mon'
+                }]
+            }]
+        }]
+    }
+
+
+def _backdate(root, seconds=60):
+    for path, _, _ in os.walk(root):
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns - seconds * 10**9))
+
+
+def test_archive_scanner_rescan(tmpdir, monkeypatch):
+    tmpdir.join('MOHC', 'HadGEM2-ES', 'historical').ensure(dir=True)
+    tmpdir.join('CSIRO-BOM', 'ACCESS1-0', 'historical').ensure(dir=True)
+    # directories changed right before a scan are always listed again
+    _backdate(str(tmpdir))
+
+    scanner = ArchiveScanner(str(tmpdir), fanout_depth=1)
+    scanner.scan()
+
+    assert scanner.scan() == 0
+
+    new_dir = tmpdir.join('MOHC', 'HadGEM2-ES', 'rcp85').ensure(dir=True)
+    parent = os.path.dirname(str(new_dir))
+
+    listed = []
+    scandir = os.scandir
+
+    def _scandir(path):
+        listed.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', _scandir)
+
+    assert scanner.scan() == 2
+    assert listed == [parent, str(new_dir)]
+    assert 'rcp85' in scanner.entries[os.path.join('MOHC', 'HadGEM2-ES')][1]
+
+
+def test_archive_scanner_cache(tmpdir):
+    archive = tmpdir.mkdir('archive')
+    archive.join('MOHC', 'HadGEM2-ES', 'historical').ensure(dir=True)
+    archive.join('MOHC', 'HadGEM2-ES', 'rcp85').ensure(dir=True)
+    archive.join('CSIRO-BOM', 'ACCESS1-0').ensure(dir=True)
+    cache_file = str(tmpdir.join('cache'))
+
+    scanner = ArchiveScanner(str(archive))
+    scanner.scan()
+    scanner.save(cache_file)
+
+    loaded = ArchiveScanner(str(archive))
+    assert loaded.load(cache_file)
+    assert loaded.entries == scanner.entries
+    assert loaded.scanned == scanner.scanned
+    assert loaded.tree() == scanner.tree()
+    assert loaded.scan() == 0
+
+    assert not ArchiveScanner(str(tmpdir)).load(cache_file)
+    assert not ArchiveScanner(str(archive)).load(str(tmpdir.join('missing')))
@@ -1,3 +1,5 @@
+import json
+
 from c3s_magic_wps.processes.utils import DataFinder
 
 
@@ -19,3 +21,99 @@ def test_data_finder():
 
     # print ("tree!", self.data)
     print("pruned tree!", pruned)
+
+
+def _make_tree(root, paths):
+    for path in paths:
+        root.join(*path.split('/')).ensure(dir=True)
+
+
+def test_data_finder_index(tmpdir, monkeypatch):
+    _make_tree(tmpdir, [
+        'MOHC/HadGEM2-ES/historical/mon/atmos/Amon/r1i1p1/pr',
+        'MOHC/HadGEM2-ES/historical/mon/atmos/Amon/r1i1p1/tas',
+        'MOHC/HadGEM2-ES/historical/mon/atmos/Amon/r2i1p1/pr',
+        'MOHC/HadGEM2-ES/historical/day/atmos/day/r1i1p1/zg',
+        'CSIRO-BOM/ACCESS1-0/rcp85/mon/atmos/Amon/r1i1p1/tas',
+    ])
+    monkeypatch.setenv('CMIP_DATA_ROOT', str(tmpdir))
+    monkeypatch.delenv('CMIP_META_CACHE_FILE', raising=False)
+    finder = DataFinder()
+
+    models, experiments, ensembles = finder.get_model_experiment_ensemble(required_variables=['pr', 'tas'],
+                                                                          required_frequency='mon')
+    assert models == ['HadGEM2-ES']
+    assert experiments == ['historical']
+    assert ensembles == ['r1i1p1']
+
+    models, _, _ = finder.get_model_experiment_ensemble(required_variables=['tas'], required_frequency='mon')
+    assert sorted(models) == ['ACCESS1-0', 'HadGEM2-ES']
+
+    assert finder.get_model_experiment_ensemble(required_variables=['zg'], required_frequency='mon') == ([], [], [])
+
+    pruned = finder.get_pruned_tree(required_variables=['zg'], required_frequency='day')
+    assert pruned == {
+        'name': 'root',
+        'contents': [{
+            'name': 'MOHC',
+            'contents': [{
+                'name': 'HadGEM2-ES',
+                'contents': [{
+                    'name': 'historical',
+                    'contents': [{
+                        'name': 'day',
+                        'contents': [{
+                            'name': 'atmos',
+                            'contents': [{
+                                'name': 'day',
+                                'contents': [{
+                                    'name': 'r1i1p1'
+                                }]
+                            }]
+                        }]
+                    }]
+                }]
+            }]
+        }]
+    }
+
+
+def test_data_finder_cache(tmpdir, monkeypatch):
+    archive = tmpdir.mkdir('archive')
+    _make_tree(archive, ['MOHC/HadGEM2-ES/historical/mon/atmos/Amon/r1i1p1/pr'])
+    monkeypatch.setenv('CMIP_DATA_ROOT', str(archive))
+    monkeypatch.setenv('CMIP_META_CACHE_FILE', str(tmpdir.join('cache')))
+    monkeypatch.setenv('CMIP_META_CACHE_TTL', '3600')
+    # do not serialize trees for processes, which would already trigger the refresh
+    monkeypatch.setattr(DataFinder, 'registered_keys', set())
+
+    finder = DataFinder()
+    assert finder.get_model_experiment_ensemble(['pr'])[0] == ['HadGEM2-ES']
+
+    # a new finder serves the cached data first and picks up the change in the background
+    _make_tree(archive, ['CSIRO-BOM/ACCESS1-0/historical/mon/atmos/Amon/r1i1p1/pr'])
+    monkeypatch.setenv('CMIP_META_CACHE_TTL', '0')
+    finder = DataFinder()
+    version = finder.version
+    assert finder.check_stale()
+    finder._refresh_thread.join()
+    assert sorted(finder.get_model_experiment_ensemble(['pr'])[0]) == ['ACCESS1-0', 'HadGEM2-ES']
+    assert finder.version > version
+
+
+def test_data_finder_json(tmpdir, monkeypatch):
+    _make_tree(tmpdir, ['MOHC/HadGEM2-ES/historical/mon/atmos/Amon/r1i1p1/pr'])
+    monkeypatch.setenv('CMIP_DATA_ROOT', str(tmpdir))
+    monkeypatch.delenv('CMIP_META_CACHE_FILE', raising=False)
+    monkeypatch.setattr(DataFinder, 'registered_keys', set())
+    finder = DataFinder()
+    old_version, old_data, _ = finder._snapshot()
+
+    _make_tree(tmpdir, ['CSIRO-BOM/ACCESS1-0/historical/mon/atmos/Amon/r1i1p1/pr'])
+    assert finder.refresh()
+    assert json.loads(finder.get_tree_json()) == finder.data
+    assert json.loads(finder.get_pruned_tree_json(['pr'])) == finder.get_pruned_tree(['pr'])
+
+    # the json of a request which took the tree before the refresh does not replace the json of the new tree
+    assert json.loads(finder._serialize(None, old_version, lambda: old_data)) == old_data
+    assert json.loads(finder.get_tree_json()) == finder.data
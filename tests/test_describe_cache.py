@@ -0,0 +1,48 @@
+import gzip
+
+from pywps import Service
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from c3s_magic_wps.describe_cache import DescribeCache
+from c3s_magic_wps.processes.wps_sleep import Sleep
+
+
+class CountingService(Service):
+    def __init__(self, *args, **kwargs):
+        super(CountingService, self).__init__(*args, **kwargs)
+        self.calls = 0
+
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        return super(CountingService, self).__call__(environ, start_response)
+
+
+def test_describe_cache():
+    service = CountingService(processes=[Sleep()])
+    version = [1]
+    client = Client(DescribeCache(service, version=lambda: version[0]), Response)
+
+    query = '/wps?service=WPS&request=DescribeProcess&version=1.0.0&identifier=sleep'
+    response = client.get(query)
+    assert response.status_code == 200
+    assert b'sleep' in response.get_data()
+    etag = response.headers['ETag']
+
+    # the cached document is served until the version changes
+    assert client.get(query.replace('DescribeProcess', 'describeprocess')).get_data() == response.get_data()
+    assert client.get(query, headers={'If-None-Match': etag}).status_code == 304
+    compressed = client.get(query, headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.get_data()) == response.get_data()
+    assert service.calls == 1
+
+    version[0] = 2
+    assert client.get(query, headers={'If-None-Match': etag}).status_code == 304
+    assert service.calls == 2
+
+    # errors and other requests are not cached
+    client.get('/wps?service=WPS&request=DescribeProcess&version=1.0.0&identifier=unknown')
+    client.get('/wps?service=WPS&request=DescribeProcess&version=1.0.0&identifier=unknown')
+    client.get('/wps?service=WPS&request=Execute&version=1.0.0&identifier=unknown')
+    assert service.calls == 5
@@ -0,0 +1,131 @@
+import gzip
+import io
+import os
+import time
+import zipfile
+
+from pywps import configuration
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from c3s_magic_wps import archive
+from c3s_magic_wps.downloads import FileServer, LazyArchiveMiddleware, precompress
+
+
+def _app(environ, start_response):
+    return Response('static')(environ, start_response)
+
+
+def test_lazy_archive(tmpdir, monkeypatch):
+    output_dir = tmpdir.join('job', 'output')
+    output_dir.join('recipe', 'run', 'main_log.txt').write('log line\n' * 1000, ensure=True)
+    output_dir.join('recipe', 'plots', 'plot.png').write_binary(os.urandom(2048), ensure=True)
+    outputpath = tmpdir.join('outputs')
+    archive_file = outputpath.join('uuid', 'result.zip')
+    archive_file.dirpath().ensure(dir=True)
+    archive.defer_archive(str(output_dir), str(archive_file), str(tmpdir.join('lazy')))
+    assert archive.read_placeholder(str(archive_file)) is not None
+
+    monkeypatch.setattr(configuration, 'get_config_value', lambda section, option, default='': {
+        ('server', 'outputpath'): str(outputpath)}.get((section, option), default))
+    client = Client(LazyArchiveMiddleware(_app))
+    assert client.get('/outputs/uuid/other.zip').get_data() == b'static'
+
+    # the first download is streamed while the archive is created
+    response = client.get('/outputs/uuid/result.zip')
+    assert response.status_code == 200
+    assert 'Content-Length' not in response.headers
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as zf:
+        assert zf.testzip() is None
+        assert zf.read('recipe/run/main_log.txt') == b'log line\n' * 1000
+
+    # later downloads use the created archive
+    tree = archive.read_placeholder(str(archive_file))['tree']
+    assert os.path.isfile(archive.materialized_archive(tree))
+    response = client.get('/outputs/uuid/result.zip')
+    assert int(response.headers['Content-Length']) == len(response.get_data())
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as zf:
+        assert sorted(zf.namelist()) == ['recipe/plots/plot.png', 'recipe/run/main_log.txt']
+
+    # created archives are removed after their time to live, deferred archives once they expired
+    archive.evict_archives(str(tmpdir.join('lazy')), ttl=3600, keep=3600)
+    assert os.path.isfile(archive.materialized_archive(tree))
+    past = time.time() - 7200
+    os.utime(archive.materialized_archive(tree), (past, past))
+    archive.evict_archives(str(tmpdir.join('lazy')), ttl=3600, keep=3600)
+    assert not os.path.exists(archive.materialized_archive(tree))
+    archive.evict_archives(str(tmpdir.join('lazy')), ttl=3600, keep=-1)
+    assert not os.path.exists(tree)
+    assert client.get('/outputs/uuid/result.zip').status_code == 410
+
+
+def test_file_server(tmpdir):
+    data = os.urandom(10000)
+    tmpdir.join('outputs', 'uuid', 'data.nc').write_binary(data, ensure=True)
+    client = Client(FileServer(_app, {'/outputs': str(tmpdir.join('outputs')), '/static': None}))
+    assert client.get('/outputs/uuid/other.nc').get_data() == b'static'
+    assert client.get('/outputs/../outputs/uuid/data.nc').get_data() == b'static'
+
+    response = client.get('/outputs/uuid/data.nc')
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.get_data() == data
+
+    response = client.get('/outputs/uuid/data.nc', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 100-199/10000'
+    assert response.get_data() == data[100:200]
+
+    response = client.get('/outputs/uuid/data.nc', headers={'Range': 'bytes=-10'})
+    assert response.get_data() == data[-10:]
+
+    # a file wrapper sending the whole file is only used for the whole file
+    file_wrapper = {'wsgi.file_wrapper': lambda fp, size: iter(lambda: fp.read(size), b'')}
+    response = client.get('/outputs/uuid/data.nc', headers={'Range': 'bytes=100-199'}, environ_overrides=file_wrapper)
+    assert response.get_data() == data[100:200]
+    assert client.get('/outputs/uuid/data.nc', environ_overrides=file_wrapper).get_data() == data
+
+    response = client.get('/outputs/uuid/data.nc', headers={'Range': 'bytes=20000-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */10000'
+
+    response = client.head('/outputs/uuid/data.nc')
+    assert int(response.headers['Content-Length']) == 10000
+    assert response.get_data() == b''
+
+
+def test_file_server_caching(tmpdir):
+    tmpdir.join('outputs', 'uuid', 'plot.png').write_binary(os.urandom(100), ensure=True)
+    tmpdir.join('outputs', 'uuid.xml').write('<status/>')
+    tmpdir.join('static', 'meta.yml').write('key: value\n' * 100, ensure=True)
+    client = Client(FileServer(_app, {'/outputs': str(tmpdir.join('outputs')), '/static': str(tmpdir.join('static'))},
+                               immutable=['/outputs'], max_age=60))
+
+    # job outputs never change, the status documents of the jobs do
+    response = client.get('/outputs/uuid/plot.png')
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get('/outputs/uuid.xml').headers['Cache-Control'] == 'public, max-age=60'
+
+    etag = response.headers['ETag']
+    response = client.get('/outputs/uuid/plot.png', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    response = client.get('/outputs/uuid/plot.png', headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert response.status_code == 304
+    assert client.get('/outputs/uuid/plot.png', headers={'If-None-Match': '"other"'}).status_code == 200
+    # a range of a changed file is not combined with the cached part
+    response = client.get('/outputs/uuid/plot.png', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert response.status_code == 200
+
+    # precompressed variants are sent to clients accepting them
+    assert precompress(str(tmpdir.join('static'))) == 1
+    assert precompress(str(tmpdir.join('static'))) == 0
+    response = client.get('/static/meta.yml', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Type'] == 'text/yaml'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.get_data()) == b'key: value\n' * 100
+    plain = client.get('/static/meta.yml')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.get_data() == b'key: value\n' * 100
+    assert plain.headers['ETag'] != response.headers['ETag']
@@ -0,0 +1,81 @@
+import pytest
+from pywps import Process, Service
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from c3s_magic_wps.processes.utils import DataFinder, model_experiment_ensemble
+from c3s_magic_wps.wsgi import VersionedService
+
+
+@pytest.fixture
+def archive(tmpdir, monkeypatch):
+    tmpdir.join('MOHC', 'HadGEM2-ES', 'historical', 'day', 'atmos', 'day', 'r1i1p1', 'zg').ensure(dir=True)
+    monkeypatch.setenv('CMIP_DATA_ROOT', str(tmpdir))
+    monkeypatch.delenv('CMIP_META_CACHE_FILE', raising=False)
+    monkeypatch.setattr(DataFinder, '_DataFinder__instance', None)
+    return tmpdir
+
+
+def _inputs():
+    return model_experiment_ensemble(model='ACCESS1-0',
+                                     experiment='historical',
+                                     ensemble='r1i1p1',
+                                     required_variables=['zg'],
+                                     required_frequency='day')
+
+
+def test_model_experiment_ensemble(archive):
+    model, experiment, ensemble = _inputs()
+    assert [value.value for value in model.allowed_values] == ['HadGEM2-ES']
+    assert model.data == 'HadGEM2-ES'
+    assert experiment.data == 'historical'
+    assert ensemble.data == 'r1i1p1'
+
+    # inputs created after the index changed list the new data
+    archive.join('CSIRO-BOM', 'ACCESS1-0', 'historical', 'day', 'atmos', 'day', 'r1i1p1', 'zg').ensure(dir=True)
+    DataFinder.get_instance().refresh()
+    model, _, _ = _inputs()
+    assert [value.value for value in model.allowed_values] == ['ACCESS1-0', 'HadGEM2-ES']
+    assert model.data == 'ACCESS1-0'
+
+    clone = model.clone()
+    clone.data = 'HadGEM2-ES'
+    assert clone.data == 'HadGEM2-ES'
+    with pytest.raises(Exception):
+        clone.data = 'MIROC5'
+
+
+class ModelProcess(Process):
+    def __init__(self):
+        super(ModelProcess, self).__init__(lambda request, response: response, identifier='model', title='Model',
+                                           inputs=_inputs())
+
+
+def test_versioned_service(archive):
+    service = VersionedService(lambda: Service(processes=[ModelProcess()]), lambda: DataFinder.get_instance().version)
+    assert DataFinder._DataFinder__instance is None
+    client = Client(service, Response)
+    query = '/wps?service=WPS&request=DescribeProcess&version=1.0.0&identifier=model'
+    document = client.get(query).get_data(as_text=True)
+    assert '<ows:Value>HadGEM2-ES</ows:Value>' in document
+    assert '<ows:Value>ACCESS1-0</ows:Value>' not in document
+    first = service.load()
+    assert service.load() is first
+
+    # the processes are created again with the allowed values of the new index
+    archive.join('CSIRO-BOM', 'ACCESS1-0', 'historical', 'day', 'atmos', 'day', 'r1i1p1', 'zg').ensure(dir=True)
+    DataFinder.get_instance().refresh()
+    document = client.get(query).get_data(as_text=True)
+    assert '<ows:Value>ACCESS1-0</ows:Value>' in document
+    assert '<ows:Value>HadGEM2-ES</ows:Value>' in document
+    assert service.load() is not first
+
+
+def test_model_experiment_ensemble_without_data(monkeypatch):
+    monkeypatch.delenv('CMIP_DATA_ROOT', raising=False)
+    monkeypatch.setattr(DataFinder, '_DataFinder__instance', None)
+    model, _, _ = model_experiment_ensemble(model='ACCESS1-0', experiment='historical', ensemble='r1i1p1')
+
+    assert [value.value for value in model.allowed_values] == ['None']
+    assert model.data == 'None'
+    assert model.json['identifier'] == 'model'
@@ -0,0 +1,139 @@
+import pytest
+
+from c3s_magic_wps.execute import (BatchClient, LoadTest, bench_report, load_matrix, parse_mix, parse_status,
+                                   percentile, write_summary)
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<wps:ExecuteResponse xmlns:wps="http://www.opengis.net/wps/1.0.0" xmlns:ows="http://www.opengis.net/ows/1.1"
+    xmlns:xlink="http://www.w3.org/1999/xlink" statusLocation="http://localhost:5000/outputs/{uuid}.xml">
+    <wps:Status creationTime="2019-01-01T12:00:00Z">{status}</wps:Status>
+    <wps:ProcessOutputs>
+        <wps:Output>
+            <ows:Identifier>archive</ows:Identifier>
+            <wps:Reference href="http://localhost:5000/outputs/{uuid}/result.zip" mimeType="application/zip"/>
+        </wps:Output>
+        <wps:Output>
+            <ows:Identifier>profile</ows:Identifier>
+            <wps:Reference href="" mimeType="text/plain"/>
+        </wps:Output>
+    </wps:ProcessOutputs>
+</wps:ExecuteResponse>
+"""
+
+ACCEPTED = '<wps:ProcessAccepted percentCompleted="0">accepted</wps:ProcessAccepted>'
+SUCCEEDED = '<wps:ProcessSucceeded>done.</wps:ProcessSucceeded>'
+FAILED = """<wps:ProcessFailed><wps:ExceptionReport><ows:Exception exceptionCode="NoApplicableCode">
+    <ows:ExceptionText>esmvaltool failed</ows:ExceptionText>
+    </ows:Exception></wps:ExceptionReport></wps:ProcessFailed>"""
+
+
+def test_load_matrix(tmpdir):
+    matrix = tmpdir.join('matrix.csv')
+    matrix.write('process,model,experiment,ensemble,start_year,end_year,season\n'
+                 'blocking,ACCESS1-0,historical,r1i1p1,1980,1989,DJF\n'
+                 'cvdp,MPI-ESM-LR,historical,r1i1p1,,,\n')
+    jobs = load_matrix(str(matrix))
+    assert jobs[1] == dict(process='cvdp', model='MPI-ESM-LR', experiment='historical', ensemble='r1i1p1')
+    assert jobs[0]['season'] == 'DJF'
+
+    matrix = tmpdir.join('matrix.yml')
+    matrix.write('- process: [blocking, zmnam]\n'
+                 '  model: [ACCESS1-0, MPI-ESM-LR]\n'
+                 '  experiment: historical\n'
+                 '  ensemble: r1i1p1\n'
+                 '- process: sleep\n')
+    jobs = load_matrix(str(matrix))
+    assert len(jobs) == 5
+    assert dict(process='zmnam', model='MPI-ESM-LR', experiment='historical', ensemble='r1i1p1') in jobs
+
+
+def test_parse_status():
+    status, message, location, references = parse_status(RESPONSE.format(uuid='1', status=FAILED))
+    assert (status, message, location) == ('failed', 'esmvaltool failed', 'http://localhost:5000/outputs/1.xml')
+    assert references == {'archive': 'http://localhost:5000/outputs/1/result.zip'}
+
+
+class FakeClient(BatchClient):
+    def __init__(self, *args, **kwargs):
+        super(FakeClient, self).__init__('http', 'localhost', 5000, *args, **kwargs)
+        self.polls = {}
+
+    def _get(self, url):
+        if 'request=Execute' in url:
+            uuid = 'fail' if 'identifier=cvdp' in url else str(len(self.polls))
+            self.polls[uuid] = 0
+            return RESPONSE.format(uuid=uuid, status=ACCEPTED)
+        uuid = url.rsplit('/', 1)[1][:-len('.xml')]
+        self.polls[uuid] += 1
+        if uuid == 'fail':
+            return RESPONSE.format(uuid=uuid, status=FAILED)
+        return RESPONSE.format(uuid=uuid, status=SUCCEEDED if self.polls[uuid] > 2 else ACCEPTED)
+
+    def _download(self, url, path):
+        with open(path, 'w') as fp:
+            fp.write(url)
+
+
+def test_batch_client(tmpdir):
+    jobs = [dict(process='blocking', model='ACCESS1-0'), dict(process='cvdp'), dict(process='zmnam')]
+    client = FakeClient(concurrency=2, poll_interval=0.01, download_dir=str(tmpdir.join('downloads')))
+    results = client.run(jobs)
+
+    assert [result['status'] for result in results] == ['succeeded', 'failed', 'succeeded']
+    assert results[0]['inputs'] == 'model=ACCESS1-0'
+    assert results[1]['message'] == 'esmvaltool failed'
+    assert tmpdir.join('downloads', '0000_blocking', 'archive.zip').check()
+    assert not write_summary(results, str(tmpdir.join('summary.csv')))
+    assert len(tmpdir.join('summary.csv').readlines()) == 4
+
+
+class BrokenDownloadClient(FakeClient):
+    def _download(self, url, path):
+        raise IOError('connection reset')
+
+
+def test_batch_client_download_failure(tmpdir):
+    client = BrokenDownloadClient(poll_interval=0.01, download_dir=str(tmpdir.join('downloads')))
+    result, = client.run([dict(process='blocking')])
+
+    # the job succeeded, only its outputs are missing
+    assert result['status'] == 'succeeded'
+    assert result['message'] == 'done. download failed: archive: connection reset'
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([5], 95) == 5
+    assert percentile([], 50) is None
+
+
+def test_parse_mix():
+    assert parse_mix('GetCapabilities=4,sleep') == {'getcapabilities': 4, 'sleep': 1}
+    with pytest.raises(ValueError):
+        parse_mix('execute=1')
+
+
+class FakeLoadTest(LoadTest):
+    def _request(self, kind):
+        return (0.5 if kind == 'sleep' else 0.01), ('ServerBusy' if kind == 'meta' else None)
+
+
+def test_load_test():
+    report = FakeLoadTest('http', 'localhost', 5000, parse_mix('getcapabilities=2,meta=1,sleep=1'),
+                          concurrency=4).run(100)
+    assert report['total']['requests'] == 100
+    assert sum(summary['requests'] for summary in report['requests'].values()) == 100
+    assert report['requests']['meta']['error_rate'] == 1
+    assert report['requests']['meta']['error_kinds'] == {'ServerBusy': report['requests']['meta']['requests']}
+    assert report['requests']['sleep']['p50_ms'] == 500
+    assert report['total']['errors'] == report['requests']['meta']['requests']
+
+
+def test_bench_report():
+    samples = [('sleep', 0.1 * i, None) for i in range(1, 11)]
+    report = bench_report(samples, 2.0, 1)
+    assert report['total']['throughput'] == 5
+    assert report['requests']['sleep']['p95_ms'] == 1000
@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+from c3s_magic_wps import instrumentation
+
+
+def test_phase(tmpdir):
+    measurements = []
+    instrumentation.add_sink(measurements.append)
+    try:
+        with instrumentation.phase('recipe', str(tmpdir), diag='miles_blocking'):
+            tmpdir.join('recipe.yml').write('x' * 4096)
+        with pytest.raises(ValueError):
+            with instrumentation.phase('process_recipe', str(tmpdir)):
+                raise ValueError('diagnostic failed')
+    finally:
+        instrumentation.remove_sink(measurements.append)
+
+    with open(str(tmpdir.join(instrumentation.SIDECAR))) as fp:
+        phases = json.load(fp)['phases']
+    assert phases == measurements
+    assert [phase['phase'] for phase in phases] == ['recipe', 'process_recipe']
+    assert [phase['success'] for phase in phases] == [True, False]
+    assert phases[0]['diag'] == 'miles_blocking'
+    for key in ('wall_seconds', 'cpu_seconds', 'child_cpu_seconds', 'peak_rss_mb'):
+        assert phases[0][key] >= 0
@@ -0,0 +1,53 @@
+import glob
+import os
+
+from c3s_magic_wps import runner
+from c3s_magic_wps.manifest import OutputManifest, add_manifest
+
+FILES = [
+    'plots/miles_diagnostics/miles_block/ACCESS1-0/historical/r1i1p1/2000-2005/DJF/Block/BlockEvents_ACCESS1-0.png',
+    'plots/miles_diagnostics/miles_block/ACCESS1-0/historical/r1i1p1/2000-2005/DJF/Block/Z500_ACCESS1-0.png',
+    'plots/hyint/main/hyint_ACCESS1-0_pr_map.png',
+    'plots/hyint/main/hyint_ACCESS1-0_comp_map.png',
+    'plots/hyint/main/.hidden_map.png',
+    'work/diagnostic1/cvdp/tas.trends.ann.nc',
+    'work/diagnostic1/cvdp/pr.trends.ann.nc',
+    'work/diagnostic1/script1/CMIP5_ACCESS1-0.nc',
+    'work/diagnostic1/script1/CMIP5_ACCESS1-0.xlsx',
+]
+
+
+def test_output_manifest(tmpdir):
+    root = tmpdir.join('recipe_20190101_120000')
+    for path in FILES:
+        root.join(path).write('', ensure=True)
+    manifest = OutputManifest(str(root))
+
+    for pattern in [
+            'plots/miles_diagnostics/miles_block/*/historical/r1i1p1/2000-2005/DJF/Block/*Events*.png',
+            'plots/hyint/main/*_??_map.png',
+            'plots/hyint/main/*map.png',
+            'plots/hyint/*/*.png',
+            'work/diagnostic1/cvdp/tas.trends.ann.nc',
+            'work/diagnostic1/script1/CMIP5*.*',
+            'work/*.nc',
+            'plots/hyint/main/*.pdf',
+            'plots/hyint/main/*',
+            'plots/hyint/main/hyint*',
+            'work/diagnostic1/*/CMIP5_ACCESS1-0*',
+    ]:
+        pattern = os.path.join(str(root), pattern)
+        assert manifest.find(pattern) == sorted(glob.glob(pattern))
+
+
+def test_get_output(tmpdir):
+    root = tmpdir.join('recipe_20190101_120000')
+    for path in FILES:
+        root.join(path).write('', ensure=True)
+    add_manifest(str(root))
+
+    plot = runner.get_output(str(root.join('plots')), path_filter=os.path.join('hyint', 'main'),
+                             name_filter='*comp_map', output_format='png')
+    assert plot == str(root.join('plots', 'hyint', 'main', 'hyint_ACCESS1-0_comp_map.png'))
+    assert runner.get_output(str(root.join('work')), path_filter=os.path.join('diagnostic1', 'script1'),
+                             name_filter='CMIP5*', output_format='xlsx').endswith('.xlsx')
@@ -0,0 +1,69 @@
+from pywps import configuration
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from c3s_magic_wps import metrics, runtimes
+from c3s_magic_wps.metrics import MetricsEndpoint, histogram, render
+
+from .common import load_default_config
+
+
+def _not_found(environ, start_response):
+    start_response('404 Not Found', [('Content-Type', 'text/plain')])
+    return [b'not found']
+
+
+def test_render():
+    observations = [({'process': 'blocking'}, 3), ({'process': 'blocking'}, 90)]
+    families = [
+        ('jobs_running', 'gauge', 'Jobs running.', [('', {}, 2)]),
+        ('phase_seconds', 'histogram', 'Runtime.', histogram(observations, buckets=(5, 60))),
+    ]
+    assert render(families).splitlines() == [
+        '# HELP c3s_magic_wps_jobs_running Jobs running.',
+        '# TYPE c3s_magic_wps_jobs_running gauge',
+        'c3s_magic_wps_jobs_running 2',
+        '# HELP c3s_magic_wps_phase_seconds Runtime.',
+        '# TYPE c3s_magic_wps_phase_seconds histogram',
+        'c3s_magic_wps_phase_seconds_bucket{le="5",process="blocking"} 1',
+        'c3s_magic_wps_phase_seconds_bucket{le="60",process="blocking"} 1',
+        'c3s_magic_wps_phase_seconds_bucket{le="+Inf",process="blocking"} 2',
+        'c3s_magic_wps_phase_seconds_sum{process="blocking"} 93',
+        'c3s_magic_wps_phase_seconds_count{process="blocking"} 2',
+    ]
+
+
+def test_metrics_endpoint(tmpdir):
+    load_default_config()
+    settings = [
+        ('metrics', 'counters_db', str(tmpdir.join('counters.sqlite'))),
+        ('scheduler', 'runtime_db', str(tmpdir.join('runtimes.sqlite'))),
+        ('scheduler', 'queue_dir', str(tmpdir.join('queue'))),
+        ('server', 'outputpath', str(tmpdir.join('outputs'))),
+    ]
+    previous = [configuration.get_config_value(section, option) for section, option, _ in settings]
+    for section, option, value in settings:
+        configuration.CONFIG.set(section, option, value)
+    try:
+        tmpdir.join('outputs', 'job', 'result.zip').write('x' * 100, ensure=True)
+        runtimes.get_runtime_store().record('blocking', 10, 42, phase='diagnostic')
+        metrics.count('cache_requests', 3, cache='result', result='hit')
+        metrics.count('cache_requests', cache='result', result='miss')
+
+        client = Client(MetricsEndpoint(_not_found), Response)
+        assert client.get('/wps').status_code == 404
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+        lines = response.get_data(as_text=True).splitlines()
+        assert 'c3s_magic_wps_phase_seconds_count{phase="diagnostic",process="blocking"} 1' in lines
+        assert 'c3s_magic_wps_cache_hit_ratio{cache="result"} 0.75' in lines
+        assert 'c3s_magic_wps_esmvaltool_waiting_jobs{lane="short"} 0' in lines
+        assert 'c3s_magic_wps_disk_usage_bytes{folder="outputs"} 100' in lines
+        assert 'c3s_magic_wps_jobs_queued 0' in lines
+
+        metrics.write_scrape_file(str(tmpdir.join('c3s_magic_wps.prom')))
+        assert tmpdir.join('c3s_magic_wps.prom').read().splitlines()[:2] == lines[:2]
+    finally:
+        for (section, option, _), value in zip(settings, previous):
+            configuration.CONFIG.set(section, option, value or '')
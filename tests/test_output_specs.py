@@ -0,0 +1,65 @@
+import os
+
+from c3s_magic_wps import runner
+from c3s_magic_wps.processes.utils import OutputSpec, collect_outputs
+from c3s_magic_wps.processes.wps_blocking import Blocking
+
+
+class FakeOutput():
+    def __init__(self):
+        self.file = None
+        self.output_format = None
+
+
+class FakeResponse():
+    def __init__(self, identifiers):
+        self.outputs = {identifier: FakeOutput() for identifier in identifiers}
+        self.status = []
+
+    def update_status(self, message, percentage):
+        self.status.append((message, percentage))
+
+
+def _result(tmpdir, files):
+    root = tmpdir.join('output', 'recipe_20190101_120000')
+    for path in files:
+        root.join(path).write('', ensure=True)
+    return dict(success=True, plot_dir=str(root.join('plots')), work_dir=str(root.join('work')))
+
+
+def test_collect_outputs(tmpdir, monkeypatch):
+    monkeypatch.setattr(runner, 'compress_output', lambda output_dir, archive_file, **kwargs: archive_file)
+    subdir = os.path.join('ACCESS1-0', 'historical', 'r1i1p1', '1980-1989', 'DJF', 'Block')
+    result = _result(tmpdir, [
+        os.path.join('plots', 'miles_diagnostics', 'miles_block', subdir, 'Z500_ACCESS1-0.png'),
+        os.path.join('plots', 'miles_diagnostics', 'miles_block', subdir, 'BlockEvents_ACCESS1-0.png'),
+        os.path.join('work', 'miles_diagnostics', 'miles_block', subdir, 'BlockFull_ACCESS1-0.nc'),
+    ])
+
+    process = Blocking()
+    response = FakeResponse([spec.identifier for spec in process.output_specs] + ['archive'])
+    collect_outputs(response, result, process.output_specs, str(tmpdir.join('output')),
+                    str(tmpdir.join('blocking_result.zip')), subdir=subdir)
+
+    assert response.outputs['z500_plot'].file.endswith('Z500_ACCESS1-0.png')
+    assert response.outputs['z500_plot'].output_format.mime_type == 'image/png'
+    assert response.outputs['blockevents_plot'].file.endswith('BlockEvents_ACCESS1-0.png')
+    assert response.outputs['data_full'].file.endswith('BlockFull_ACCESS1-0.nc')
+    assert response.outputs['data_clim'].file is None
+    assert response.outputs['archive'].file == str(tmpdir.join('blocking_result.zip'))
+    assert 'data_clim' in response.status[-1][0]
+    percentages = [percentage for _, percentage in response.status]
+    assert percentages == sorted(percentages)
+
+
+def test_collect_outputs_failed(tmpdir, monkeypatch):
+    monkeypatch.setattr(runner, 'compress_output', lambda output_dir, archive_file, **kwargs: archive_file)
+    result = _result(tmpdir, ['plots/main/plot.png'])
+    result.update(success=False, exception='diagnostic failed')
+    specs = [OutputSpec('plot', 'plot', 'main', '*', 'png')]
+
+    response = FakeResponse(['plot', 'archive'])
+    collect_outputs(response, result, specs, str(tmpdir.join('output')), str(tmpdir.join('result.zip')))
+    assert response.outputs['plot'].file is None
+    assert response.outputs['archive'].file == str(tmpdir.join('result.zip'))
+    assert response.status[-1] == ("exception occured: diagnostic failed", 90)
@@ -0,0 +1,144 @@
+import logging
+import os
+import sys
+import types
+
+from c3s_magic_wps.preproc_cache import PreprocCache, cached_task_run, enabled
+
+
+class Product():
+    def __init__(self, run_dir, input_file, dataset, settings=None):
+        self.filename = os.path.join(run_dir, 'preproc', 'diag', 'pr', 'CMIP5_{}_pr.nc'.format(dataset))
+        self.files = [input_file]
+        self.attributes = dict(project='CMIP5', dataset=dataset, exp='historical', ensemble='r1i1p1', mip='Amon',
+                               short_name='pr', start_year=2000, end_year=2005, filename=self.filename)
+        self.settings = settings or dict(regrid=dict(target_grid='2.5x2.5'), save=dict(filename=self.filename))
+
+
+class Task():
+    write_ncl_interface = False
+
+    def __init__(self, products):
+        self.products = set(products)
+
+
+def _preprocess(task, input_files):
+    for product in task.products:
+        os.makedirs(os.path.dirname(product.filename), exist_ok=True)
+        with open(product.filename, 'w') as fp:
+            fp.write(product.attributes['dataset'])
+    _preprocess.runs.append(sorted(product.attributes['dataset'] for product in task.products))
+
+
+def _write_metadata(products, write_ncl_interface):
+    return sorted(product.filename for product in products)
+
+
+def test_preproc_cache(tmpdir):
+    input_file = tmpdir.join('archive', 'pr.nc')
+    input_file.write('input', ensure=True)
+    cache = PreprocCache(str(tmpdir.join('cache')), max_size=1024)
+    _preprocess.runs = []
+
+    run_dir = str(tmpdir.join('job1', 'output', 'recipe_1'))
+    task = Task([Product(run_dir, str(input_file), 'A'), Product(run_dir, str(input_file), 'B')])
+    run = cached_task_run(cache, _preprocess, _write_metadata, run_dir)
+    assert len(run(task, [])) == 2
+    assert _preprocess.runs == [['A', 'B']]
+
+    # another job only preprocesses the dataset which is not cached
+    run_dir = str(tmpdir.join('job2', 'output', 'recipe_2'))
+    task = Task([Product(run_dir, str(input_file), 'A'), Product(run_dir, str(input_file), 'C')])
+    run = cached_task_run(cache, _preprocess, _write_metadata, run_dir)
+    metadata = run(task, [])
+    assert _preprocess.runs == [['A', 'B'], ['C']]
+    assert len(metadata) == 2 and len(task.products) == 2
+    with open(os.path.join(run_dir, 'preproc', 'diag', 'pr', 'CMIP5_A_pr.nc')) as fp:
+        assert fp.read() == 'A'
+
+    # other preprocessor settings are not restored
+    product = Product(run_dir, str(input_file), 'A', settings=dict(regrid=dict(target_grid='1x1')))
+    assert cache.key(product, run_dir) != cache.key(Product(run_dir, str(input_file), 'A'), run_dir)
+
+    # multi model tasks are never cached
+    task = Task([Product(run_dir, str(input_file), 'A', settings=dict(multi_model_statistics={}))])
+    cached_task_run(cache, _preprocess, _write_metadata, run_dir)(task, [])
+    assert _preprocess.runs[-1] == ['A']
+
+
+def test_preproc_cache_evict(tmpdir):
+    cache = PreprocCache(str(tmpdir.join('cache')), max_size=10)
+    for key in ['a', 'b']:
+        tmpdir.join(key + '.nc').write('123456')
+        cache.store(key, str(tmpdir.join(key + '.nc')))
+    # each entry is 6 bytes, so only the most recent one fits
+    assert os.listdir(str(tmpdir.join('cache'))) == ['b.nc']
+
+
+class PreprocessingTask():
+    """Stands in for the PreprocessingTask of esmvaltool 2.0a2."""
+    def __init__(self, products, write_ncl_interface=False):
+        self.products = set(products)
+        self.write_ncl_interface = write_ncl_interface
+
+    def _run(self, input_files):
+        for product in self.products:
+            os.makedirs(os.path.dirname(product.filename), exist_ok=True)
+            with open(product.filename, 'w') as fp:
+                fp.write(product.attributes['dataset'])
+        return _write_metadata_file(self.products, self.write_ncl_interface)
+
+
+def _write_metadata_file(products, write_ncl=False):
+    filename = os.path.join(os.path.dirname(next(iter(products)).filename), 'metadata.txt')
+    with open(filename, 'w') as fp:
+        fp.write(' '.join(sorted(product.attributes['dataset'] for product in products)))
+    return [filename]
+
+
+def _fake_esmvaltool(monkeypatch, version='2.0a2'):
+    preprocessor = types.ModuleType('esmvaltool.preprocessor')
+    preprocessor.PreprocessingTask = PreprocessingTask
+    preprocessor.write_metadata = _write_metadata_file
+    esmvaltool = types.ModuleType('esmvaltool')
+    esmvaltool.__version__ = version
+    esmvaltool.preprocessor = preprocessor
+    monkeypatch.setitem(sys.modules, 'esmvaltool', esmvaltool)
+    monkeypatch.setitem(sys.modules, 'esmvaltool.preprocessor', preprocessor)
+
+
+def _run_job(tmpdir, job, cache):
+    input_file = tmpdir.join('archive', 'pr.nc')
+    input_file.write('input', ensure=True)
+    run_dir = tmpdir.join(job, 'output', 'recipe_1')
+    task = PreprocessingTask([Product(str(run_dir), str(input_file), dataset) for dataset in 'AB'])
+    with enabled(cache, str(run_dir)):
+        task._run([])
+    return {path.relto(run_dir): path.read() for path in run_dir.visit() if path.isfile()}
+
+
+def test_enabled_outputs(tmpdir, monkeypatch):
+    _fake_esmvaltool(monkeypatch)
+    cache = PreprocCache(str(tmpdir.join('cache')), max_size=1024)
+    uncached = _run_job(tmpdir, 'job1', None)
+    assert len(uncached) == 3
+    # the first cached job fills the cache, the second one restores from it
+    assert _run_job(tmpdir, 'job2', cache) == uncached
+    assert len(os.listdir(str(tmpdir.join('cache')))) == 2
+    assert _run_job(tmpdir, 'job3', cache) == uncached
+    assert PreprocessingTask._run.__qualname__ == 'PreprocessingTask._run'
+
+
+def test_enabled_unsupported(tmpdir, monkeypatch, caplog):
+    _fake_esmvaltool(monkeypatch, version='2.1.0')
+    cache = PreprocCache(str(tmpdir.join('cache')), max_size=1024)
+    original = PreprocessingTask._run
+    with caplog.at_level(logging.WARNING, logger='PYWPS'):
+        with enabled(cache, str(tmpdir)):
+            assert PreprocessingTask._run is original
+    assert 'esmvaltool 2.1.0 is not supported' in caplog.text
+
+    monkeypatch.delattr(sys.modules['esmvaltool.preprocessor'], 'write_metadata')
+    sys.modules['esmvaltool'].__version__ = '2.0a2'
+    with enabled(cache, str(tmpdir)):
+        assert PreprocessingTask._run is original
@@ -0,0 +1,85 @@
+import os
+import pstats
+
+import pytest
+from pywps import FORMATS, ComplexOutput, Format, Process, Service, configuration
+
+from c3s_magic_wps import runner
+from c3s_magic_wps.processes.utils import collect_outputs, default_outputs
+from c3s_magic_wps.profiling import PSTATS_FILE, is_enabled, profiled
+
+from .common import client_for, load_default_config
+
+
+def _busy_diagnostic():
+    total = 0
+    for _ in range(200):
+        total += sum(i * i for i in range(5000))
+    return total
+
+
+def test_profiled(tmpdir):
+    with profiled(str(tmpdir), interval=0.001) as collapsed_file:
+        _busy_diagnostic()
+
+    stacks = [line.rsplit(' ', 1) for line in open(collapsed_file).read().splitlines()]
+    assert stacks
+    assert any('_busy_diagnostic (test_profiling.py:' in stack for stack, _ in stacks)
+    assert all(int(count) > 0 for _, count in stacks)
+
+    stats = pstats.Stats(str(tmpdir.join(PSTATS_FILE)))
+    assert any(function == '_busy_diagnostic' for _, _, function in stats.stats)
+
+
+class ProfiledProcess(Process):
+    """Process with the default outputs, collecting the outputs of a finished esmvaltool run."""
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        outputs = [
+            *default_outputs(),
+            ComplexOutput('archive', 'Archive', as_reference=True, supported_formats=[Format('application/zip')]),
+        ]
+        super(ProfiledProcess, self).__init__(self._handler, identifier='profiled', title='Profiled', outputs=outputs)
+
+    def _handler(self, request, response):
+        run_dir = os.path.join(self.output_dir, 'recipe', 'run')
+        os.makedirs(run_dir)
+        result = dict(success=True, plot_dir=os.path.join(self.output_dir, 'recipe', 'plots'))
+        response.outputs['success'].data = 'True'
+        for identifier in ('recipe', 'log', 'debug_log'):
+            response.outputs[identifier].output_format = FORMATS.TEXT
+            response.outputs[identifier].file = os.path.join(run_dir, identifier + '.txt')
+            open(response.outputs[identifier].file, 'w').close()
+        collect_outputs(response, result, [], self.output_dir, os.path.join(self.output_dir, 'result.zip'))
+        return response
+
+
+@pytest.mark.parametrize('value,enabled', [('false', False), ('0', False), ('no', False), ('off', False), ('', False),
+                                           ('true', True), ('1', True), ('yes', True), ('On', True)])
+def test_is_enabled(value, enabled):
+    try:
+        configuration.CONFIG.set('profiling', 'enabled', value)
+        assert is_enabled() == enabled
+    finally:
+        load_default_config()
+
+
+@pytest.mark.parametrize('enabled', [False, True])
+def test_profile_output(tmpdir, monkeypatch, enabled):
+    monkeypatch.setattr(runner, 'compress_output', lambda output_dir, archive_file, **kwargs: archive_file)
+    load_default_config()
+    configuration.CONFIG.set('server', 'outputpath', str(tmpdir.join('outputs')))
+    configuration.CONFIG.set('profiling', 'enabled', 'true' if enabled else '')
+    try:
+        tmpdir.join('output').ensure(dir=True)
+        tmpdir.join('output', 'result.zip').write('zip')
+        client = client_for(Service(processes=[ProfiledProcess(str(tmpdir.join('output')))]))
+        response = client.get(service='WPS', request='Execute', version='1.0.0', identifier='profiled')
+        document = response.data.decode('utf-8')
+    finally:
+        load_default_config()
+
+    # an output without a file would be an empty reference, which clients cannot download
+    assert 'ProcessSucceeded' in document
+    assert 'href=""' not in document
+    assert ('<ows:Identifier>profile</ows:Identifier>' in document) == enabled
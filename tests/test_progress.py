@@ -0,0 +1,86 @@
+import sqlite3
+
+from c3s_magic_wps.progress import RunProgress
+from c3s_magic_wps.runtimes import RuntimeStore
+
+RECIPE = {
+    'diagnostics': {
+        'blocking': {
+            'variables': {'zg': {}, 'ta': {}},
+            'scripts': {'main': {}},
+        },
+    },
+}
+
+
+class FakeResponse():
+    def __init__(self):
+        self.status = []
+
+    def update_status(self, message, percentage):
+        self.status.append((message, percentage))
+
+
+def _log(tmpdir, *tasks):
+    log = tmpdir.join('output', 'recipe_20190101_120000', 'run', 'main_log.txt')
+    log.write(''.join('INFO Successfully completed task {} (priority 0) in 0:01:00\n'.format(task) for task in tasks),
+              mode='a', ensure=True)
+
+
+def test_run_progress(tmpdir):
+    response = FakeResponse()
+    expected = {'preprocess': 600, 'diagnostic': 600, 'collect': 30, 'archive': 30}
+    tracker = RunProgress(response, str(tmpdir.join('output')), RECIPE, expected, start=20, end=80)
+    tracker.started = 0
+
+    tracker.update(now=60)
+    assert response.status[-1] == ("running diagnostic: preprocessing, 0 of 2 tasks done, about 20 minutes left ...",
+                                   23)
+
+    # a completed task moves the progress on
+    _log(tmpdir, 'blocking/zg')
+    tracker.update(now=120)
+    assert response.status[-1][1] == 35
+
+    _log(tmpdir, 'blocking/ta')
+    tracker.update(now=300)
+    assert tracker.preprocessed == 300
+    assert response.status[-1] == ("running diagnostic: running diagnostic scripts, 0 of 1 done, about 11 minutes left"
+                                   " ...", 50)
+
+    tracker.update(now=1000)
+    assert response.status[-1][0].endswith("taking longer than usual ...")
+    percentages = [percentage for _, percentage in response.status]
+    assert percentages == sorted(percentages)
+    assert max(percentages) < 80
+
+
+def test_run_progress_without_history(tmpdir):
+    response = FakeResponse()
+    tracker = RunProgress(response, str(tmpdir.join('output')), RECIPE, {'run': None})
+    tracker.started = 0
+    tracker.update(now=60)
+    assert response.status == [("running diagnostic: preprocessing, 0 of 2 tasks done ...", 20)]
+
+
+def test_runtime_store_phases(tmpdir):
+    store = RuntimeStore(str(tmpdir.join('runtimes.sqlite')))
+    store.record('blocking', 10, 100, phase='preprocess')
+    store.record('blocking', 10, 50, phase='diagnostic')
+    phases = store.estimate_phases('blocking', 20)
+    assert phases['preprocess'] == 200
+    assert phases['diagnostic'] == 100
+    assert phases['run'] is None
+
+
+def test_runtime_store_migration(tmpdir):
+    path = str(tmpdir.join('runtimes.sqlite'))
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute('CREATE TABLE runs (process TEXT NOT NULL, size REAL NOT NULL, seconds REAL NOT NULL, '
+                           'finished REAL NOT NULL)')
+        connection.execute("INSERT INTO runs VALUES ('blocking', 10, 100, 0)")
+    connection.close()
+    store = RuntimeStore(path)
+    assert store.estimate('blocking', 10) == 100
+    assert store.estimate('blocking', 10, phase='preprocess') is None
@@ -0,0 +1,141 @@
+import os
+import shutil
+
+from pywps import configuration
+
+from c3s_magic_wps import result_cache, runner
+from c3s_magic_wps.result_cache import ResultCache
+
+from .common import load_default_config
+
+RECIPE = """
+datasets:
+  - {{dataset: ACCESS1-0, project: CMIP5, exp: historical, ensemble: r1i1p1}}
+diagnostics:
+  diag:
+    variables:
+      zg:
+        mip: day
+    scripts:
+      script:
+        script: {workdir}/script.py
+"""
+
+CONFIG = """
+output_dir: {workdir}/output
+rootpath:
+  CMIP5: {archive}
+"""
+
+
+def _write_recipe(workdir, archive):
+    workdir.ensure(dir=True)
+    recipe_file = workdir.join('recipe.yml')
+    recipe_file.write(RECIPE.format(workdir=workdir))
+    config_file = workdir.join('config.yml')
+    config_file.write(CONFIG.format(workdir=workdir, archive=archive))
+    return str(recipe_file), str(config_file)
+
+
+def _write_output(output_dir):
+    output_dir.join('recipe', 'run', 'main_log.txt').write('log', ensure=True)
+    output_dir.join('recipe', 'plots', 'diag', 'script', 'plot.png').write('png', ensure=True)
+    output_dir.join('recipe', 'work').ensure(dir=True)
+    run_dir = output_dir.join('recipe', 'run')
+    return dict(success=True,
+                exception=None,
+                logfile=str(run_dir.join('main_log.txt')),
+                debug_logfile=str(run_dir.join('main_log_debug.txt')),
+                plot_dir=str(output_dir.join('recipe', 'plots')),
+                work_dir=str(output_dir.join('recipe', 'work')),
+                run_dir=str(run_dir))
+
+
+def test_result_cache(tmpdir):
+    archive = tmpdir.join('archive')
+    data_file = archive.join('CSIRO-BOM', 'ACCESS1-0', 'historical', 'day', 'atmos', 'day', 'r1i1p1', 'zg',
+                             'zg_day.nc')
+    data_file.write('data', ensure=True)
+    cache = ResultCache(str(tmpdir.join('cache')), max_size=1024)
+
+    recipe_file, config_file = _write_recipe(tmpdir.join('job1'), archive)
+    key = cache.key(recipe_file, config_file)
+    assert cache.restore(key, str(tmpdir.join('job1', 'output'))) is None
+
+    result = _write_output(tmpdir.join('job1', 'output'))
+    cache.store(key, str(tmpdir.join('job1', 'output')), result)
+
+    # the same recipe in another workdir uses the cached result
+    recipe_file, config_file = _write_recipe(tmpdir.join('job2'), archive)
+    assert cache.key(recipe_file, config_file) == key
+    restored = cache.restore(key, str(tmpdir.join('job2', 'output')))
+    assert restored['plot_dir'] == str(tmpdir.join('job2', 'output', 'recipe', 'plots'))
+    assert tmpdir.join('job2', 'output', 'recipe', 'plots', 'diag', 'script', 'plot.png').read() == 'png'
+
+    # changed input data invalidates the result
+    stat = os.stat(str(data_file))
+    os.utime(str(data_file), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.key(recipe_file, config_file) != key
+
+    assert cache.key(recipe_file, config_file, skip_nonexistent=True) != cache.key(recipe_file, config_file)
+
+
+def test_result_cache_evict(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')), max_size=10)
+
+    for n, key in enumerate(['a', 'b']):
+        result = _write_output(tmpdir.join('job{}'.format(n), 'output'))
+        cache.store(key, str(tmpdir.join('job{}'.format(n), 'output')), result)
+
+    # each entry is 6 bytes, so only the most recent one fits
+    assert sorted(os.listdir(str(tmpdir.join('cache')))) == ['b']
+
+
+def test_result_cache_restore_failure(tmpdir, monkeypatch):
+    cache = ResultCache(str(tmpdir.join('cache')), max_size=1024)
+    result = _write_output(tmpdir.join('job1', 'output'))
+    cache.store('a', str(tmpdir.join('job1', 'output')), result)
+
+    def copy_part(src, dst):
+        shutil.copytree(os.path.join(src, 'recipe', 'run'), os.path.join(dst, 'recipe', 'run'))
+        raise OSError('No space left on device')
+
+    # a failed copy leaves nothing behind for esmvaltool to run into
+    monkeypatch.setattr(result_cache, '_copy_tree', copy_part)
+    tmpdir.join('job2').ensure(dir=True)
+    assert cache.restore('a', str(tmpdir.join('job2', 'output'))) is None
+    assert tmpdir.join('job2').listdir() == []
+
+
+def test_run_caches_archive(tmpdir, monkeypatch):
+    load_default_config()
+    configuration.CONFIG.set('server', 'workdir', str(tmpdir))
+    configuration.CONFIG.set('cache', 'result_dir', str(tmpdir.join('cache')))
+    archive = tmpdir.join('archive')
+    archive.join('CSIRO-BOM', 'ACCESS1-0', 'historical', 'day', 'atmos', 'day', 'r1i1p1', 'zg', 'zg_day.nc').write(
+        'data', ensure=True)
+    runs = []
+
+    def fake_run(recipe_file, config_file, skip_nonexistent=False):
+        runs.append(recipe_file)
+        return _write_output(tmpdir.join(os.path.basename(os.path.dirname(config_file)), 'output'))
+
+    monkeypatch.setattr(runner, '_run', fake_run)
+    try:
+        recipe_file, config_file = _write_recipe(tmpdir.join('job1'), archive)
+        first = runner.run(recipe_file, config_file)
+        assert first['cache_key']
+        runner.compress_output(str(tmpdir.join('job1', 'output')), str(tmpdir.join('job1', 'result.zip')),
+                               result=first)
+        assert tmpdir.join('cache', first['cache_key'], 'archive.zip').check()
+
+        # the second job restores the result and the archive of the first one
+        recipe_file, config_file = _write_recipe(tmpdir.join('job2'), archive)
+        second = runner.run(recipe_file, config_file)
+        assert second['cache_key'] == first['cache_key']
+        assert len(runs) == 1
+        runner.compress_output(str(tmpdir.join('job2', 'output')), str(tmpdir.join('job2', 'result.zip')),
+                               result=second)
+        assert tmpdir.join('job2', 'result.zip').read_binary() == tmpdir.join('job1', 'result.zip').read_binary()
+    finally:
+        load_default_config()
@@ -0,0 +1,198 @@
+import threading
+import time
+
+from pywps import configuration
+
+from c3s_magic_wps import runner
+from c3s_magic_wps.runtimes import RuntimeStore, get_runtime_store
+from c3s_magic_wps.scheduler import (CpuBudget, JobQueue, count_tasks, default_slots, get_cpu_budget, get_job_queue,
+                                     job_size, reserve_cpus)
+
+from .common import load_default_config
+
+
+def test_count_tasks():
+    recipe = {
+        'datasets': [{'dataset': 'A'}, {'dataset': 'B'}],
+        'diagnostics': {
+            'first': {
+                'variables': {'tas': None, 'pr': {'additional_datasets': [{'dataset': 'OBS'}]}},
+                'scripts': {'main': {}, 'plot': {}},
+            },
+            'second': {
+                'additional_datasets': [{'dataset': 'C'}],
+                'variables': {'ta': {}},
+                'scripts': None,
+            },
+        },
+    }
+    assert count_tasks(recipe) == 2 + 3 + 2 + 3
+
+
+def test_cpu_budget(tmpdir):
+    budget = CpuBudget(str(tmpdir), 3)
+    first = budget.acquire(2)
+    assert first.count == 2
+    # only the free slot is handed out
+    with budget.acquire(4) as second:
+        assert second.count == 1
+    first.release()
+    with budget.acquire(4) as third:
+        assert third.count == 3
+
+
+def test_max_parallel_tasks(tmpdir):
+    load_default_config()
+    configuration.CONFIG.set('esmvaltool', 'cpu_budget', '2')
+    configuration.CONFIG.set('esmvaltool', 'cpu_budget_dir', str(tmpdir.join('cpus')))
+    try:
+        _, config_file = runner.generate_recipe('miles_blocking', workdir=str(tmpdir))
+        with open(config_file) as fp:
+            assert 'max_parallel_tasks: 2\n' in fp.read()
+
+        # with one cpu used by another job, the job runs a single task
+        busy = CpuBudget(str(tmpdir.join('cpus')), 2).acquire(1)
+        with reserve_cpus(config_file) as reservation:
+            assert reservation.count == 1
+        busy.release()
+        with open(config_file) as fp:
+            assert 'max_parallel_tasks: 1\n' in fp.read()
+    finally:
+        configuration.CONFIG.set('esmvaltool', 'cpu_budget', '0')
+        configuration.CONFIG.set('esmvaltool', 'cpu_budget_dir', '')
+
+
+def test_shared_files_in_workdir(tmpdir):
+    load_default_config()
+    configuration.CONFIG.set('server', 'workdir', str(tmpdir))
+    try:
+        assert get_cpu_budget().lock_dir == str(tmpdir.join('c3s_magic_wps-cpus'))
+        assert get_job_queue().queue_dir == str(tmpdir.join('c3s_magic_wps-queue'))
+        assert get_runtime_store().path == str(tmpdir.join('c3s_magic_wps-runtimes.sqlite'))
+    finally:
+        load_default_config()
+
+
+def test_job_size():
+    recipe = {
+        'datasets': [{'dataset': 'A', 'start_year': 1980, 'end_year': 1989}],
+        'diagnostics': {
+            'first': {
+                'variables': {
+                    'tas': None,
+                    'pr': {'start_year': 2000, 'end_year': 2004, 'additional_datasets': [{'dataset': 'OBS'}]},
+                },
+            },
+        },
+    }
+    assert job_size(recipe) == 10 + 10 + 5
+    assert job_size({}) == 1
+
+
+def test_runtime_store(tmpdir):
+    store = RuntimeStore(str(tmpdir.join('runtimes.sqlite')))
+    assert store.estimate('blocking', 10, default=60) == 60
+    store.record('blocking', 10, 100)
+    store.record('blocking', 20, 400)
+    store.record('blocking', 10, 200)
+    # the median runtime per year, 20 seconds, times the size
+    assert store.estimate('blocking', 5) == 100
+    assert store.estimate('zmnam', 5) is None
+
+
+def test_job_queue(tmpdir):
+    queue = JobQueue(str(tmpdir), {'short': 1, 'long': 0}, long_job_seconds=600)
+    assert queue.lane(599) == 'short'
+    assert queue.lane(600) == 'long'
+    assert queue.lane(None) == 'long'
+    # the long lane is not limited
+    with queue.admit('cvdp', 1, None) as job:
+        assert job.lane == 'long'
+
+    running = queue.admit('first', 1, 10, poll_interval=0.01)
+    admitted = []
+
+    def wait(process, estimate):
+        with queue.admit(process, 1, estimate, poll_interval=0.01):
+            admitted.append(process)
+
+    threads = [threading.Thread(target=wait, args=('slow', 300))]
+    threads[0].start()
+    while not queue.waiting():
+        time.sleep(0.01)
+    threads.append(threading.Thread(target=wait, args=('quick', 10)))
+    threads[1].start()
+    while len(queue.waiting('short')) < 2:
+        time.sleep(0.01)
+    # shorter jobs go first
+    assert queue.waiting() == ['quick', 'slow']
+
+    running.release()
+    for thread in threads:
+        thread.join(10)
+    assert admitted == ['quick', 'slow']
+    assert queue.waiting() == []
+
+
+def test_default_slots(tmpdir):
+    load_default_config()
+    configuration.CONFIG.set('server', 'workdir', str(tmpdir))
+    try:
+        assert get_job_queue().slots == {'short': 1, 'long': 1}
+        configuration.CONFIG.set('server', 'parallelprocesses', '5')
+        assert default_slots() == {'short': 3, 'long': 2}
+        configuration.CONFIG.set('scheduler', 'long_slots', '0')
+        assert get_job_queue().slots == {'short': 3, 'long': 0}
+    finally:
+        load_default_config()
+
+
+def test_job_queue_long_job_ahead_of_short_jobs(tmpdir):
+    load_default_config()
+    queue = JobQueue(str(tmpdir), default_slots(), long_job_seconds=600)
+    running = queue.admit('cvdp', 1, 3600)
+    admitted = []
+
+    def wait():
+        with queue.admit('blocking', 1, 1800, poll_interval=0.01):
+            admitted.append('blocking')
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    while not queue.waiting('long'):
+        time.sleep(0.01)
+
+    # the short jobs queued after the long one do not wait for it
+    for process in ('zmnam', 'meta'):
+        with queue.admit(process, 1, 10, poll_interval=0.01) as job:
+            assert job.lane == 'short'
+            admitted.append(process)
+    assert queue.waiting() == ['blocking']
+
+    running.release()
+    thread.join(10)
+    assert admitted == ['zmnam', 'meta', 'blocking']
+
+
+def test_run_records_phases(tmpdir, monkeypatch):
+    load_default_config()
+    configuration.CONFIG.set('server', 'workdir', str(tmpdir))
+    try:
+        recipe_file, config_file = runner.generate_recipe('miles_blocking', workdir=str(tmpdir.mkdir('job')))
+        output_dir = tmpdir.join('job', 'output')
+        output_dir.join('recipe', 'plots', 'plot.png').write('png', ensure=True)
+
+        def fake_run(recipe_file, config_file, skip_nonexistent=False):
+            return dict(success=True, plot_dir=str(output_dir.join('recipe', 'plots')))
+
+        monkeypatch.setattr(runner, '_run', fake_run)
+        result = runner.run(recipe_file, config_file, use_cache=False)
+        # the job is returned with the result, for the phases recorded after the run
+        assert result['job'][0] == 'recipe'
+        runner.compress_output(str(output_dir), str(tmpdir.join('job', 'result.zip')), result=result)
+        runner.compress_output(str(output_dir), str(tmpdir.join('job', 'restored.zip')))
+
+        phases = [(process, phase) for process, phase, _ in get_runtime_store().runs()]
+        assert sorted(phases) == [('recipe', 'archive'), ('recipe', 'recipe'), ('recipe', 'run')]
+    finally:
+        load_default_config()
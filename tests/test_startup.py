@@ -0,0 +1,109 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import psutil
+import pytest
+
+import c3s_magic_wps
+from c3s_magic_wps import importtime
+from c3s_magic_wps.wsgi import LazyApplication
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     six
+import time:      2000 |       2000 |       sqlalchemy.sql
+import time:      1000 |       3000 |     sqlalchemy
+import time:       500 |       3500 |   pywps.dblog
+import time:       300 |       3920 | pywps
+"""
+
+
+def _imported_modules(module):
+    script = 'import sys; import {}; print(" ".join(sys.modules))'.format(module)
+    return subprocess.check_output([sys.executable, '-c', script], universal_newlines=True).split()
+
+
+def test_cli_imports_only_click():
+    modules = _imported_modules('c3s_magic_wps.cli')
+    for module in ('pywps', 'jinja2', 'psutil', 'c3s_magic_wps.processes', 'c3s_magic_wps.runner'):
+        assert module not in modules
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='the processes are imported with the package on Python 3.6')
+def test_data_finder_does_not_import_processes():
+    modules = _imported_modules('c3s_magic_wps.processes.utils.data_finder')
+    assert not [module for module in modules if module.startswith('c3s_magic_wps.processes.wps_')]
+
+
+def test_process_classes():
+    script = 'from c3s_magic_wps.processes import *; from c3s_magic_wps.processes import Blocking; print(Blocking)'
+    output = subprocess.check_output([sys.executable, '-c', script], universal_newlines=True)
+    assert output.strip() == "<class 'c3s_magic_wps.processes.wps_blocking.Blocking'>"
+
+
+def test_lazy_application():
+    created = []
+
+    def app(environ, start_response):
+        start_response('200 OK', [])
+        return [b'ok']
+
+    def factory():
+        created.append(app)
+        return app
+
+    application = LazyApplication(factory)
+    assert not created
+    assert application({}, lambda status, headers: None) == [b'ok']
+    assert application({}, lambda status, headers: None) == [b'ok']
+    assert application.load() is app
+    assert len(created) == 1
+
+
+def test_parse_importtime():
+    imports = importtime.parse(IMPORTTIME_OUTPUT)
+    assert [item.module for item in imports] == ['six', 'sqlalchemy.sql', 'sqlalchemy', 'pywps.dblog', 'pywps']
+    assert imports[2] == importtime.Import('sqlalchemy', 0.001, 0.003)
+    packages = importtime.by_package(imports)
+    assert [package for package, _ in packages] == ['sqlalchemy', 'pywps', 'six']
+    assert abs(packages[0][1] - 0.003) < 1e-9
+
+
+def test_measure():
+    report = importtime.measure('c3s_magic_wps.importtime')
+    assert report.module == 'c3s_magic_wps.importtime'
+    assert 0 < report.seconds < 10
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_start_server_daemon(tmpdir):
+    pytest.importorskip('gunicorn')
+    command = [sys.executable, '-m', 'c3s_magic_wps.cli', '--server', '--daemon', '--workers', '1',
+               '--port', str(_free_port()), '--rootpath', str(tmpdir)]
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(c3s_magic_wps.__file__)))
+    # the command returns when the service detached
+    subprocess.run(command, cwd=str(tmpdir), env=env, timeout=60, check=True)
+    pid_file = tmpdir.join('pywps.pid')
+    for _ in range(300):
+        if pid_file.check() and pid_file.read().strip():
+            break
+        time.sleep(0.1)
+    pid = int(pid_file.read())
+    try:
+        assert psutil.Process(pid).is_running()
+        assert pid != os.getpid()
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        for _ in range(100):
+            if not psutil.pid_exists(pid):
+                break
+            time.sleep(0.1)
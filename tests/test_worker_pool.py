@@ -0,0 +1,102 @@
+import os
+import subprocess
+import time
+
+import psutil
+from pywps import configuration
+
+from c3s_magic_wps.worker_pool import WorkerPool, get_worker_pool, stop_worker_pool
+
+from .common import load_default_config
+
+
+def _job(recipe_file, config_file, skip_nonexistent):
+    if recipe_file == 'crash':
+        os._exit(1)
+    if recipe_file == 'sleep':
+        time.sleep(10)
+    if recipe_file == 'orphan':
+        # like the diagnostic scripts started by esmvaltool
+        script = subprocess.Popen(['sleep', '60'])
+        with open(config_file, 'w') as fp:
+            fp.write(str(script.pid))
+        time.sleep(10)
+    if recipe_file == 'fail':
+        raise ValueError('recipe failed')
+    return dict(success=True, exception=None, pid=os.getpid())
+
+
+def test_worker_pool(tmpdir):
+    config_file = str(tmpdir.join('config.yml'))
+    pool = WorkerPool(1, max_jobs=2, time_limit=2, target=_job)
+    try:
+        first = pool.run('recipe', config_file)
+        assert first['success']
+        assert first['pid'] != os.getpid()
+
+        # the worker is recycled after two jobs
+        assert pool.run('recipe', config_file)['pid'] == first['pid']
+        assert pool.run('recipe', config_file)['pid'] != first['pid']
+
+        result = pool.run('fail', config_file)
+        assert not result['success']
+        assert result['exception'] == 'recipe failed'
+        assert result['logfile'] == str(tmpdir.join('output', 'run', 'main_log.txt'))
+
+        result = pool.run('crash', config_file)
+        assert not result['success']
+        assert result['exception'] == 'esmvaltool worker crashed'
+
+        result = pool.run('sleep', config_file)
+        assert not result['success']
+        assert 'time limit' in result['exception']
+
+        assert pool.run('recipe', config_file)['success']
+        assert pool.size() == 1
+    finally:
+        pool.close()
+
+
+def _running(pid):
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+def test_worker_pool_time_limit_kills_children(tmpdir):
+    config_file = str(tmpdir.join('config.yml'))
+    pool = WorkerPool(1, time_limit=2, target=_job)
+    try:
+        result = pool.run('orphan', config_file)
+        assert 'time limit' in result['exception']
+        pid = int(tmpdir.join('config.yml').read())
+        for _ in range(50):
+            if not _running(pid):
+                break
+            time.sleep(0.1)
+        assert not _running(pid)
+    finally:
+        pool.close()
+
+
+def test_get_worker_pool_reload():
+    load_default_config()
+    try:
+        assert get_worker_pool() is None
+        configuration.CONFIG.set('esmvaltool', 'workers', '1')
+        pool = get_worker_pool()
+        assert pool.size() == 1
+        assert get_worker_pool() is pool
+
+        # the pool is replaced when the configuration changed
+        configuration.CONFIG.set('esmvaltool', 'workers', '2')
+        pool = get_worker_pool()
+        assert pool.size() == 2
+        configuration.CONFIG.set('esmvaltool', 'job_time_limit', '60')
+        assert get_worker_pool() is not pool
+        configuration.CONFIG.set('esmvaltool', 'workers', '0')
+        assert get_worker_pool() is None
+    finally:
+        stop_worker_pool()
+        load_default_config()
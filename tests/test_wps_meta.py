@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from pywps import Service
+from pywps.tests import assert_response_success
+
+from .common import client_for, get_output
+from c3s_magic_wps.processes.utils import DataFinder
+from c3s_magic_wps.processes.wps_meta import Meta
+
+
+@pytest.fixture
+def archive(tmpdir, monkeypatch):
+    tmpdir.join('MOHC', 'HadGEM2-ES', 'historical', 'day', 'atmos', 'day', 'r1i1p1', 'zg').ensure(dir=True)
+    tmpdir.join('MOHC', 'HadGEM2-ES', 'historical', 'mon', 'atmos', 'Amon', 'r1i1p1', 'pr').ensure(dir=True)
+    monkeypatch.setenv('CMIP_DATA_ROOT', str(tmpdir))
+    monkeypatch.delenv('CMIP_META_CACHE_FILE', raising=False)
+    monkeypatch.setattr(DataFinder, '_DataFinder__instance', None)
+    return tmpdir
+
+
+def test_wps_meta(archive):
+    client = client_for(Service(processes=[Meta()]))
+    resp = client.get(service='WPS', request='Execute', version='1.0.0', identifier='meta',
+                      datainputs='process=blocking')
+    assert_response_success(resp)
+
+    finder = DataFinder.get_instance()
+    assert (('zg', ), 'day') in finder._serialized
+
+    drs = json.loads(get_output(resp.xml)['drs'])
+    assert drs == finder.get_pruned_tree(required_variables=['zg'], required_frequency='day')
+    assert drs['contents'][0]['contents'][0]['contents'][0]['contents'][0]['name'] == 'day'